@@ -19,18 +19,33 @@ from __future__ import print_function
 
 import os
 import re
+import gzip
 import json
 import time
 import uuid
 import math
 import hashlib
 import logging
+import threading
+import zlib
 from datetime import datetime
 from collections import defaultdict
 
-import requests
 from dotenv import load_dotenv
 
+from event_log import EventWriter, iter_log_events
+from log_index import LogIndex
+from rollups import PERIODS, Rollups, summarize
+from event_codec import BinaryEventLog
+from live_dashboard import LiveDashboard
+from gigachat_client import GigaChatClient
+from llm_cache import LLMCache, make_key as llm_cache_key
+from llm_executor import LLMExecutor
+from llm_guard import BreakerPool, InFlight, RateLimiter
+from faq import FaqMatcher
+from model_router import ModelRouter, question_features
+from conversation_memory import ConversationMemory, compact_case
+
 from telegram import (
     Update, ReplyKeyboardMarkup, ReplyKeyboardRemove,
     InlineKeyboardMarkup, InlineKeyboardButton
@@ -39,6 +54,7 @@ from telegram.ext import (
     Updater, CommandHandler, MessageHandler, Filters,
     CallbackQueryHandler, CallbackContext
 )
+from telegram.error import BadRequest
 
 # -----------------------------
 # Config / Paths
@@ -57,6 +73,16 @@ KB_INDEX_PATH = os.path.join(DATA_DIR, "kb_index.json")
 STATE_FILE = os.path.join(DATA_DIR, "state.json")
 FEEDBACK_LOG = os.path.join(DATA_DIR, "feedback.jsonl")
 DIALOGS_LOG = os.path.join(DATA_DIR, "dialogs.jsonl")
+LOG_INDEX_PATH = os.path.join(DATA_DIR, "log_index.sqlite3")
+LLM_CACHE_PATH = os.path.join(DATA_DIR, "llm_cache.sqlite3")
+FAQ_ANSWERS_PATH = os.path.join(DATA_DIR, "faq_answers.json")
+MODEL_ROUTES_PATH = os.path.join(DATA_DIR, "model_routes.json")
+EVB_DIR = os.path.join(DATA_DIR, "evb")
+DASH_DIR = os.path.join(BASE_DIR, "dashboard")
+
+# Холодный архив состояний неактивных пользователей (gzip JSONL, сегмент на месяц)
+STATE_ARCHIVE_DIR = os.path.join(DATA_DIR, "state_archive")
+STATE_ARCHIVE_INDEX = os.path.join(STATE_ARCHIVE_DIR, "index.json")
 
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -65,6 +91,39 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # Админ (из .env или по умолчанию)
 ADMIN_IDS = []
 
+# Фоновый писатель dialogs.jsonl/feedback.jsonl (запускается в main())
+EVENT_WRITER = None
+# Индекс thread_id/answer_id -> user/chat (SQLite, обновляется писателем событий)
+LOG_INDEX = None
+# Общий клиент GigaChat с пулом соединений (создаётся в main())
+GIGACHAT = None
+# Кэш ответов GigaChat на диске (LLM_CACHE_TTL_HOURS=0 — выключен)
+LLM_CACHE = None
+# Потоковые ответы: заглушка сразу, затем правки по мере генерации (GIGACHAT_STREAM=0 — выключить)
+GIGACHAT_STREAM = True
+GIGACHAT_STREAM_EDIT_SEC = 1.0
+# Пул для ответов LLM (LLM_WORKERS, LLM_QUEUE_MAX); None — отвечать прямо в потоке диспетчера
+LLM_EXECUTOR = None
+# Автомат отключения GigaChat при сбоях и адаптивный таймаут (создаётся в init_gigachat())
+GIGACHAT_BREAKERS = None
+# Лимиты вызовов GigaChat: общий под квоту API и на пользователя (создаётся в init_gigachat())
+LLM_RATE_LIMITER = None
+# Одинаковые промпты, которые генерируются прямо сейчас: ждущие получают ответ лидера
+LLM_INFLIGHT = InFlight()
+# Вызовы с личным промптом (история треда, данные кейса) — мимо кэша и склейки, см. gigachat_call
+LLM_PERSONAL_CALLS = 0
+_LLM_PERSONAL_LOCK = threading.Lock()
+# Одобренные готовые ответы на частые вопросы (scripts/build_faq_answers.py), FAQ_ENABLED=0 — выключить
+FAQ_MATCHER = None
+# Выбор модели GigaChat по сложности вопроса и задержки по моделям (создаётся в init_gigachat())
+MODEL_ROUTER = None
+# Память треда для промпта: последние реплики + краткое содержание (MEMORY_TOKENS=0 — выключить)
+CONVERSATION_MEMORY = None
+
+# TTL неактивности пользователя в днях (STATE_TTL_DAYS, 0 — не выгружать)
+STATE_TTL_DAYS = 30
+STATE_EVICT_INTERVAL = 6 * 3600
+
 # -----------------------------
 # Logging
 # -----------------------------
@@ -90,6 +149,17 @@ def now_ts():
     return int(time.time())
 
 def safe_write_jsonl(path, event):
+    """Пишет событие в JSONL: через фоновую очередь, если она запущена, иначе сразу.
+    
+    Синхронная запись тоже идёт через EVENT_WRITER (если он создан), чтобы её
+    увидели слушатели — LOG_INDEX, rollups и живой дашборд.
+    """
+    if EVENT_WRITER is not None:
+        if EVENT_WRITER.running():
+            EVENT_WRITER.write(path, event)
+        else:
+            EVENT_WRITER.write_now(path, event)
+        return
     try:
         line = json.dumps(event, ensure_ascii=False)
         with open(path, "a", encoding="utf-8") as f:
@@ -97,6 +167,11 @@ def safe_write_jsonl(path, event):
     except Exception as e:
         logger.error("Failed to write to %s: %s", path, e)
 
+def flush_event_log():
+    """Дожидается записи очереди событий перед чтением логов с диска."""
+    if EVENT_WRITER is not None:
+        EVENT_WRITER.flush()
+
 def normalize_text(s):
     s = (s or "").strip().lower()
     s = re.sub(r"\s+", " ", s)
@@ -172,7 +247,9 @@ def build_feedback_keyboard(answer_id):
 # -----------------------------
 # State management (persistent to file)
 # -----------------------------
-STATE_LOCK = False
+# Файл состояния читают и пишут потоки диспетчера, воркеры LLM и job_queue:
+# чтение-изменение-запись целиком под STATE_LOCK
+STATE_LOCK = threading.RLock()
 
 def load_state():
     """Загружает состояние из файла."""
@@ -185,43 +262,202 @@ def load_state():
         return {}
 
 def save_state(state_dict):
-    """Сохраняет состояние в файл."""
-    global STATE_LOCK
-    if STATE_LOCK:
-        return
-    try:
-        STATE_LOCK = True
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(state_dict, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error("Failed to save state: %s", e)
-    finally:
-        STATE_LOCK = False
+    """Сохраняет состояние в файл (атомарно, через .tmp)."""
+    with STATE_LOCK:
+        try:
+            tmp = STATE_FILE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state_dict, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, STATE_FILE)
+        except Exception as e:
+            logger.error("Failed to save state: %s", e)
 
 def get_user_state_persistent(user_id):
     """Получает состояние пользователя из файла."""
-    state_dict = load_state()
-    user_key = str(user_id)
-    if user_key not in state_dict:
-        state_dict[user_key] = {
-            "branch": None,  # 115fz, zsk, 161fz, tax, bailiffs, no_reason
-            "case_data": {},  # собранные ответы
-            "asked_questions": [],  # список ID заданных вопросов
-            "last_bot_question_id": None,
-            "last_user_message_ts": None,
-            "dm_available": False,  # проверка возможности писать в личку
-            "last_chat_id": None,
-            "thread_id": None,  # для связи ответов
-        }
-        save_state(state_dict)
-    return state_dict[user_key], state_dict
+    with STATE_LOCK:
+        state_dict = load_state()
+        user_key = str(user_id)
+        if user_key not in state_dict:
+            # Пользователь мог быть выгружен в холодный архив — поднимаем обратно
+            archived = restore_archived_user(user_key)
+            if archived is not None:
+                state_dict[user_key] = archived
+                save_state(state_dict)
+                return state_dict[user_key], state_dict
+            state_dict[user_key] = {
+                "branch": None,  # 115fz, zsk, 161fz, tax, bailiffs, no_reason
+                "case_data": {},  # собранные ответы
+                "asked_questions": [],  # список ID заданных вопросов
+                "last_bot_question_id": None,
+                "last_user_message_ts": None,
+                "dm_available": False,  # проверка возможности писать в личку
+                "last_chat_id": None,
+                "thread_id": None,  # для связи ответов
+                "created_ts": now_ts(),
+            }
+            save_state(state_dict)
+        return state_dict[user_key], state_dict
 
 def update_user_state_persistent(user_id, updates):
     """Обновляет состояние пользователя в файле."""
-    user_state, state_dict = get_user_state_persistent(user_id)
-    user_state.update(updates)
-    state_dict[str(user_id)] = user_state
-    save_state(state_dict)
+    with STATE_LOCK:
+        user_state, state_dict = get_user_state_persistent(user_id)
+        user_state.update(updates)
+        state_dict[str(user_id)] = user_state
+        save_state(state_dict)
+
+# -----------------------------
+# Cold archive: выгрузка неактивных пользователей
+# -----------------------------
+# Выгрузка держит в state.json только активных пользователей, так что его размер
+# растёт с их числом, а не со всей историей. Сам файл по-прежнему читается и
+# перезаписывается целиком при каждом get/update состояния.
+def _archive_segment_path(ts):
+    """Путь к месячному сегменту архива: state-YYYY-MM.jsonl.gz."""
+    return os.path.join(STATE_ARCHIVE_DIR, "state-%s.jsonl.gz" % time.strftime("%Y-%m", time.gmtime(ts)))
+
+# Индекс архива в памяти: читается с диска один раз, дальше меняется только
+# через save_archive_index (все вызовы — под STATE_LOCK)
+_ARCHIVE_INDEX = None
+
+def load_archive_index():
+    """Индекс архива: user_id -> [имя сегмента, смещение gzip-member'а] последней копии состояния.
+
+    В индексах до появления смещений значение — просто имя сегмента.
+    """
+    global _ARCHIVE_INDEX
+    with STATE_LOCK:
+        if _ARCHIVE_INDEX is None:
+            data = _load_json(STATE_ARCHIVE_INDEX)
+            _ARCHIVE_INDEX = data if isinstance(data, dict) else {}
+        return _ARCHIVE_INDEX
+def save_archive_index(index):
+    global _ARCHIVE_INDEX
+    with STATE_LOCK:
+        try:
+            os.makedirs(STATE_ARCHIVE_DIR, exist_ok=True)
+            tmp = STATE_ARCHIVE_INDEX + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp, STATE_ARCHIVE_INDEX)
+            _ARCHIVE_INDEX = index
+        except Exception as e:
+            logger.error("Failed to save state archive index: %s", e)
+            # Следующее чтение — снова с диска, чтобы память не расходилась с файлом
+            _ARCHIVE_INDEX = None
+
+def archive_user_states(items):
+    """Дописывает состояния (user_key, state) в текущий месячный сегмент архива.
+
+    Каждый вызов — отдельный gzip-member (сегмент читается как один поток), его
+    смещение запоминается в индексе: восстановление распаковывает только его.
+    """
+    if not items:
+        return
+    ts = now_ts()
+    path = _archive_segment_path(ts)
+    os.makedirs(STATE_ARCHIVE_DIR, exist_ok=True)
+    with open(path, "ab") as raw:
+        offset = raw.seek(0, os.SEEK_END)
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for user_key, st in items:
+                f.write((json.dumps({"user_id": user_key, "archived_ts": ts, "state": st},
+                                    ensure_ascii=False) + "\n").encode("utf-8"))
+    index = load_archive_index()
+    for user_key, _ in items:
+        index[user_key] = [os.path.basename(path), offset]
+    save_archive_index(index)
+
+def _read_archive_member(path, offset):
+    """Строки одного gzip-member'а сегмента, начиная со смещения offset."""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while not d.eof:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            data.append(d.decompress(chunk))
+    return b"".join(data).decode("utf-8").splitlines()
+
+def restore_archived_user(user_key):
+    """Возвращает состояние пользователя из архива (или None) и снимает его с учёта в индексе."""
+    index = load_archive_index()
+    entry = index.get(user_key)
+    if not entry:
+        return None
+    segment, offset = (entry, None) if isinstance(entry, str) else entry
+    path = os.path.join(STATE_ARCHIVE_DIR, segment)
+    restored = None
+    try:
+        if offset is not None:
+            lines = _read_archive_member(path, offset)
+        else:
+            # старый индекс без смещения: весь сегмент, последняя копия
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                lines = [line for line in f if user_key in line]
+        for line in lines:
+            if user_key not in line:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if rec.get("user_id") == user_key:
+                restored = rec.get("state")
+    except Exception as e:
+        logger.error("Failed to read state archive %s: %s", segment, e)
+        return None
+    if not isinstance(restored, dict):
+        return None
+    del index[user_key]
+    save_archive_index(index)
+    logger.info("User %s restored from state archive (%s)", user_key, segment)
+    return restored
+
+def evict_inactive_users(ttl_days=None):
+    """Переносит в архив пользователей, не писавших дольше TTL. Возвращает число выгруженных."""
+    ttl_days = STATE_TTL_DAYS if ttl_days is None else ttl_days
+    if not ttl_days or ttl_days <= 0:
+        return 0
+    with STATE_LOCK:
+        state_dict = load_state()
+        now = now_ts()
+        cutoff = now - int(ttl_days * 86400)
+        evicted = []
+        stamped = False
+        for user_key, st in state_dict.items():
+            if not isinstance(st, dict):
+                continue
+            last = st.get("last_user_message_ts") or st.get("created_ts")
+            if not last:
+                # старые записи без отметок времени: начинаем отсчёт TTL с текущего момента
+                st["created_ts"] = now
+                stamped = True
+                continue
+            if last < cutoff and not st.get("awaiting_comment_for"):
+                evicted.append((user_key, st))
+        if not evicted:
+            if stamped:
+                save_state(state_dict)
+            return 0
+        try:
+            archive_user_states(evicted)
+        except Exception as e:
+            logger.error("Failed to archive inactive users: %s", e)
+            return 0
+        for user_key, _ in evicted:
+            del state_dict[user_key]
+        save_state(state_dict)
+        logger.info("State eviction: %d users archived, %d in hot state", len(evicted), len(state_dict))
+        return len(evicted)
+
+def job_evict_inactive_users(context: CallbackContext):
+    try:
+        evict_inactive_users()
+    except Exception as e:
+        logger.error("State eviction failed: %s", e)
 
 # -----------------------------
 # Content menu (content.json)
@@ -405,6 +641,21 @@ def rebuild_kb_index():
     logger.info("KB index rebuilt: %d docs", len(index_docs))
     return idx
 
+def kb_index_version(idx):
+    """Отпечаток содержимого KB (для ключа кэша LLM), считается один раз на загруженный индекс."""
+    if not idx:
+        return ""
+    version = idx.get("_version")
+    if version is None:
+        h = hashlib.md5()
+        for d in idx.get("docs") or []:
+            h.update((d.get("id") or "").encode("utf-8"))
+            h.update(b"\0")
+            h.update((d.get("text") or "").encode("utf-8"))
+            h.update(b"\0")
+        version = idx["_version"] = h.hexdigest()[:12]
+    return version
+
 def load_kb_index():
     if os.path.exists(KB_INDEX_PATH):
         try:
@@ -432,15 +683,12 @@ def bm25_score(query_tokens, doc_tokens, df, n_docs, k1=1.2, b=0.75, avgdl=200.0
         score += idf * ((tf * (k1 + 1)) / (denom or 1.0))
     return score
 
-def retrieve_kb_snippets(query, idx, top_k=6, max_chars=1400):
-    """RAG: получает 3-6 релевантных фрагментов."""
+def retrieve_kb_snippets(query, idx, top_k=6, max_chars=1400, with_scores=False):
+    """RAG: получает 3-6 релевантных фрагментов (with_scores=True — (фрагменты, их BM25))."""
     docs = idx.get("docs") or []
-    if not docs:
-        return []
-    
-    q_tokens = tokenize(query)
+    q_tokens = tokenize(query) if docs else []
     if not q_tokens:
-        return []
+        return ([], []) if with_scores else []
     
     df = idx.get("df") or {}
     n_docs = idx.get("n_docs") or max(1, len(docs))
@@ -460,92 +708,289 @@ def retrieve_kb_snippets(query, idx, top_k=6, max_chars=1400):
     scored.sort(key=lambda x: x[0], reverse=True)
     
     snippets = []
+    scores = []
     for s, text in scored[:top_k]:
         t = clean_kb_markdown(text)
         t = t[:max_chars].strip()
         if t:
             snippets.append(t)
-    return snippets
+            scores.append(s)
+    return (snippets, scores) if with_scores else snippets
 
 # -----------------------------
 # GigaChat API
 # -----------------------------
-GIGACHAT_TOKEN_CACHE = {"token": None, "exp_ts": 0}
-
-def gigachat_get_access_token(auth_key, scope, ca_bundle_path=None, timeout=30):
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": "Basic " + auth_key,
-    }
-    verify = True
-    if ca_bundle_path and os.path.exists(ca_bundle_path):
-        verify = ca_bundle_path
-    r = requests.post(url, headers=headers, data={"scope": scope}, timeout=timeout, verify=verify)
-    r.raise_for_status()
-    data = r.json()
-    token = data.get("access_token") or ""
-    exp = int(time.time()) + 25 * 60  # 25 минут для безопасности
-    return token, exp
-
-def gigachat_call(prompt, model=None, timeout=60):
-    # Модель из .env или по умолчанию
-    if model is None:
-        model = os.getenv("GIGACHAT_MODEL", "GigaChat").strip()
-    
+GIGACHAT_SYSTEM_PROMPT = (
+    "Ты — AI-помощник по блокировкам счетов/карт, 115-ФЗ, ЗСК и комплаенсу. "
+    "Отвечай кратко, структурировано, без markdown (#,*). "
+    "Используй эмодзи ✅ 1️⃣ 2️⃣ 3️⃣ для читаемости. Не упоминай файлы/источники."
+)
+
+def init_gigachat():
+    """Создаёт общий GigaChatClient (пул keep-alive соединений) по GIGACHAT_* из .env."""
+    global GIGACHAT, GIGACHAT_STREAM, GIGACHAT_STREAM_EDIT_SEC, GIGACHAT_BREAKERS, LLM_RATE_LIMITER, MODEL_ROUTER
+    GIGACHAT_STREAM = os.getenv("GIGACHAT_STREAM", "1").strip() != "0"
+    try:
+        GIGACHAT_STREAM_EDIT_SEC = float(os.getenv("GIGACHAT_STREAM_EDIT_SEC", "1.0").strip() or 1.0)
+    except ValueError:
+        GIGACHAT_STREAM_EDIT_SEC = 1.0
     auth_key = os.getenv("GIGACHAT_AUTH_KEY", "").strip()
-    scope = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS").strip()
-    ca_bundle = os.getenv("GIGACHAT_VERIFY_CA", "").strip() or os.getenv("GIGACHAT_CA_BUNDLE", "").strip()
-    
     if not auth_key:
+        logger.warning("GIGACHAT_AUTH_KEY not set, answers will use KB snippets only")
+        GIGACHAT = None
+        return None
+    ca_bundle = (os.getenv("GIGACHAT_VERIFY_CA", "").strip()
+                 or os.getenv("GIGACHAT_CA_BUNDLE", "").strip()
+                 or os.path.join("data", "ca", "ca_bundle.pem"))
+    if not os.path.isabs(ca_bundle) and not os.path.exists(ca_bundle):
+        ca_bundle = os.path.join(BASE_DIR, ca_bundle)
+    try:
+        pool_size = int(os.getenv("GIGACHAT_POOL_SIZE", "10").strip() or 10)
+    except ValueError:
+        pool_size = 10
+    GIGACHAT = GigaChatClient(
+        auth_key,
+        scope=os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS").strip(),
+        model=os.getenv("GIGACHAT_MODEL", "GigaChat").strip(),
+        ca_bundle_path=ca_bundle,
+        pool_size=pool_size,
+        oauth_url=os.getenv("GIGACHAT_OAUTH_URL", "").strip() or None,
+        api_base=os.getenv("GIGACHAT_API_BASE", "").strip() or None,
+    )
+    # Автомат и адаптивный таймаут — отдельно по каждой модели (лёгкая и сильная деградируют по-разному)
+    try:
+        GIGACHAT_BREAKERS = BreakerPool(
+            "gigachat",
+            error_rate=float(os.getenv("GIGACHAT_BREAKER_ERROR_RATE", "0.5").strip() or 0.5),
+            cooldown=float(os.getenv("GIGACHAT_BREAKER_COOLDOWN", "30").strip() or 30),
+            min_timeout=float(os.getenv("GIGACHAT_TIMEOUT_MIN", "10").strip() or 10),
+            max_timeout=float(os.getenv("GIGACHAT_TIMEOUT_MAX", "60").strip() or 60),
+        )
+    except ValueError as e:
+        logger.warning("Failed to parse GIGACHAT_BREAKER_*/GIGACHAT_TIMEOUT_*: %s", e)
+        GIGACHAT_BREAKERS = BreakerPool("gigachat")
+    GIGACHAT_BREAKERS.get(GIGACHAT.model)
+    try:
+        LLM_RATE_LIMITER = RateLimiter(
+            global_rate=float(os.getenv("GIGACHAT_RPS", "2").strip() or 0),
+            global_burst=int(os.getenv("GIGACHAT_BURST", "10").strip() or 10),
+            user_rate=float(os.getenv("USER_LLM_PER_MIN", "5").strip() or 0) / 60.0,
+            user_burst=int(os.getenv("USER_LLM_BURST", "3").strip() or 3),
+            max_wait=float(os.getenv("GIGACHAT_RATE_WAIT", "2").strip() or 0),
+        )
+    except ValueError as e:
+        logger.warning("Failed to parse GIGACHAT_RPS/USER_LLM_*: %s", e)
+        LLM_RATE_LIMITER = RateLimiter()
+    MODEL_ROUTER = ModelRouter.from_file(
+        os.getenv("GIGACHAT_ROUTES_PATH", "").strip() or MODEL_ROUTES_PATH,
+        GIGACHAT.model,
+        light_model=os.getenv("GIGACHAT_MODEL_LIGHT", "").strip() or None,
+        strong_model=os.getenv("GIGACHAT_MODEL_STRONG", "").strip() or None,
+    )
+    # Токен получаем сразу и обновляем заранее в фоне — не на пути запроса пользователя
+    GIGACHAT.start_refresher(margin=int(os.getenv("GIGACHAT_TOKEN_REFRESH_SEC", "120").strip() or 120))
+    logger.info("GigaChat client ready: model=%s pool=%d api=%s", GIGACHAT.model, pool_size, GIGACHAT.api_base)
+    return GIGACHAT
+
+def gigachat_call(prompt, model=None, timeout=None, kb_version="", on_text=None, user_id=None, personal=False):
+    """Ответ GigaChat на промпт: (answer, None) или (None, текст ошибки).
+    
+    Сначала ищет ответ в LLM_CACHE (ключ учитывает модель, системный промпт и версию KB).
+    Если такой же промпт уже генерируется, ждёт тот же результат (LLM_INFLIGHT), не тратя лимиты.
+    personal=True — промпт с историей треда или данными кейса: он свой у каждого пользователя,
+    поэтому кэш и склейка не используются (такие вызовы считает LLM_PERSONAL_CALLS для /status).
+    Пока автомат модели (GIGACHAT_BREAKERS) открыт, сразу возвращает ошибку (вызывающий отвечает по RAG),
+    не тратя лимиты. Иначе расходует токен LLM_RATE_LIMITER (общий и user_id); сверх лимита — ошибка.
+    Таймаут — адаптивный по p95 этой модели (timeout, если задан, — верхняя граница).
+    С on_text ответ запрашивается потоком: on_text(текст_на_данный_момент) после каждого фрагмента;
+    таймаут тогда — срок на всю генерацию, и p95 для него автомат считает по потоковым вызовам.
+    """
+    global LLM_PERSONAL_CALLS
+    if GIGACHAT is None:
         return None, "GIGACHAT_AUTH_KEY not set"
     
-    # refresh token if needed
-    if (not GIGACHAT_TOKEN_CACHE["token"]) or (time.time() >= GIGACHAT_TOKEN_CACHE["exp_ts"]):
+    key = None
+    if personal:
+        with _LLM_PERSONAL_LOCK:
+            LLM_PERSONAL_CALLS += 1
+    else:
+        key = llm_cache_key(model or GIGACHAT.model, GIGACHAT_SYSTEM_PROMPT, prompt, kb_version)
+    if LLM_CACHE is not None and key is not None:
         try:
-            token, exp = gigachat_get_access_token(auth_key, scope, ca_bundle_path=ca_bundle or None)
-            GIGACHAT_TOKEN_CACHE["token"] = token
-            GIGACHAT_TOKEN_CACHE["exp_ts"] = exp
+            cached = LLM_CACHE.get(key)
         except Exception as e:
-            return None, "GigaChat auth error: %s" % str(e)
+            logger.warning("LLM cache read failed: %s", e)
+            cached = None
+        if cached:
+            return cached, None
     
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": "Bearer " + GIGACHAT_TOKEN_CACHE["token"],
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "Ты — AI-помощник по блокировкам счетов/карт, 115-ФЗ, ЗСК и комплаенсу. Отвечай кратко, структурировано, без markdown (#,*). Используй эмодзи ✅ 1️⃣ 2️⃣ 3️⃣ для читаемости. Не упоминай файлы/источники."},
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.2,
-    }
+    breaker = GIGACHAT_BREAKERS.get(model or GIGACHAT.model) if GIGACHAT_BREAKERS is not None else None
+    flight = LLM_INFLIGHT.join(key, on_text) if key is not None else None
+    if flight is None:
+        # Автомат — до лимитов: отклонённый вызов не должен съедать токены
+        if breaker is not None and not breaker.allow():
+            return None, "GigaChat circuit open"
+        if LLM_RATE_LIMITER is not None:
+            limited = LLM_RATE_LIMITER.acquire(user_id)
+            if limited:
+                if breaker is not None:
+                    breaker.cancel()
+                logger.info("GigaChat rate limit (%s) for user %s", limited, user_id)
+                return None, "GigaChat rate limited (%s)" % limited
+        if key is None:
+            return _gigachat_request(prompt, model, timeout, on_text, breaker)
+        flight, leader = LLM_INFLIGHT.begin(key, on_text)
+        if not leader:
+            # Такой же запрос начался, пока ждали лимит: ждём его, токен и пропуск автомата возвращаем
+            if breaker is not None:
+                breaker.cancel()
+            if LLM_RATE_LIMITER is not None:
+                LLM_RATE_LIMITER.release(user_id)
+    else:
+        leader = False
+    
+    if not leader:
+        wait = timeout or (breaker.timeout(stream=on_text is not None) if breaker is not None else 60)
+        result = LLM_INFLIGHT.wait(flight, wait, on_text)
+        if result is None:
+            return None, "GigaChat request error: coalesced wait timed out after %.1f s" % wait
+        return result
+    
+    result = (None, "GigaChat request error: interrupted")
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=timeout)
-        r.raise_for_status()
-        data = r.json()
-        choices = data.get("choices") or []
-        if not choices:
-            return None, "No choices"
-        msg = choices[0].get("message") or {}
-        return msg.get("content") or "", None
+        result = _gigachat_request(prompt, model, timeout, flight.broadcast if on_text is not None else None, breaker)
+    finally:
+        LLM_INFLIGHT.finish(key, flight, result)
+    
+    answer = result[0]
+    if LLM_CACHE is not None and answer:
+        try:
+            LLM_CACHE.put(key, model or GIGACHAT.model, answer)
+        except Exception as e:
+            logger.warning("LLM cache write failed: %s", e)
+    return result
+
+def _gigachat_request(prompt, model, timeout, on_text, breaker=None):
+    """Сам запрос к GigaChat, уже пропущенный breaker.allow(): (answer, None) или (None, ошибка).
+
+    Исход записывается в автомат модели (breaker.record), задержки потоковых вызовов — отдельно.
+    """
+    stream = on_text is not None
+    if breaker is not None:
+        adaptive = breaker.timeout(stream=stream)
+        timeout = min(timeout, adaptive) if timeout else adaptive
+    started = time.time()
+    
+    try:
+        GIGACHAT.get_access_token()
+    except Exception as e:
+        if breaker is not None:
+            breaker.record(False)
+        return None, "GigaChat auth error: %s" % str(e)
+    
+    try:
+        if not stream:
+            answer = GIGACHAT.chat(GIGACHAT_SYSTEM_PROMPT, prompt, temperature=0.2, max_tokens=None,
+                                   model=model, timeout=timeout)
+        else:
+            parts = []
+            for delta in GIGACHAT.chat_stream(GIGACHAT_SYSTEM_PROMPT, prompt, temperature=0.2, max_tokens=None,
+                                              model=model, timeout=timeout):
+                parts.append(delta)
+                on_text("".join(parts))
+            answer = "".join(parts)
     except Exception as e:
+        if breaker is not None:
+            breaker.record(False)
+        _record_model_call(model, time.time() - started, False)
         return None, "GigaChat request error: %s" % str(e)
-
-def build_llm_prompt(user_text, snippets, branch=None, case_context=None):
-    """Строит промпт для GigaChat с контекстом кейса."""
+    elapsed = time.time() - started
+    if breaker is not None:
+        breaker.record(bool(answer), elapsed, stream=stream)
+    _record_model_call(model, elapsed, bool(answer))
+    return answer, None
+
+def _record_model_call(model, latency, ok):
+    """Задержка и исход запроса к модели: в лог и в статистику MODEL_ROUTER (/status)."""
+    model = model or GIGACHAT.model
+    logger.info("GigaChat call: model=%s %.2fs ok=%s", model, latency, ok)
+    if MODEL_ROUTER is not None:
+        MODEL_ROUTER.record(model, latency, ok)
+
+class StreamingReply(object):
+    """Сообщение-заглушка, которое правится по мере генерации ответа.
+    
+    Правки не чаще interval секунд (в группах — не чаще раза в 3 с), чтобы не упираться
+    в лимиты Telegram; на RetryAfter следующая правка откладывается на указанное время.
+    update() приходит из потока раздачи LLM_INFLIGHT, finish() — из потока ответа: после
+    finish() поздние фрагменты игнорируются (проверка под _lock).
+    """
+    
+    PLACEHOLDER = "⏳ Готовлю ответ…"
+    MAX_LEN = 4000
+    
+    def __init__(self, bot, chat_id, message_id, interval=1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = max(interval, 3.0) if chat_id < 0 else interval
+        # Первый фрагмент показываем сразу, дальше — не чаще interval
+        self._next_edit = 0
+        self._shown = self.PLACEHOLDER
+        self._lock = threading.Lock()
+        self._finished = False
+    
+    def _edit(self, text):
+        if text == self._shown:
+            return True
+        try:
+            self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id)
+            self._shown = text
+            return True
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after:
+                self._next_edit = time.time() + float(retry_after)
+            logger.info("Stream edit failed: %s", e)
+            return False
+    
+    def update(self, text):
+        """on_text для gigachat_call: показывает текущий текст, если пришло время следующей правки."""
+        with self._lock:
+            now = time.time()
+            if self._finished or now < self._next_edit:
+                return
+            self._next_edit = now + self.interval
+            text = text.strip()
+            if text:
+                self._edit(text[:self.MAX_LEN] + " …")
+    
+    @property
+    def finished(self):
+        return self._finished
+    
+    def finish(self, text, reply_markup=None):
+        """Итоговый текст; если правка не удалась, отправляет его новым сообщением. Возвращает message_id."""
+        with self._lock:
+            self._finished = True
+            edited = self._edit(text[:self.MAX_LEN])
+        if edited:
+            return self.message_id
+        msg = self.bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup)
+        return msg.message_id
+
+def build_llm_prompt(user_text, snippets, branch=None, case_context=None, history=None):
+    """Строит промпт для GigaChat с контекстом кейса и историей треда (размер ограничен)."""
     ctx = "\n\n".join(snippets) if snippets else ""
     branch_info = ""
     if branch:
         branch_info = "\nВетка кейса: %s" % branch
     case_info = ""
-    if case_context:
-        case_info = "\nКонтекст кейса: %s" % json.dumps(case_context, ensure_ascii=False)
+    case_text = compact_case(case_context)
+    if case_text:
+        case_info = "\nКонтекст кейса: %s" % case_text
+    if history:
+        case_info += "\n\nИстория разговора (для понимания уточняющих вопросов):\n%s" % history
     
     if ctx:
         return (
@@ -593,6 +1038,11 @@ def is_on_topic(text):
     return any(k in t for k in keywords)
 
 
+def case_flow_active(user_state):
+    """Опрос кейса начат и не закончен: бот ждёт ответа на свой вопрос."""
+    case = user_state.get("case_data") or {}
+    return bool(case.get("asked_questions")) and case.get("step", 1) < 4
+
 def ensure_case_flow(update: Update, context: CallbackContext, user_state, text):
     """Сценарный опрос: задаёт обязательные вопросы перед LLM."""
     if not is_on_topic(text) and not user_state.get("branch"):
@@ -692,7 +1142,56 @@ def start(update: Update, context: CallbackContext):
     )
 
 def status(update: Update, context: CallbackContext):
-    update.message.reply_text("✅ Бот работает. Напишите вопрос или нажмите кнопку меню.", reply_markup=make_main_keyboard())
+    msg = "✅ Бот работает. Напишите вопрос или нажмите кнопку меню."
+    if EVENT_WRITER is not None and is_admin(update.effective_user.id):
+        st = EVENT_WRITER.stats()
+        msg += "\n\n📝 Очередь логов: %d (записано %d, пачек %d, ошибок %d, отброшено %d)" % (
+            st["queue_depth"], st["written"], st["batches"], st["errors"], st["dropped"])
+    if GIGACHAT_BREAKERS is not None and is_admin(update.effective_user.id):
+        for model, st in sorted(GIGACHAT_BREAKERS.stats().items()):
+            state = {"closed": "✅ работает", "open": "⛔ отключён (ответы по базе знаний)",
+                     "half_open": "🟡 пробный запрос"}.get(st["state"], st["state"])
+            msg += ("\n🔌 %s: %s; ошибок %d из %d за минуту, p95 %s с, таймаут %.0f с; "
+                    "потоком p95 %s с, таймаут %.0f с") % (
+                model, state, st["errors"], st["calls"], st["p95"] if st["p95"] is not None else "—", st["timeout"],
+                st["stream_p95"] if st["stream_p95"] is not None else "—", st["stream_timeout"])
+            if st["state"] == "open":
+                msg += ", проба через %.0f с" % st["retry_in"]
+    if LLM_RATE_LIMITER is not None and is_admin(update.effective_user.id):
+        st = LLM_RATE_LIMITER.stats()
+        msg += "\n🚦 Лимиты LLM: пропущено %d (с ожиданием %d), сверх лимита пользователя %d, общего %d" % (
+            st["allowed"], st["waited"], st["user_limited"], st["global_limited"])
+    if MODEL_ROUTER is not None and is_admin(update.effective_user.id):
+        for model, st in sorted(MODEL_ROUTER.stats().items()):
+            msg += "\n🧠 %s: запросов %d (ошибок %d), p50 %s с, p95 %s с; правила: %s" % (
+                model, st["calls"], st["errors"],
+                st["p50"] if st["p50"] is not None else "—", st["p95"] if st["p95"] is not None else "—",
+                ", ".join("%s %d" % kv for kv in sorted(st["routes"].items())) or "—")
+    if CONVERSATION_MEMORY is not None and is_admin(update.effective_user.id):
+        st = CONVERSATION_MEMORY.stats()
+        msg += "\n💬 Память тредов: сжатий %d (без LLM %d), лимит %d ток." % (
+            st["compactions"], st["fallbacks"], CONVERSATION_MEMORY.max_tokens)
+    if FAQ_MATCHER is not None and is_admin(update.effective_user.id):
+        st = FAQ_MATCHER.stats()
+        msg += "\n📚 Готовые ответы FAQ: %d интентов, выдано %d из %d вопросов" % (
+            st["intents"], st["hits"], st["hits"] + st["misses"])
+    if is_admin(update.effective_user.id):
+        st = LLM_INFLIGHT.stats()
+        if st["coalesced"]:
+            msg += "\n🔗 Одинаковых вопросов склеено: %d (не дождались %d)" % (st["coalesced"], st["timeouts"])
+        if LLM_PERSONAL_CALLS:
+            msg += "\n👤 Запросов с историей/кейсом (без кэша и склейки): %d" % LLM_PERSONAL_CALLS
+    if LLM_EXECUTOR is not None and is_admin(update.effective_user.id):
+        st = LLM_EXECUTOR.stats()
+        msg += "\n🤖 Очередь LLM: выполняется %d/%d, ждёт %d/%d (готово %d, ошибок %d, отказов %d)" % (
+            st["running"], st["workers"], st["queued"], st["max_queue"],
+            st["completed"], st["failed"], st["rejected"])
+    if LLM_CACHE is not None and is_admin(update.effective_user.id):
+        st = LLM_CACHE.stats()
+        msg += "\n🗄 Кэш LLM: %d ответов, %.1f МБ, попаданий %d из %d (%.0f%%)" % (
+            st["entries"], st["bytes"] / 1048576.0, st["hits"], st["hits"] + st["misses"],
+            st["hit_rate"] * 100)
+    update.message.reply_text(msg, reply_markup=make_main_keyboard())
 
 def handle_menu(update: Update, context: CallbackContext):
     """Обработка меню Раздатка/Шаблоны/Курсы."""
@@ -804,26 +1303,95 @@ def handle_text(update: Update, context: CallbackContext):
         update_user_state_persistent(user.id, {"branch": branch})
         user_state["branch"] = branch
 
+    # Частый вопрос с проверенным готовым ответом: без опроса, RAG и GigaChat.
+    # Пока идёт опрос кейса, сообщение — ответ на его вопрос, а не новый вопрос к FAQ
+    if FAQ_MATCHER is not None and not case_flow_active(user_state):
+        intent, score = FAQ_MATCHER.match(text, branch)
+        if intent is not None:
+            logger.info("FAQ answer %s (score %.2f) for %s", intent["id"], score, user.id)
+            deliver_answer(update.message, context.bot, text, intent["answer"], branch,
+                           rag_used=False, gigachat_used=False, extra_meta={"faq_id": intent["id"]})
+            return
+    
     # Сценарный опрос кейса
     if ensure_case_flow(update, context, user_state, text):
         return
     
-    # RAG: получаем фрагменты из KB
+    # RAG-индекс (кэшируется в bot_data)
     kb_idx = context.bot_data.get("kb_index")
     if not kb_idx:
         kb_idx = load_kb_index()
         context.bot_data["kb_index"] = kb_idx
     
-    snippets = retrieve_kb_snippets(text, kb_idx, top_k=6)
+    # Заглушка сразу, дальше она правится по мере генерации ответа
+    stream_reply = None
+    if GIGACHAT is not None and GIGACHAT_STREAM:
+        try:
+            placeholder = update.message.reply_text(StreamingReply.PLACEHOLDER, reply_markup=make_main_keyboard())
+            stream_reply = StreamingReply(context.bot, chat_id, placeholder.message_id,
+                                          interval=GIGACHAT_STREAM_EDIT_SEC)
+        except Exception as e:
+            logger.warning("Failed to send placeholder: %s", e)
+    
+    # Ответ готовится в пуле LLM_EXECUTOR: диспетчер сразу свободен для оценок, меню и команд
+    if LLM_EXECUTOR is None:
+        answer_question(update.message, context.bot, user_state, text, branch, kb_idx, stream_reply)
+        return
+    if LLM_EXECUTOR.submit(answer_question_task, update.message, context.bot, user_state, text, branch,
+                           kb_idx, stream_reply) is None:
+        logger.warning("LLM queue full, rejecting message from %s", user.id)
+        busy = "⏳ Сейчас много вопросов, не успеваю ответить. Повторите, пожалуйста, через минуту."
+        if stream_reply is not None:
+            stream_reply.finish(busy, reply_markup=make_main_keyboard())
+        else:
+            update.message.reply_text(busy, reply_markup=make_main_keyboard())
+
+ANSWER_FAILED_TEXT = "😔 Не получилось подготовить ответ. Повторите вопрос, пожалуйста, чуть позже."
+
+def answer_question_task(message, bot, user_state, text, branch, kb_idx, stream_reply=None):
+    """answer_question в пуле LLM_EXECUTOR: при ошибке пользователь получает извинение, а не вечную заглушку."""
+    try:
+        answer_question(message, bot, user_state, text, branch, kb_idx, stream_reply)
+    except Exception:
+        try:
+            if stream_reply is not None:
+                if not stream_reply.finished:
+                    stream_reply.finish(ANSWER_FAILED_TEXT, reply_markup=make_main_keyboard())
+            else:
+                message.reply_text(ANSWER_FAILED_TEXT, reply_markup=make_main_keyboard())
+        except Exception as e:
+            logger.warning("Failed to send answer error notice to %s: %s", message.chat_id, e)
+        raise  # ошибку с трассировкой пишет и считает LLM_EXECUTOR
+
+def answer_question(message, bot, user_state, text, branch, kb_idx, stream_reply=None):
+    """RAG + GigaChat и отправка ответа с кнопками оценки (выполняется в пуле LLM_EXECUTOR)."""
+    user = message.from_user
+    
+    snippets, scores = retrieve_kb_snippets(text, kb_idx, top_k=6, with_scores=True)
     rag_used = len(snippets) > 0
     
-    # Строим промпт для GigaChat
+    # Строим промпт для GigaChat (память перечитываем: предыдущий ответ мог завершиться после handle_text)
     case_context = user_state.get("case_data", {})
-    prompt = build_llm_prompt(text, snippets, branch=branch, case_context=case_context)
+    history = None
+    if CONVERSATION_MEMORY is not None:
+        fresh = get_user_state_persistent(user.id)[0]
+        history = CONVERSATION_MEMORY.render(fresh.get("memory"), fresh.get("thread_id"))
+    prompt = build_llm_prompt(text, snippets, branch=branch, case_context=case_context, history=history)
+    
+    # Модель по сложности вопроса (правила MODEL_ROUTER)
+    model, route = None, None
+    if MODEL_ROUTER is not None:
+        model, route = MODEL_ROUTER.route(question_features(text, branch, case_context, scores))
     
     # Вызываем GigaChat
-    answer, err = gigachat_call(prompt)
+    started = time.time()
+    answer, err = gigachat_call(prompt, model=model, kb_version=kb_index_version(kb_idx), user_id=user.id,
+                                on_text=stream_reply.update if stream_reply is not None else None,
+                                personal=bool(history or compact_case(case_context)))
     gigachat_used = (answer is not None and not err)
+    llm_meta = None
+    if route is not None:
+        llm_meta = {"model": model, "route": route, "llm_ms": int((time.time() - started) * 1000)}
     
     # Fallback без LLM
     if err or not answer:
@@ -836,21 +1404,41 @@ def handle_text(update: Update, context: CallbackContext):
             )
     
     answer = prettify_answer(answer)
+    deliver_answer(message, bot, text, answer, branch, rag_used, gigachat_used, stream_reply, extra_meta=llm_meta)
+
+def deliver_answer(message, bot, text, answer, branch, rag_used, gigachat_used, stream_reply=None, extra_meta=None):
+    """Отправляет ответ, пишет его в dialogs.jsonl, присылает кнопки оценки и обновляет состояние."""
+    user = message.from_user
+    chat_id = message.chat_id
     
-    # Генерируем ID ответа и thread_id
+    # Генерируем ID ответа и thread_id (перечитываем: другой воркер мог уже завести тред)
     answer_id = str(uuid.uuid4())
-    thread_id = user_state.get("thread_id") or str(uuid.uuid4())
-    if not user_state.get("thread_id"):
-        update_user_state_persistent(user.id, {"thread_id": thread_id})
+    with STATE_LOCK:
+        thread_id = get_user_state_persistent(user.id)[0].get("thread_id")
+        if not thread_id:
+            thread_id = str(uuid.uuid4())
+            update_user_state_persistent(user.id, {"thread_id": thread_id})
     
     # Хеш запроса для отслеживания
     query_hash = hashlib.md5(text.encode("utf-8")).hexdigest()[:8]
     
-    # Отправляем ответ
-    msg = update.message.reply_text(answer, reply_markup=make_main_keyboard())
-    message_id_bot = msg.message_id
+    # Отправляем ответ (или дописываем заглушку)
+    if stream_reply is not None:
+        message_id_bot = stream_reply.finish(answer, reply_markup=make_main_keyboard())
+    else:
+        msg = message.reply_text(answer, reply_markup=make_main_keyboard())
+        message_id_bot = msg.message_id
     
     # Сохраняем ответ бота в dialogs.jsonl
+    meta = {
+        "answer_id": answer_id,
+        "question": text,
+        "branch": branch,
+        "rag_used": rag_used,
+        "gigachat_used": gigachat_used,
+    }
+    if extra_meta:
+        meta.update(extra_meta)
     safe_write_jsonl(DIALOGS_LOG, {
         "ts": now_ts(),
         "user_id": user.id,
@@ -859,18 +1447,11 @@ def handle_text(update: Update, context: CallbackContext):
         "role": "bot",
         "text": answer,
         "thread_id": thread_id,
-        "meta": {
-            "answer_id": answer_id,
-            "question": text,
-            "branch": branch,
-            "rag_used": rag_used,
-            "gigachat_used": gigachat_used,
-        }
+        "meta": meta,
     })
-    
     # Отправляем клавиатуру с оценкой
     try:
-        feedback_msg = context.bot.send_message(
+        feedback_msg = bot.send_message(
             chat_id=chat_id,
             text="Оцените ответ:",
             reply_markup=build_feedback_keyboard(answer_id)
@@ -891,6 +1472,50 @@ def handle_text(update: Update, context: CallbackContext):
             "question": text,
         }
     })
+    if CONVERSATION_MEMORY is not None:
+        remember_turn(user.id, thread_id, text, answer)
+
+def remember_turn(user_id, thread_id, question, answer):
+    """Добавляет реплику в память треда; сжатие старых реплик — в пуле LLM (или сразу, без пула)."""
+    with STATE_LOCK:
+        memory = get_user_state_persistent(user_id)[0].get("memory")
+        memory = CONVERSATION_MEMORY.add(memory, thread_id, question, answer)
+        update_user_state_persistent(user_id, {"memory": memory})
+    if not CONVERSATION_MEMORY.needs_compact(memory):
+        return
+    if LLM_EXECUTOR is None:
+        compact_memory(user_id)
+    elif LLM_EXECUTOR.submit(compact_memory, user_id) is None:
+        logger.info("LLM queue full, memory compaction for %s postponed", user_id)
+
+def compact_memory(user_id):
+    """Сворачивает старые реплики треда в summary; LLM вызывается вне STATE_LOCK."""
+    memory = get_user_state_persistent(user_id)[0].get("memory")
+    if not CONVERSATION_MEMORY.needs_compact(memory):
+        return
+    overflow, summary = CONVERSATION_MEMORY.compact(memory)
+    with STATE_LOCK:
+        current = get_user_state_persistent(user_id)[0].get("memory") or {}
+        updated = CONVERSATION_MEMORY.apply(current, memory.get("summary") or "", overflow, summary)
+        if updated is not None:
+            update_user_state_persistent(user_id, {"memory": updated})
+
+def summarize_turns(prev_summary, turns):
+    """Краткое содержание разговора для памяти треда (лёгкая модель MODEL_ROUTER); None — не вышло."""
+    if GIGACHAT is None:
+        return None
+    dialog = "\n".join("Пользователь: %s\nБот: %s" % (t["q"], t["a"]) for t in turns)
+    prompt = (
+        "Ранее в разговоре: %s\n\nНовые реплики:\n%s\n\n"
+        "Сожми всё это в краткое содержание разговора (до %d слов): ситуация пользователя, "
+        "что уже выяснено и что посоветовано. Только факты, без вступлений, без markdown."
+    ) % (prev_summary or "—", dialog, CONVERSATION_MEMORY.summary_tokens // 2)
+    model = MODEL_ROUTER.tiers["light"] if MODEL_ROUTER is not None else None
+    answer, err = gigachat_call(prompt, model=model, personal=True)
+    if err or not answer:
+        logger.info("Memory summary failed: %s", err)
+        return None
+    return answer
 
 def on_callback(update: Update, context: CallbackContext):
     """Обработка callback от inline-кнопок."""
@@ -902,6 +1527,28 @@ def on_callback(update: Update, context: CallbackContext):
     user = update.effective_user
     chat_id = update.effective_chat.id
 
+    if data.startswith("INBOX:"):
+        # INBOX:<page>:<номер ветки в INBOX_BRANCHES|->:<max_rating|>
+        if not is_admin(user.id):
+            return
+        parts = data.split(":")
+        try:
+            page = int(parts[1])
+        except Exception:
+            return
+        branch = None
+        if len(parts) > 2 and parts[2].isdigit() and int(parts[2]) < len(INBOX_BRANCHES):
+            branch = INBOX_BRANCHES[int(parts[2])]
+        max_rating = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else None
+        text, kb = render_inbox(user.id, page, branch, max_rating)
+        try:
+            q.edit_message_text(text, reply_markup=kb)
+        except BadRequest as e:
+            # Повторное нажатие той же страницы или фильтра: текст и кнопки не изменились
+            if "message is not modified" not in str(e).lower():
+                raise
+        return
+
     if data.startswith("FILE:"):
         parts = data.split(":", 2)
         if len(parts) == 3:
@@ -968,115 +1615,249 @@ def is_admin(user_id):
     """Проверяет, является ли пользователь админом."""
     return user_id in ADMIN_IDS
 
-def cmd_inbox(update: Update, context: CallbackContext):
-    """Команда /inbox — список новых комментариев."""
-    user = update.effective_user
-    if not is_admin(user.id):
-        update.message.reply_text("❌ Доступ запрещён.")
-        return
-    
-    # Читаем feedback.jsonl
+INBOX_PAGE_SIZE = 10
+# Ветки (см. detect_branch) — в callback_data /inbox передаётся номер ветки: лимит Telegram 64 байта
+INBOX_BRANCHES = ("115fz", "zsk", "161fz", "tax", "bailiffs", "no_reason")
+CALLBACK_DATA_MAX = 64
+
+def parse_inbox_args(args):
+    """/inbox [page] [branch] [rating<=N] -> (page, branch, max_rating)."""
+    page, branch, max_rating = 1, None, None
+    for a in args or []:
+        a = a.strip()
+        m = re.match(r"^(?:rating)?<=?(\d)$", a, flags=re.I)
+        if m:
+            max_rating = int(m.group(1))
+        elif a.isdigit():
+            page = max(1, int(a))
+        elif a and a != "-":
+            branch = a
+    return page, branch, max_rating
+
+def _inbox_rows_from_logs(offset, limit, branch, max_rating):
+    """Запасной путь без индекса: полный проход по feedback.jsonl."""
+    flush_event_log()
+    ratings = {}
     comments = []
-    if os.path.exists(FEEDBACK_LOG):
-        with open(FEEDBACK_LOG, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    event = json.loads(line)
-                    if event.get("type") == "comment" or (event.get("comment") and event.get("comment").strip()):
-                        comments.append(event)
-                except Exception:
-                    continue
+    for event in iter_log_events(FEEDBACK_LOG):
+        if event.get("rating") is not None and event.get("answer_id"):
+            ratings[event["answer_id"]] = event.get("rating")
+        if event.get("type") == "comment" or (event.get("comment") and event.get("comment").strip()):
+            comments.append(event)
+    rows = []
+    for c in comments:
+        eff = c.get("rating") if c.get("rating") is not None else ratings.get(c.get("answer_id"))
+        if branch and c.get("branch") != branch:
+            continue
+        if max_rating is not None and (eff is None or eff > max_rating):
+            continue
+        rows.append(dict(c, comment=c.get("comment") or c.get("text"), eff_rating=eff, is_read=True))
+    rows.sort(key=lambda x: x.get("ts", ""), reverse=True)
+    return rows[offset:offset + limit]
+
+def render_inbox(admin_id, page=1, branch=None, max_rating=None):
+    """Текст и клавиатура страницы /inbox; показанные комментарии помечаются прочитанными."""
+    offset = (page - 1) * INBOX_PAGE_SIZE
+    if LOG_INDEX is not None:
+        rows = LOG_INDEX.list_comments(admin_id, offset=offset, limit=INBOX_PAGE_SIZE + 1,
+                                       branch=branch, max_rating=max_rating)
+    else:
+        rows = _inbox_rows_from_logs(offset, INBOX_PAGE_SIZE + 1, branch, max_rating)
+    has_next = len(rows) > INBOX_PAGE_SIZE
+    rows = rows[:INBOX_PAGE_SIZE]
     
-    # Сортируем по времени (новые первыми)
-    comments.sort(key=lambda x: x.get("ts", ""), reverse=True)
+    if not rows:
+        return ("📭 Нет новых комментариев." if page == 1 else "📭 Больше комментариев нет."), None
     
-    # Показываем последние 10
-    if not comments:
-        update.message.reply_text("📭 Нет новых комментариев.")
-        return
+    title = "📬 Последние комментарии (стр. %d)" % page
+    filters = []
+    if branch:
+        filters.append("ветка %s" % branch)
+    if max_rating is not None:
+        filters.append("оценка ≤ %d" % max_rating)
+    if filters:
+        title += " — " + ", ".join(filters)
+    if LOG_INDEX is not None:
+        title += "\nНепрочитанных: %d" % LOG_INDEX.unread_count(admin_id)
     
-    msg_parts = ["📬 Последние комментарии:\n"]
-    for i, c in enumerate(comments[:10], 1):
-        thread_id = c.get("thread_id", "?")
-        user_id = c.get("user_id", "?")
-        comment = (c.get("comment") or c.get("text") or "")[:100]
-        rating = c.get("rating")
-        branch = c.get("branch", "?")
-        
+    msg_parts = [title + "\n"]
+    for i, c in enumerate(rows, offset + 1):
+        thread_id = c.get("thread_id") or "?"
+        comment = (c.get("comment") or "")[:100]
         msg_parts.append(
-            "%d) Thread: %s | User: %s | Branch: %s | Rating: %s\n"
+            "%d) %sThread: %s | User: %s | Branch: %s | Rating: %s\n"
             "   Комментарий: %s\n" % (
-                i, thread_id[:8], user_id, branch, rating or "—", comment
+                i, "" if c.get("is_read") else "🆕 ", thread_id[:8], c.get("user_id", "?"),
+                c.get("branch") or "?", c.get("eff_rating") or "—", comment
             )
         )
     
-    update.message.reply_text("\n".join(msg_parts))
+    if LOG_INDEX is not None:
+        LOG_INDEX.mark_read(admin_id, rows)
+    
+    nav = []
+    suffix = "%s:%s" % (INBOX_BRANCHES.index(branch) if branch in INBOX_BRANCHES else "-",
+                        "" if max_rating is None else max_rating)
+    for label, target in (("⬅️ Назад", page - 1 if page > 1 else None),
+                          ("Вперёд ➡️", page + 1 if has_next else None)):
+        if target is None:
+            continue
+        data = "INBOX:%d:%s" % (target, suffix)
+        if len(data.encode("utf-8")) > CALLBACK_DATA_MAX:
+            logger.warning("Inbox callback_data too long, button skipped: %s", data)
+            continue
+        nav.append(InlineKeyboardButton(label, callback_data=data))
+    return "\n".join(msg_parts), (InlineKeyboardMarkup([nav]) if nav else None)
 
-def cmd_reply(update: Update, context: CallbackContext):
-    """Команда /reply <thread_id> <текст> — ответить пользователю."""
+def cmd_inbox(update: Update, context: CallbackContext):
+    """Команда /inbox [page] [branch] [rating<=N] — комментарии пользователей постранично."""
     user = update.effective_user
     if not is_admin(user.id):
         update.message.reply_text("❌ Доступ запрещён.")
         return
     
-    args = context.args
-    if len(args) < 2:
-        update.message.reply_text("Использование: /reply <thread_id> <текст ответа>")
+    page, branch, max_rating = parse_inbox_args(context.args)
+    if branch is not None and branch not in INBOX_BRANCHES:
+        update.message.reply_text("❌ Неизвестная ветка «%s». Доступны: %s" % (branch[:32], ", ".join(INBOX_BRANCHES)))
         return
+    text, kb = render_inbox(user.id, page, branch, max_rating)
+    update.message.reply_text(text, reply_markup=kb)
+
+def parse_stats_args(args):
+    """/stats [N | Nh | YYYY-MM-DD [YYYY-MM-DD]] [branch] -> (period, since, until, branch, label).
+
+    since/until — начала первой и последней корзины (UTC).
+    """
+    now = now_ts()
+    period, n, dates, branch = "d", 7, [], None
+    for a in args or []:
+        a = a.strip()
+        m = re.match(r"^(\d+)([hd]?)$", a, flags=re.I)
+        if m:
+            n = max(1, int(m.group(1)))
+            period = "h" if m.group(2).lower() == "h" else "d"
+        elif re.match(r"^\d{4}-\d{2}-\d{2}$", a):
+            try:
+                dt = datetime.strptime(a, "%Y-%m-%d")
+            except ValueError:
+                continue
+            dates.append(int((dt - datetime(1970, 1, 1)).total_seconds()))
+        elif a and a != "-":
+            branch = a
+    if dates:
+        since, until = min(dates), max(dates)
+        label = time.strftime("%Y-%m-%d", time.gmtime(since))
+        if until != since:
+            label += " — " + time.strftime("%Y-%m-%d", time.gmtime(until))
+        return "d", since, until, branch, label
+    size = PERIODS[period]
+    until = now - now % size
+    since = until - (n - 1) * size
+    label = ("последние %d ч" if period == "h" else "последние %d дн.") % n
+    return period, since, until, branch, label
+
+def _rollup_rows_from_logs(period, since, until, branch):
+    """Запасной путь без индекса: счётчики по событиям окна из логов."""
+    flush_event_log()
+    rollups = Rollups(periods=(period,))
+    end = until + PERIODS[period] - 1
+    for path, name in ((DIALOGS_LOG, "dialogs"), (FEEDBACK_LOG, "feedback")):
+        for event in iter_log_events(path, since=since, until=end):
+            rollups.add(name, event)
+    return [r for r in rollups.rows(period)
+            if since <= r[1] <= until and (branch is None or r[2] == branch)]
+
+def _pct(part, whole):
+    return "%.0f%%" % (100.0 * part / whole) if whole else "—"
+
+def render_stats(period, since, until, branch=None, label=""):
+    """Текст /stats по rollups за окно."""
+    if LOG_INDEX is not None:
+        rows = LOG_INDEX.rollup_rows(period, since, until, branch=branch)
+    else:
+        rows = _rollup_rows_from_logs(period, since, until, branch)
+    s = summarize(rows)
+    t = s["total"]
     
-    thread_id = args[0]
-    reply_text = " ".join(args[1:])
+    lines = ["📈 Статистика: %s (UTC)%s" % (label, " — ветка %s" % branch if branch else "")]
+    lines.append("Сообщений: %d | Ответов: %d" % (t["messages"], t["answers"]))
+    lines.append("RAG: %s | GigaChat: %s" % (_pct(t["rag_used"], t["answers"]), _pct(t["gigachat_used"], t["answers"])))
+    lines.append("Оценки: " + " ".join("⭐%d: %d" % (i, t["r%d" % i]) for i in range(1, 7)))
+    lines.append("Средняя (1-5): %.2f | ⭐6: %d" % (t["avg_rating_1_5"], t["r6"]))
+    lines.append("Комментариев: %d | Ответов админов: %d" % (t["comments"], t["admin_replies"]))
     
-    # Находим пользователя по thread_id
-    target_user_id = None
-    target_chat_id = None
+    branches = [(b, c) for b, c in s["branches"].items() if b and (c["answers"] or c["ratings_1_5"] or c["r6"])]
+    if branches and not branch:
+        lines.append("\nПо веткам:")
+        for b, c in sorted(branches, key=lambda x: -x[1]["answers"]):
+            lines.append("- %s: ответов %d, RAG %s, ср. %.2f, ⭐6 %d" % (
+                b, c["answers"], _pct(c["rag_used"], c["answers"]), c["avg_rating_1_5"], c["r6"]))
+    return "\n".join(lines)
+
+def cmd_stats(update: Update, context: CallbackContext):
+    """Команда /stats [N | Nh | YYYY-MM-DD [YYYY-MM-DD]] [branch] — статистика за период."""
+    user = update.effective_user
+    if not is_admin(user.id):
+        update.message.reply_text("❌ Доступ запрещён.")
+        return
     
-    if os.path.exists(DIALOGS_LOG):
-        with open(DIALOGS_LOG, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    event = json.loads(line)
-                    if event.get("thread_id") == thread_id:
-                        target_user_id = event.get("user_id")
-                        target_chat_id = event.get("chat_id")
-                        break
-                except Exception:
-                    continue
+    period, since, until, branch, label = parse_stats_args(context.args)
+    update.message.reply_text(render_stats(period, since, until, branch, label))
+
+def find_thread_target(thread_id):
+    """thread_id или answer_id -> (user_id, chat_id, thread_id)."""
+    if LOG_INDEX is not None:
+        for attempt in range(2):
+            row = LOG_INDEX.lookup_thread(thread_id) or LOG_INDEX.lookup_answer(thread_id)
+            if row:
+                return row.get("user_id"), row.get("chat_id"), row.get("thread_id") or thread_id
+            # событие могло ещё лежать в очереди писателя
+            flush_event_log()
+        return None, None, thread_id
+    
+    # Без индекса — полный проход по логу
+    flush_event_log()
+    for event in iter_log_events(DIALOGS_LOG):
+        if event.get("thread_id") == thread_id:
+            return event.get("user_id"), event.get("chat_id"), thread_id
+    return None, None, thread_id
+
+def send_admin_reply(bot, target, reply_text, admin_id=None, via=None):
+    """Отправляет ответ админа по thread_id/answer_id и пишет его в dialogs.jsonl.
+
+    Возвращает (ok, текст результата для админа).
+    """
+    target_user_id, target_chat_id, thread_id = find_thread_target(target)
     
     if not target_user_id:
-        update.message.reply_text("❌ Пользователь с thread_id %s не найден." % thread_id)
-        return
+        return False, "❌ Пользователь с thread_id %s не найден." % thread_id
     
     # Пытаемся отправить в личку (приоритет)
     sent = False
+    result = "❌ Не удалось отправить ответ."
     try:
-        context.bot.send_message(chat_id=target_user_id, text=reply_text)
+        bot.send_message(chat_id=target_user_id, text=reply_text)
         sent = True
-        update.message.reply_text("✅ Ответ отправлен в личку пользователю %s" % target_user_id)
+        result = "✅ Ответ отправлен в личку пользователю %s" % target_user_id
     except Exception as e:
         logger.warning("Failed to send DM to %s: %s", target_user_id, e)
         # Fallback: отправляем в последний чат
         if target_chat_id:
             try:
-                context.bot.send_message(chat_id=target_chat_id, text=reply_text)
+                bot.send_message(chat_id=target_chat_id, text=reply_text)
                 sent = True
-                # Предлагаем кнопку для открытия лички
-                update.message.reply_text(
+                result = (
                     "✅ Ответ отправлен в чат %s (личка недоступна).\n"
                     "Пользователь может открыть личку через /start" % target_chat_id
                 )
             except Exception as e2:
                 logger.error("Failed to send to chat %s: %s", target_chat_id, e2)
-                update.message.reply_text("❌ Не удалось отправить ответ.")
     
     if sent:
         # Сохраняем ответ админа
+        meta = {"admin_id": admin_id}
+        if via:
+            meta["via"] = via
         safe_write_jsonl(DIALOGS_LOG, {
             "ts": now_ts(),
             "user_id": target_user_id,
@@ -1085,7 +1866,7 @@ def cmd_reply(update: Update, context: CallbackContext):
             "role": "admin",
             "text": reply_text,
             "thread_id": thread_id,
-            "meta": {"admin_id": user.id}
+            "meta": meta
         })
         
         # Обновляем состояние пользователя (dm_available)
@@ -1093,6 +1874,32 @@ def cmd_reply(update: Update, context: CallbackContext):
         update_user_state_persistent(target_user_id, {
             "dm_available": (target_chat_id == target_user_id) if target_chat_id else False
         })
+    return sent, result
+
+def cmd_reply(update: Update, context: CallbackContext):
+    """Команда /reply <thread_id|answer_id> <текст> — ответить пользователю."""
+    user = update.effective_user
+    if not is_admin(user.id):
+        update.message.reply_text("❌ Доступ запрещён.")
+        return
+    
+    args = context.args
+    if len(args) < 2:
+        update.message.reply_text("Использование: /reply <thread_id|answer_id> <текст ответа>")
+        return
+    
+    _, result = send_admin_reply(context.bot, args[0], " ".join(args[1:]), admin_id=user.id)
+    update.message.reply_text(result)
+
+def job_dashboard_reply(context: CallbackContext):
+    """Ответ из живого дашборда (POST /api/reply): отправка в потоке job_queue бота."""
+    job = context.job.context
+    try:
+        ok, result = send_admin_reply(context.bot, job["target"], job["text"], via="live_dashboard")
+    except Exception as e:
+        logger.error("Dashboard reply to %s failed: %s", job["target"], e)
+        ok, result = False, "❌ Ошибка отправки: %s" % e
+    job["done"](ok, result)
 
 # -----------------------------
 # Error handler
@@ -1120,6 +1927,13 @@ def main():
         except Exception as e:
             logger.warning("Failed to parse ADMIN_IDS: %s", e)
     
+    # TTL выгрузки неактивных пользователей в архив
+    global STATE_TTL_DAYS
+    try:
+        STATE_TTL_DAYS = float(os.getenv("STATE_TTL_DAYS", "30").strip() or 0)
+    except Exception as e:
+        logger.warning("Failed to parse STATE_TTL_DAYS: %s", e)
+    
     # Предзагрузка content & kb
     try:
         content = load_content()
@@ -1135,21 +1949,160 @@ def main():
     except Exception as e:
         logger.info("KB index init failed: %s", e)
     
+    try:
+        init_gigachat()
+    except Exception as e:
+        logger.warning("GigaChat client init failed: %s", e)
+    
+    global LLM_CACHE
+    try:
+        cache_ttl = float(os.getenv("LLM_CACHE_TTL_HOURS", "168").strip() or 0)
+        if cache_ttl > 0:
+            LLM_CACHE = LLMCache(
+                LLM_CACHE_PATH,
+                ttl=int(cache_ttl * 3600),
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "50").strip() or 0) * 1024 * 1024),
+            )
+    except Exception as e:
+        logger.warning("LLM cache init failed, calling GigaChat directly: %s", e)
+        LLM_CACHE = None
+    
+    global FAQ_MATCHER
+    if os.getenv("FAQ_ENABLED", "1").strip() != "0":
+        try:
+            FAQ_MATCHER = FaqMatcher(
+                os.getenv("FAQ_ANSWERS_PATH", FAQ_ANSWERS_PATH).strip() or FAQ_ANSWERS_PATH,
+                min_score=float(os.getenv("FAQ_MIN_SCORE", "0.75").strip() or 0.75),
+            )
+        except Exception as e:
+            logger.warning("FAQ answers init failed: %s", e)
+            FAQ_MATCHER = None
+    
+    global CONVERSATION_MEMORY
+    try:
+        memory_tokens = int(os.getenv("MEMORY_TOKENS", "1200").strip() or 0)
+        summary_tokens = int(os.getenv("MEMORY_SUMMARY_TOKENS", "150").strip() or 150)
+    except ValueError:
+        logger.warning("Failed to parse MEMORY_TOKENS/MEMORY_SUMMARY_TOKENS, using defaults")
+        memory_tokens, summary_tokens = 1200, 150
+    if memory_tokens > 0:
+        CONVERSATION_MEMORY = ConversationMemory(memory_tokens, summary_tokens, summarize=summarize_turns)
+    
+    # Пул для ответов LLM: handle_text только ставит задачу в очередь
+    global LLM_EXECUTOR
+    try:
+        LLM_EXECUTOR = LLMExecutor(
+            max_workers=int(os.getenv("LLM_WORKERS", "4").strip() or 4),
+            max_queue=int(os.getenv("LLM_QUEUE_MAX", "50").strip() or 0),
+        )
+    except Exception as e:
+        logger.warning("LLM executor init failed, answering in dispatcher threads: %s", e)
+        LLM_EXECUTOR = None
+    
+    # Фоновая запись логов событий
+    global EVENT_WRITER
+    try:
+        EVENT_WRITER = EventWriter(
+            flush_interval=float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0").strip() or 1.0),
+            fsync=os.getenv("EVENT_FSYNC", "1").strip() != "0",
+            max_queue=int(os.getenv("EVENT_QUEUE_SIZE", "10000").strip() or 10000),
+            rotate_daily=os.getenv("EVENT_ROTATE_DAILY", "1").strip() != "0",
+            rotate_max_bytes=int(float(os.getenv("EVENT_ROTATE_MAX_MB", "64").strip() or 0) * 1024 * 1024),
+        )
+        EVENT_WRITER.start()
+    except Exception as e:
+        logger.warning("Event writer init failed, writing synchronously: %s", e)
+        EVENT_WRITER = None
+    
+    # Индекс тредов для /reply: обновляется писателем событий, при первом запуске строится по логам,
+    # при последующих — дочитывает то, что записано после прошлой остановки
+    global LOG_INDEX
+    if EVENT_WRITER is not None:
+        try:
+            LOG_INDEX = LogIndex(LOG_INDEX_PATH)
+            if LOG_INDEX.needs_rebuild():
+                LOG_INDEX.rebuild(DIALOGS_LOG, FEEDBACK_LOG)
+            else:
+                LOG_INDEX.catch_up(DIALOGS_LOG, FEEDBACK_LOG)
+            EVENT_WRITER.add_listener(LOG_INDEX.on_events)
+        except Exception as e:
+            logger.warning("Log index init failed, /reply will scan logs: %s", e)
+            LOG_INDEX = None
+    
+    # Компактная бинарная копия логов (EVENT_LOG_BINARY=1), JSONL остаётся основным
+    binary_log = None
+    if EVENT_WRITER is not None and os.getenv("EVENT_LOG_BINARY", "0").strip() == "1":
+        binary_log = BinaryEventLog(EVB_DIR)
+        EVENT_WRITER.add_listener(binary_log.on_events)
+    
     updater = Updater(token=bot_token, use_context=True)
     dp = updater.dispatcher
     
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("status", status))
     dp.add_handler(CommandHandler("inbox", cmd_inbox))
+    dp.add_handler(CommandHandler("stats", cmd_stats))
     dp.add_handler(CommandHandler("reply", cmd_reply))
     dp.add_handler(CallbackQueryHandler(on_callback))
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text))
     
     dp.add_error_handler(on_error)
     
+    if STATE_TTL_DAYS > 0:
+        updater.job_queue.run_repeating(job_evict_inactive_users, interval=STATE_EVICT_INTERVAL, first=10)
+    
+    # Живой дашборд (LIVE_DASHBOARD_PORT): агрегаты в памяти, SSE и ответы админа без cron
+    live_dashboard = None
+    try:
+        live_port = int(os.getenv("LIVE_DASHBOARD_PORT", "0").strip() or 0)
+    except Exception as e:
+        logger.warning("Failed to parse LIVE_DASHBOARD_PORT: %s", e)
+        live_port = 0
+    if live_port and EVENT_WRITER is None:
+        logger.warning("Live dashboard needs the event writer, disabled")
+    elif live_port:
+        def queue_reply(target, text, done):
+            updater.job_queue.run_once(job_dashboard_reply, 0,
+                                       context={"target": target, "text": text, "done": done})
+        try:
+            live_dashboard = LiveDashboard(
+                DASH_DIR, DIALOGS_LOG, FEEDBACK_LOG,
+                reply_fn=queue_reply,
+                token=os.getenv("LIVE_DASHBOARD_TOKEN", "").strip(),
+            )
+            # Listener — до start(): пачки, записанные во время первичной сборки, копятся в _pending
+            EVENT_WRITER.add_listener(live_dashboard.on_events)
+            live_dashboard.start(os.getenv("LIVE_DASHBOARD_HOST", "127.0.0.1").strip() or "127.0.0.1", live_port)
+        except Exception as e:
+            logger.error("Live dashboard disabled: %s", e)
+            if live_dashboard is not None:
+                EVENT_WRITER.remove_listener(live_dashboard.on_events)
+            live_dashboard = None
+    
     logger.info("Bot starting polling...")
     updater.start_polling(clean=True)
     updater.idle()
+    
+    if live_dashboard is not None:
+        live_dashboard.stop()
+    
+    # Дожидаемся ответов, которые уже готовятся (их события попадут в очередь логов)
+    if LLM_EXECUTOR is not None:
+        logger.info("Waiting for LLM tasks: %s", LLM_EXECUTOR.stats())
+        LLM_EXECUTOR.shutdown(wait=True)
+    
+    # Дописываем очередь событий перед выходом
+    if EVENT_WRITER is not None:
+        logger.info("Draining event queue: %d pending", EVENT_WRITER.qsize())
+        EVENT_WRITER.close()
+    if binary_log is not None:
+        binary_log.close()
+    if GIGACHAT is not None:
+        GIGACHAT.close()
+    if LLM_CACHE is not None:
+        st = LLM_CACHE.stats()
+        logger.info("LLM cache: hits=%d misses=%d evicted=%d", st["hits"], st["misses"], st["evicted"])
+        LLM_CACHE.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Общие фикстуры тестов."""
+
+import os
+import sys
+import json
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+
+@pytest.fixture
+def mock_gigachat():
+    """Фабрика mock GigaChat (scripts/mock_gigachat.py) на свободном порту: start(*argv) -> server.
+
+    server.url — адрес API, server.state.counters — счётчики запросов.
+    """
+    import mock_gigachat as mock
+    servers = []
+
+    def start(*argv):
+        args = mock.build_parser().parse_args(["--port", "0", "--latency-ms", "0", "--latency-sd", "0",
+                                               "--chunk-ms", "0"] + list(argv))
+        server = mock.make_server(args)
+        server.url = "http://127.0.0.1:%d" % server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def append_jsonl():
+    """append(path, *events) — дописывает события строками JSONL, как EventWriter."""
+    def append(path, *events):
+        with open(str(path), "a", encoding="utf-8") as f:
+            for e in events:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    return append
+
+
+@pytest.fixture
+def dashboard_logs(tmp_path, monkeypatch):
+    """scripts/build_dashboard.py на логах, чекпоинте и папке дашборда во временном каталоге.
+
+    Возвращает пути (dialogs, feedback); разбор — в текущем процессе (WORKERS=1).
+    """
+    import build_dashboard
+    dialogs = str(tmp_path / "dialogs.jsonl")
+    feedback = str(tmp_path / "feedback.jsonl")
+    monkeypatch.setattr(build_dashboard, "DIALOGS_PATH", dialogs)
+    monkeypatch.setattr(build_dashboard, "FEEDBACK_PATH", feedback)
+    monkeypatch.setattr(build_dashboard, "CHECKPOINT_PATH", str(tmp_path / "checkpoint.json"))
+    monkeypatch.setattr(build_dashboard, "DASH_DIR", str(tmp_path / "dashboard"))
+    monkeypatch.setattr(build_dashboard, "WORKERS", 1)
+    return dialogs, feedback
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Память разговора для промпта: последние реплики треда + краткое содержание старых.
+
+Память — словарь в состоянии пользователя (state.json, ключ "memory"):
+    {"thread_id", "summary", "turns": [{"ts", "q", "a"}], "overflow": [...]}
+- turns — последние вопросы/ответы, не больше max_tokens (оценка по длине);
+  вопрос обрезается до QUESTION_CHARS, ответ — до ANSWER_CHARS
+- при переполнении старые реплики уходят в overflow — до половины лимита,
+  чтобы сжатие шло раз в несколько сообщений, а не на каждое
+- compact() сворачивает overflow в summary (summarize — обычно GigaChat,
+  при ошибке — список прежних вопросов) и результат хранится в памяти
+  треда: промпт использует готовое summary, а не пересчитывает его
+- render() — блок для промпта; его размер ограничен max_tokens + summary_tokens,
+  сколько бы ни длился разговор
+
+Смена thread_id обнуляет память.
+"""
+
+import time
+
+# Реплики в памяти обрезаются (длинные ответы бота — с начала): ~250 токенов на пару
+QUESTION_CHARS = 300
+ANSWER_CHARS = 450
+# Сколько реплик может ждать сжатия, если оно не успевает (очередь LLM занята)
+MAX_OVERFLOW = 20
+
+
+def estimate_tokens(text):
+    """Грубая оценка токенов: ~3 символа на токен для русского текста."""
+    return (len(text or "") + 2) // 3
+
+
+def _clip(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _clip_tail(text, limit):
+    """Оставляет конец текста (самое свежее в summary)."""
+    return text if len(text) <= limit else "…" + text[-(limit - 1):].lstrip()
+
+
+def _turn_tokens(turn):
+    return estimate_tokens(turn["q"]) + estimate_tokens(turn["a"])
+
+
+def compact_case(case_context, limit=300):
+    """Ответы анкеты кейса для промпта (без служебных полей), каждый не длиннее limit."""
+    answers = (case_context or {}).get("answers") or {}
+    labels = (("when_what", "что и когда заблокировано"), ("bank_reason", "причина банка"),
+              ("operation", "операция"))
+    parts = ["%s: %s" % (label, _clip(answers[key], limit)) for key, label in labels if answers.get(key)]
+    return "; ".join(parts)
+
+
+class ConversationMemory(object):
+    def __init__(self, max_tokens=1200, summary_tokens=150, summarize=None):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize  # fn(prev_summary, turns) -> текст или None
+        self.compactions = 0
+        self.fallbacks = 0
+
+    def for_thread(self, memory, thread_id):
+        """Память треда thread_id (пустая, если сохранена для другого треда)."""
+        if memory and memory.get("thread_id") == thread_id:
+            return memory
+        return {"thread_id": thread_id, "summary": "", "turns": [], "overflow": []}
+
+    def add(self, memory, thread_id, question, answer):
+        """Новая память с репликой; старые реплики сверх лимита уходят в overflow."""
+        mem = self.for_thread(memory, thread_id)
+        turns = list(mem["turns"]) + [{"ts": time.time(), "q": _clip(question, QUESTION_CHARS),
+                                       "a": _clip(answer, ANSWER_CHARS)}]
+        overflow = list(mem.get("overflow") or [])
+        if sum(_turn_tokens(t) for t in turns) > self.max_tokens:
+            while len(turns) > 1 and sum(_turn_tokens(t) for t in turns) > self.max_tokens // 2:
+                overflow.append(turns.pop(0))
+        return dict(mem, turns=turns, overflow=overflow[-MAX_OVERFLOW:])
+
+    def needs_compact(self, memory):
+        return bool(memory and memory.get("overflow"))
+
+    def compact(self, memory):
+        """(overflow, summary) для apply(): сжимает реплики из overflow в summary.
+
+        Долгий вызов (LLM) — без блокировок; результат применяется через apply().
+        """
+        overflow = list(memory.get("overflow") or [])
+        prev = memory.get("summary") or ""
+        summary = None
+        if self.summarize is not None:
+            try:
+                summary = self.summarize(prev, overflow)
+            except Exception:
+                summary = None
+        if summary:
+            self.compactions += 1
+        else:
+            # Без LLM: прежнее summary + темы вопросов
+            self.fallbacks += 1
+            summary = " ".join(p for p in (prev, "Вопросы: " + "; ".join(_clip(t["q"], 80) for t in overflow)) if p)
+        return overflow, _clip_tail(" ".join(summary.split()), self.summary_tokens * 3)
+
+    def apply(self, memory, prev_summary, overflow, summary):
+        """Новая память с summary, если её не изменили, пока шло сжатие; иначе None."""
+        current = memory.get("overflow") or []
+        if (memory.get("summary") or "") != prev_summary or \
+                [t["ts"] for t in current[:len(overflow)]] != [t["ts"] for t in overflow]:
+            return None
+        return dict(memory, summary=summary, overflow=current[len(overflow):])
+
+    def render(self, memory, thread_id):
+        """Блок «история разговора» для промпта ("" — истории нет)."""
+        if not memory or memory.get("thread_id") != thread_id:
+            return ""
+        lines = []
+        if memory.get("summary"):
+            lines.append("Ранее в разговоре: %s" % memory["summary"])
+        for t in memory.get("turns") or []:
+            lines.append("Пользователь: %s" % t["q"])
+            lines.append("Бот: %s" % t["a"])
+        return "\n".join(lines)
+
+    def stats(self):
+        return {"compactions": self.compactions, "fallbacks": self.fallbacks}
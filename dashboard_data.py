@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Данные дашборда: агрегаты по логам и JSON-файлы страницы.
+
+Общий код для scripts/build_dashboard.py (статический дашборд по cron) и
+live_dashboard.py (живой сервер внутри бота): оба собирают одни и те же
+summary.json, index.json, filters.json, rollups.json и страницы тредов
+threads/<YYYY-MM>/<статус>-NNNN.json, так что страница у них одна.
+"""
+
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from rollups import FIELDS as ROLLUP_FIELDS, Rollups
+
+STATUS_SLUGS = {"новый": "new", "в работе": "work", "закрыт": "closed"}
+
+# Тредов на одну страницу-шард
+DEFAULT_PAGE_SIZE = 200
+
+# Сколько показывает страница: длина вопроса/ответа в треде, превью вопроса
+# в index.json, последние комментарии и ответы админа
+QUESTION_MAX = 2000
+ANSWER_MAX = 4000
+QUESTION_PREVIEW = 120
+THREAD_TAIL = 50
+
+def parse_ts(ts_str):
+    """Парсит timestamp (ISO или int)."""
+    if isinstance(ts_str, int):
+        return ts_str
+    if isinstance(ts_str, str):
+        try:
+            # ISO format: 2024-01-01T12:00:00Z (UTC, как в event_log.event_ts)
+            if "T" in ts_str:
+                dt = datetime.strptime(ts_str.replace("Z", ""), "%Y-%m-%dT%H:%M:%S")
+                return int((dt - datetime(1970, 1, 1)).total_seconds())
+            return int(ts_str)
+        except Exception:
+            pass
+    return 0
+
+def ts_str(ts):
+    """Форматирует timestamp в строку."""
+    try:
+        ts_val = parse_ts(ts)
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts_val))
+    except Exception:
+        return str(ts)
+
+class DashboardAggregate(object):
+    """Агрегаты дашборда за один проход по логам.
+
+    Связи строятся через индексы, без вложенных циклов по qa:
+    - thread_answers: thread_id -> answer_id в порядке появления;
+      событие без answer_id относится к первому ответу треда;
+    - события, пришедшие раньше ответа своего треда, ждут в pending_*.
+    """
+
+    def __init__(self):
+        self.qa = {}
+        self.user_name = {}
+        self.thread_to_user = {}
+        self.thread_answers = defaultdict(list)
+        self.ratings = defaultdict(list)
+        self.comments = defaultdict(list)
+        self.admin_replies = defaultdict(list)
+        self.pending_feedback = defaultdict(list)
+        self.pending_admin = defaultdict(list)
+        # Первые ответы тредов из уже свёрнутых кусков лога (разбор feedback по частям).
+        # В чекпоинт не пишется.
+        self.known_answers = None
+        self.rollups = Rollups(periods=("d",))
+
+    def to_dict(self):
+        """Состояние для чекпоинта: только то, что нужно build() для следующих запусков.
+
+        Полные тексты вопроса и ответа сюда не попадают — остаётся превью
+        вопроса "q" для index.json; тексты хранит вызывающий (build_dashboard
+        пишет их в отдельный файл и кладёт позицию в qa[...]["text_at"]).
+        Комментарии и ответы админа — последние THREAD_TAIL, больше страница не показывает.
+        """
+        qa = {}
+        for aid, base in self.qa.items():
+            item = {k: v for k, v in base.items() if k not in ("question", "answer")}
+            if "question" in base:
+                item["q"] = (base["question"] or "")[:QUESTION_PREVIEW]
+            qa[aid] = item
+        return {
+            "qa": qa,
+            "user_name": self.user_name,
+            "thread_to_user": self.thread_to_user,
+            "thread_answers": self.thread_answers,
+            "ratings": self.ratings,
+            "comments": {aid: c[-THREAD_TAIL:] for aid, c in self.comments.items()},
+            "admin_replies": {aid: a[-THREAD_TAIL:] for aid, a in self.admin_replies.items()},
+            "pending_feedback": self.pending_feedback,
+            "pending_admin": self.pending_admin,
+            "rollups": self.rollups.rows(),
+            "rollup_ratings": self.rollups.ratings,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        agg = cls()
+        agg.qa = data.get("qa") or {}
+        # ключи JSON — строки, user_id хранится числом
+        agg.user_name = {int(k): v for k, v in (data.get("user_name") or {}).items()}
+        agg.thread_to_user = data.get("thread_to_user") or {}
+        for name in ("thread_answers", "ratings", "comments", "admin_replies",
+                     "pending_feedback", "pending_admin"):
+            getattr(agg, name).update(data.get(name) or {})
+        agg.rollups = Rollups.from_rows(data.get("rollups"), periods=("d",), ratings=data.get("rollup_ratings"))
+        return agg
+
+    def add_dialog(self, e):
+        self.rollups.add("dialogs", e)
+        uid = e.get("user_id")
+        thread_id = e.get("thread_id")
+        if uid:
+            if e.get("user_name"):
+                self.user_name[int(uid)] = e.get("user_name")
+            if thread_id:
+                self.thread_to_user[thread_id] = int(uid)
+        
+        # Ответы бота
+        if e.get("role") == "bot":
+            meta = e.get("meta", {})
+            answer_id = meta.get("answer_id")
+            if answer_id:
+                if answer_id not in self.qa and thread_id:
+                    self.thread_answers[thread_id].append(answer_id)
+                self.qa[answer_id] = {
+                    "question": meta.get("question", ""),
+                    "answer": e.get("text", ""),
+                    "user_id": int(uid or 0),
+                    "user_name": e.get("user_name", ""),
+                    "thread_id": thread_id,
+                    "branch": meta.get("branch"),
+                    "ts": e.get("ts", 0),
+                }
+                if thread_id and len(self.thread_answers[thread_id]) == 1:
+                    self._resolve_pending(thread_id)
+        
+        # Ответы админов
+        elif e.get("role") == "admin" and thread_id:
+            aid = self.first_answer(thread_id)
+            if aid:
+                self._add_admin_reply(aid, e)
+            else:
+                self.pending_admin[thread_id].append(e)
+
+    def add_feedback(self, e):
+        self.rollups.add("feedback", e)
+        aid = e.get("answer_id")
+        if not aid:
+            # Может быть привязан к thread_id
+            thread_id = e.get("thread_id")
+            if not thread_id:
+                return
+            aid = self.first_answer(thread_id)
+            if not aid:
+                self.pending_feedback[thread_id].append(e)
+                return
+        self._add_feedback(aid, e)
+
+    def first_answer(self, thread_id):
+        answers = self.thread_answers.get(thread_id)
+        if answers:
+            return answers[0]
+        if self.known_answers:
+            return self.known_answers.get(thread_id)
+        return None
+
+    def merge(self, other):
+        """reduce: добавляет агрегат следующего куска лога (его события идут после наших).
+
+        Результат совпадает с последовательным проходом, если feedback-куски
+        разобраны с known_answers по всем dialogs (так делает collect).
+        """
+        self.user_name.update(other.user_name)
+        self.thread_to_user.update(other.thread_to_user)
+        self.rollups.merge(other.rollups)
+        
+        # Ответы: у треда, уже имеющего первый ответ, ответы админа из other
+        # привязаны к первому ответу other — переносим их на наш
+        remap = {}
+        new_threads = []
+        for thread_id, aids in other.thread_answers.items():
+            first = self.first_answer(thread_id)
+            if first is None:
+                new_threads.append(thread_id)
+            elif aids and aids[0] != first:
+                remap[aids[0]] = first
+            for aid in aids:
+                if aid not in self.qa:
+                    self.thread_answers[thread_id].append(aid)
+        self.qa.update(other.qa)
+        
+        # Наши ожидающие события получили ответ только в other — они раньше событий other
+        for thread_id in new_threads:
+            if self.first_answer(thread_id):
+                self._resolve_pending(thread_id)
+        
+        for aid, items in other.ratings.items():
+            self.ratings[aid].extend(items)
+        for aid, items in other.comments.items():
+            self.comments[aid].extend(items)
+        for aid, items in other.admin_replies.items():
+            self.admin_replies[remap.get(aid, aid)].extend(items)
+        
+        for thread_id, events in other.pending_feedback.items():
+            aid = self.first_answer(thread_id)
+            for e in events:
+                if aid:
+                    self._add_feedback(aid, e)
+                else:
+                    self.pending_feedback[thread_id].append(e)
+        for thread_id, events in other.pending_admin.items():
+            aid = self.first_answer(thread_id)
+            for e in events:
+                if aid:
+                    self._add_admin_reply(aid, e)
+                else:
+                    self.pending_admin[thread_id].append(e)
+
+    def _resolve_pending(self, thread_id):
+        aid = self.thread_answers[thread_id][0]
+        for e in self.pending_feedback.pop(thread_id, []):
+            self._add_feedback(aid, e)
+        for e in self.pending_admin.pop(thread_id, []):
+            self._add_admin_reply(aid, e)
+
+    def _add_feedback(self, aid, e):
+        rating = e.get("rating")
+        if rating is not None:
+            self.ratings[aid].append(int(rating))
+        
+        comment = e.get("comment") or e.get("text")
+        if comment and comment.strip():
+            self.comments[aid].append({
+                "text": comment,
+                "ts": parse_ts(e.get("ts", 0)),
+                "ts_str": ts_str(e.get("ts", 0)),
+                "user_id": e.get("user_id"),
+            })
+
+    def _add_admin_reply(self, aid, e):
+        self.admin_replies[aid].append({
+            "text": e.get("text", ""),
+            "ts": e.get("ts", 0),
+            "ts_str": ts_str(e.get("ts", 0)),
+        })
+
+    def build(self):
+        """Треды и сводная статистика.
+
+        У ответов из чекпоинта (без полного текста) question — превью "q", answer пустой.
+        """
+        threads = []
+        total_ratings = 0
+        paid_6 = 0
+        sum_1_5 = 0
+        cnt_1_5 = 0
+        answers_with_rating = 0
+        branch_stats = defaultdict(int)
+        
+        for aid, base in self.qa.items():
+            r = self.ratings.get(aid, [])
+            c = self.comments.get(aid, [])
+            a = self.admin_replies.get(aid, [])
+            
+            if r:
+                answers_with_rating += 1
+            
+            total_ratings += len(r)
+            paid_6 += sum(1 for x in r if x == 6)
+            r15 = [x for x in r if 1 <= x <= 5]
+            # Средняя по всем ответам — по последней оценке каждого, как в rollups (/stats)
+            if r and 1 <= r[-1] <= 5:
+                sum_1_5 += r[-1]
+                cnt_1_5 += 1
+            avg_1_5 = (sum(r15) / len(r15)) if r15 else 0.0
+            
+            branch = base.get("branch") or "unknown"
+            branch_stats[branch] += 1
+            
+            uid = int(base.get("user_id") or 0)
+            uname = base.get("user_name") or self.user_name.get(uid, "")
+            
+            # Статус: новый/в работе/закрыт
+            status = "новый"
+            if a:
+                status = "закрыт"
+            elif c:
+                status = "в работе"
+            
+            threads.append({
+                "answer_id": aid,
+                "thread_id": base.get("thread_id", ""),
+                "user_id": uid,
+                "user_name": uname,
+                "question": (base.get("question") or base.get("q") or "")[:QUESTION_MAX],
+                "answer": (base.get("answer") or "")[:ANSWER_MAX],
+                "ratings": {
+                    "count": len(r),
+                    "avg_1_5": round(avg_1_5, 2),
+                    "paid_6": sum(1 for x in r if x == 6),
+                    "all": r,
+                },
+                "comments": c[-THREAD_TAIL:],
+                "admin_replies": a[-THREAD_TAIL:],
+                "branch": branch,
+                "ts": base.get("ts", 0),
+                "ts_str": ts_str(base.get("ts", 0)),
+                "status": status,
+            })
+        
+        # Сортируем треды (новые комментарии первыми)
+        threads.sort(key=lambda x: (
+            x["comments"][-1]["ts"] if x["comments"] else 0,
+            x["ratings"]["count"]
+        ), reverse=True)
+        
+        # Статистика
+        stats = {
+            "generated_ts": int(time.time()),
+            "generated_ts_str": ts_str(int(time.time())),
+            "answers_with_rating": answers_with_rating,
+            "total_ratings": total_ratings,
+            "avg_rating_1_5": round((sum_1_5 / cnt_1_5) if cnt_1_5 else 0.0, 2),
+            "paid_star_6": paid_6,
+            "threads": len(threads),
+            "branch_stats": dict(branch_stats),
+        }
+        return stats, threads
+
+def shard_threads(threads, page_size=DEFAULT_PAGE_SIZE):
+    """Режет треды на страницы по месяцу и статусу. Возвращает (шарды, страницы, строки индекса)."""
+    groups = {}
+    for t in threads:
+        month = time.strftime("%Y-%m", time.gmtime(parse_ts(t.get("ts", 0))))
+        groups.setdefault((month, t["status"]), []).append(t)
+    
+    shards = []
+    pages = []
+    rows = []
+    for (month, status) in sorted(groups.keys(), reverse=True):
+        items = groups[(month, status)]
+        for n, i in enumerate(range(0, len(items), page_size), 1):
+            page = items[i:i + page_size]
+            shard_idx = len(shards)
+            shards.append({
+                "file": "threads/%s/%s-%04d.json" % (month, STATUS_SLUGS.get(status, "other"), n),
+                "month": month,
+                "status": status,
+                "count": len(page),
+            })
+            pages.append(page)
+            for t in page:
+                last_comment = t["comments"][-1]["text"] if t["comments"] else ""
+                rows.append({
+                    "id": t["answer_id"],
+                    "ts": t["ts"],
+                    "ts_str": t["ts_str"],
+                    "u": t["user_id"],
+                    "n": t["user_name"],
+                    "b": t["branch"],
+                    "s": t["status"],
+                    "r": t["ratings"]["all"],
+                    "p6": t["ratings"]["paid_6"],
+                    "cc": len(t["comments"]),
+                    "cp": last_comment[:80],
+                    "q": (t["question"] or "")[:QUESTION_PREVIEW],
+                    "sh": shard_idx,
+                })
+    # строки в общем порядке тредов (новые комментарии первыми)
+    order = {t["answer_id"]: i for i, t in enumerate(threads)}
+    rows.sort(key=lambda r: order.get(r["id"], 0))
+    return shards, pages, rows
+
+def build_filter_index(rows):
+    """Позиции строк index.json (по возрастанию) для каждого значения фильтра.
+
+    Дни — в UTC, как суточные корзины rollups: фильтр по датам и карточки за период совпадают.
+    """
+    index = {
+        "n": len(rows),
+        "branch": {},
+        "status": {},
+        "rating": {},
+        "day": {},
+        "has_comment": [],
+        "paid_6": [],
+    }
+    for i, r in enumerate(rows):
+        if r["b"]:
+            index["branch"].setdefault(r["b"], []).append(i)
+        index["status"].setdefault(r["s"], []).append(i)
+        for rating in sorted(set(r["r"] or [])):
+            index["rating"].setdefault(str(rating), []).append(i)
+        day = time.strftime("%Y-%m-%d", time.gmtime(parse_ts(r["ts"] or 0)))
+        index["day"].setdefault(day, []).append(i)
+        if r["cc"]:
+            index["has_comment"].append(i)
+        if r["p6"]:
+            index["paid_6"].append(i)
+    return index
+
+def build_payloads(stats, threads, rollups=None, page_size=DEFAULT_PAGE_SIZE):
+    """Все JSON-файлы dashboard/data/: {относительный путь: объект}."""
+    shards, pages, rows = shard_threads(threads, page_size)
+    payloads = {}
+    for shard, page in zip(shards, pages):
+        payloads[shard["file"]] = {"threads": page}
+    payloads["index.json"] = {"rows": rows}
+    payloads["filters.json"] = build_filter_index(rows)
+    payloads["rollups.json"] = {
+        "period": "d",
+        "fields": ROLLUP_FIELDS,
+        "rows": [list(r[1:]) for r in (rollups.rows("d") if rollups else [])],
+    }
+    payloads["summary.json"] = {
+        "generated_ts": stats["generated_ts"],
+        "stats": stats,
+        "page_size": page_size,
+        "shards": shards,
+    }
+    return payloads
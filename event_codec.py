@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактное бинарное представление событий dialogs/feedback (*.evb).
+
+Пишется рядом с JSONL (не вместо него), если EVENT_LOG_BINARY=1:
+data/evb/<имя>-YYYYMMDD.evb — по файлу на сутки (UTC).
+
+Формат файла:
+- заголовок: b"AEVB" + байт версии формата
+- дальше кадры: varint(длина) + тело; первый байт тела — тип кадра
+  0x01 KEY_DEF  varint id, str  — имя ключа (user_name, thread_id, ...)
+  0x02 VAL_DEF  varint id, str  — интернированное значение (роль, ветка, статус)
+  0x03 RECORD   varint schema, value — событие
+  0x04 BLOCK    zlib(последовательность кадров) — пачка EventWriter целиком
+- значения с тегом: None/False/True, int (zigzag varint), float, строка,
+  ссылка на интернированную строку, dict (ключи по id), list и отдельный тег
+  «вопрос = последний текст пользователя» для meta.question ответов бота.
+
+Словари живут в пределах одного файла, поэтому каждый .evb читается
+независимо. Выгрузка обратно в JSONL: scripts/export_events.py.
+Для аналитики без текстов сообщений: iter_evb_events(path, text=False) —
+длинные текстовые поля пропускаются без декодирования.
+"""
+
+import os
+import zlib
+import struct
+import time
+import logging
+
+from event_log import log_name
+
+logger = logging.getLogger("AiAntiblokBot")
+
+MAGIC = b"AEVB"
+FORMAT_VERSION = 1
+# Версия схемы записи: меняется, если меняется смысл полей событий
+SCHEMA_VERSION = 1
+
+FRAME_KEY_DEF = 0x01
+FRAME_VAL_DEF = 0x02
+FRAME_RECORD = 0x03
+FRAME_BLOCK = 0x04
+
+T_NONE = 0x00
+T_FALSE = 0x01
+T_TRUE = 0x02
+T_INT = 0x03
+T_FLOAT = 0x04
+T_STR = 0x05
+T_STR_REF = 0x06
+T_DICT = 0x07
+T_LIST = 0x08
+T_SAME_AS_USER_TEXT = 0x09
+
+# Поля с небольшим числом различных значений — интернируются. Идентификаторы
+# (thread_id, answer_id, query_hash) и имена сюда не входят: словарь файла живёт
+# в памяти писателя до конца суток и рос бы с каждым новым значением
+INTERN_FIELDS = frozenset(["role", "branch", "status", "rating"])
+
+# Текстовые поля, которые можно не декодировать (text=False)
+TEXT_FIELDS = frozenset(["text", "question", "answer", "comment"])
+
+_FLOAT = struct.Struct("<d")
+
+
+class _SameAsUserText(object):
+    pass
+
+
+_SAME_AS_USER_TEXT = _SameAsUserText()
+
+
+class CodecError(Exception):
+    pass
+
+
+# -----------------------------
+# Primitives
+# -----------------------------
+def _put_varint(out, n):
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return
+
+
+def _get_varint(buf, pos):
+    shift = 0
+    result = 0
+    while True:
+        if pos >= len(buf):
+            raise CodecError("truncated varint")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _put_str(out, s):
+    data = s.encode("utf-8")
+    _put_varint(out, len(data))
+    out += data
+
+
+def _get_str(buf, pos):
+    n, pos = _get_varint(buf, pos)
+    end = pos + n
+    if end > len(buf):
+        raise CodecError("truncated string")
+    return buf[pos:end].decode("utf-8"), end
+
+
+# -----------------------------
+# Encoder / decoder
+# -----------------------------
+class CodecState(object):
+    """Словари файла: общие для кодировщика и декодера."""
+
+    def __init__(self):
+        self.keys = []
+        self.key_ids = {}
+        self.vals = []
+        self.val_ids = {}
+        self.last_user_text = {}
+
+    def remember(self, event):
+        if isinstance(event, dict) and event.get("role") == "user" and isinstance(event.get("text"), str):
+            self.last_user_text[event.get("user_id")] = event["text"]
+
+
+class Encoder(object):
+    def __init__(self, state=None):
+        self.state = state or CodecState()
+
+    def encode_block(self, events):
+        """Пачка событий одним сжатым кадром BLOCK."""
+        inner = bytearray()
+        for event in events:
+            inner += self.encode(event)
+        body = bytearray([FRAME_BLOCK])
+        body += zlib.compress(bytes(inner), 6)
+        out = bytearray()
+        self._frame(out, body)
+        return bytes(out)
+
+    def encode(self, event):
+        """Возвращает байты кадров (определения словаря + запись) для одного события."""
+        out = bytearray()
+        body = bytearray([FRAME_RECORD])
+        _put_varint(body, SCHEMA_VERSION)
+        question_ref = None
+        if isinstance(event, dict) and event.get("role") == "bot":
+            meta = event.get("meta")
+            if isinstance(meta, dict) and meta.get("question") is not None and \
+                    meta.get("question") == self.state.last_user_text.get(event.get("user_id")):
+                question_ref = meta
+        self._value(out, body, event, None, question_ref)
+        self._frame(out, body)
+        self.state.remember(event)
+        return bytes(out)
+
+    def _frame(self, out, body):
+        _put_varint(out, len(body))
+        out += body
+
+    def _key_id(self, out, key):
+        kid = self.state.key_ids.get(key)
+        if kid is None:
+            kid = len(self.state.keys)
+            self.state.keys.append(key)
+            self.state.key_ids[key] = kid
+            body = bytearray([FRAME_KEY_DEF])
+            _put_varint(body, kid)
+            _put_str(body, key)
+            self._frame(out, body)
+        return kid
+
+    def _val_id(self, out, val):
+        vid = self.state.val_ids.get(val)
+        if vid is None:
+            vid = len(self.state.vals)
+            self.state.vals.append(val)
+            self.state.val_ids[val] = vid
+            body = bytearray([FRAME_VAL_DEF])
+            _put_varint(body, vid)
+            _put_str(body, val)
+            self._frame(out, body)
+        return vid
+
+    def _value(self, out, body, v, field, question_ref):
+        if v is None:
+            body.append(T_NONE)
+        elif v is True:
+            body.append(T_TRUE)
+        elif v is False:
+            body.append(T_FALSE)
+        elif isinstance(v, int):
+            body.append(T_INT)
+            _put_varint(body, (v << 1) if v >= 0 else ((-v << 1) - 1))
+        elif isinstance(v, float):
+            body.append(T_FLOAT)
+            body += _FLOAT.pack(v)
+        elif isinstance(v, str):
+            if field in INTERN_FIELDS:
+                body.append(T_STR_REF)
+                _put_varint(body, self._val_id(out, v))
+            else:
+                body.append(T_STR)
+                _put_str(body, v)
+        elif isinstance(v, dict):
+            body.append(T_DICT)
+            _put_varint(body, len(v))
+            for k, item in v.items():
+                k = str(k)
+                _put_varint(body, self._key_id(out, k))
+                if v is question_ref and k == "question":
+                    body.append(T_SAME_AS_USER_TEXT)
+                else:
+                    self._value(out, body, item, k, question_ref)
+        elif isinstance(v, (list, tuple)):
+            body.append(T_LIST)
+            _put_varint(body, len(v))
+            for item in v:
+                self._value(out, body, item, field, question_ref)
+        else:
+            body.append(T_STR)
+            _put_str(body, str(v))
+
+
+class Decoder(object):
+    def __init__(self, state=None, text=True):
+        self.state = state or CodecState()
+        self.text = text
+
+    def feed(self, buf, pos=0):
+        """Разбирает кадры из buf. Генератор (event, end_pos); на оборванном кадре останавливается.
+
+        Целый по длине, но испорченный BLOCK — CodecError со смещением кадра.
+        """
+        n = len(buf)
+        while pos < n:
+            try:
+                length, body_pos = _get_varint(buf, pos)
+            except CodecError:
+                return
+            end = body_pos + length
+            if end > n or length == 0:
+                return
+            if buf[body_pos] == FRAME_BLOCK:
+                try:
+                    inner = zlib.decompress(bytes(buf[body_pos + 1:end]))
+                except zlib.error as e:
+                    raise CodecError("corrupt block at offset %d: %s" % (pos, e))
+                for event, _ in self.feed(inner):
+                    yield event, end
+                pos = end
+                continue
+            event = self._frame(buf, body_pos, end)
+            pos = end
+            if event is not None:
+                yield event, pos
+
+    def _frame(self, buf, pos, end):
+        kind = buf[pos]
+        pos += 1
+        if kind == FRAME_KEY_DEF:
+            kid, pos = _get_varint(buf, pos)
+            key, pos = _get_str(buf, pos)
+            self._define(self.state.keys, self.state.key_ids, kid, key)
+            return None
+        if kind == FRAME_VAL_DEF:
+            vid, pos = _get_varint(buf, pos)
+            val, pos = _get_str(buf, pos)
+            self._define(self.state.vals, self.state.val_ids, vid, val)
+            return None
+        if kind == FRAME_RECORD:
+            schema, pos = _get_varint(buf, pos)
+            if schema > SCHEMA_VERSION:
+                raise CodecError("unsupported schema version %d" % schema)
+            event, pos = self._value(buf, pos, None)
+            if isinstance(event, dict):
+                meta = event.get("meta")
+                if isinstance(meta, dict) and meta.get("question") is _SAME_AS_USER_TEXT:
+                    meta["question"] = self.state.last_user_text.get(event.get("user_id"))
+            self.state.remember(event)
+            return event
+        raise CodecError("unknown frame type %d" % kind)
+
+    @staticmethod
+    def _define(items, ids, idx, value):
+        if idx != len(items):
+            raise CodecError("dictionary id out of order")
+        items.append(value)
+        ids[value] = idx
+
+    def _value(self, buf, pos, field):
+        tag = buf[pos]
+        pos += 1
+        if tag == T_NONE:
+            return None, pos
+        if tag == T_TRUE:
+            return True, pos
+        if tag == T_FALSE:
+            return False, pos
+        if tag == T_INT:
+            z, pos = _get_varint(buf, pos)
+            return ((z >> 1) if not z & 1 else -((z + 1) >> 1)), pos
+        if tag == T_FLOAT:
+            return _FLOAT.unpack_from(buf, pos)[0], pos + _FLOAT.size
+        if tag == T_STR:
+            if not self.text and field in TEXT_FIELDS:
+                n, pos = _get_varint(buf, pos)
+                return None, pos + n
+            return _get_str(buf, pos)
+        if tag == T_STR_REF:
+            vid, pos = _get_varint(buf, pos)
+            return self.state.vals[vid], pos
+        if tag == T_DICT:
+            n, pos = _get_varint(buf, pos)
+            out = {}
+            for _ in range(n):
+                kid, pos = _get_varint(buf, pos)
+                key = self.state.keys[kid]
+                out[key], pos = self._value(buf, pos, key)
+            return out, pos
+        if tag == T_LIST:
+            n, pos = _get_varint(buf, pos)
+            out = []
+            for _ in range(n):
+                item, pos = self._value(buf, pos, field)
+                out.append(item)
+            return out, pos
+        if tag == T_SAME_AS_USER_TEXT:
+            return _SAME_AS_USER_TEXT, pos
+        raise CodecError("unknown value tag %d" % tag)
+
+
+# -----------------------------
+# Files
+# -----------------------------
+def _open_evb(path, text):
+    """(содержимое, Decoder) файла .evb после проверки заголовка; (None, None) для пустого файла."""
+    with open(path, "rb") as f:
+        buf = f.read()
+    if not buf:
+        return None, None
+    if buf[:4] != MAGIC:
+        raise CodecError("%s: not an .evb file" % path)
+    if buf[4] > FORMAT_VERSION:
+        raise CodecError("%s: unsupported format version %d" % (path, buf[4]))
+    return buf, Decoder(text=text)
+
+
+def _feed_evb(path, dec, buf):
+    try:
+        for item in dec.feed(buf, 5):
+            yield item
+    except CodecError as e:
+        raise CodecError("%s: %s" % (path, e))
+
+
+def read_evb(path, text=True):
+    """Читает .evb целиком: (события, CodecState, длина корректной части файла)."""
+    buf, dec = _open_evb(path, text)
+    if buf is None:
+        return [], CodecState(), 0
+    events = []
+    good = 5
+    for event, end in _feed_evb(path, dec, buf):
+        events.append(event)
+        good = end
+    return events, dec.state, good
+
+
+def iter_evb_events(path, text=True):
+    """События файла по мере разбора: до испорченного кадра успевают выйти все предыдущие."""
+    buf, dec = _open_evb(path, text)
+    if buf is None:
+        return
+    for event, _ in _feed_evb(path, dec, buf):
+        yield event
+
+
+class BinaryEventLog(object):
+    """Listener для EventWriter: дублирует события в data/evb/<имя>-YYYYMMDD.evb."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._open = {}  # имя лога -> (день, файл, Encoder)
+
+    def on_events(self, path, events, seq, offsets):
+        name = log_name(path)
+        f, enc = self._get(name)
+        f.write(enc.encode_block(events))
+        f.flush()
+
+    def _get(self, name):
+        day = time.strftime("%Y%m%d", time.gmtime())
+        cur = self._open.get(name)
+        if cur and cur[0] == day:
+            return cur[1], cur[2]
+        if cur:
+            cur[1].close()
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, "%s-%s.evb" % (name, day))
+        state = CodecState()
+        good = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # продолжаем файл после перезапуска: восстанавливаем словари и отрезаем оборванный хвост
+            try:
+                _, state, good = read_evb(path)
+            except CodecError as e:
+                # испорчен кадр в середине: файл откладываем целиком, сутки продолжаются в новом
+                damaged = "%s.damaged-%d" % (path, int(time.time()))
+                logger.error("%s, moved to %s", e, damaged)
+                os.rename(path, damaged)
+                state = CodecState()
+        if good is not None:
+            if good < os.path.getsize(path):
+                logger.warning("Truncating damaged tail of %s at %d", path, good)
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+            f = open(path, "ab")
+        else:
+            f = open(path, "wb")
+            f.write(MAGIC + bytes([FORMAT_VERSION]))
+        enc = Encoder(state)
+        self._open[name] = (day, f, enc)
+        return f, enc
+
+    def close(self):
+        for _, f, _ in self._open.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._open = {}
@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фоновая запись JSONL-событий (dialogs.jsonl / feedback.jsonl) для Python 3.6+.
+
+- Обработчики кладут событие в ограниченную очередь и сразу возвращаются;
+  если очередь полна, событие отбрасывается и учитывается в stats()["dropped"]
+  (обработчик никогда не ждёт диск).
+- Отдельный поток копит события, группирует их по файлам и пишет пачку
+  одним вызовом write() (group commit), затем flush + fsync.
+- Интервал сброса задаётся flush_interval; при остановке очередь
+  дописывается полностью.
+
+Ротация логов:
+- Активный файл остаётся на прежнем месте (data/dialogs.jsonl), чтобы внешние
+  скрипты (send_outbox.py, reply.php) могли дописывать в него как раньше.
+  Дозапись идёт под flock (append_lock, append_line): смещения строк, которые
+  писатель сообщает слушателям, берутся под блокировкой и верны, даже если
+  между пачками строки дописал другой процесс.
+- Раз в сутки (UTC) или по достижении размера активный файл переносится в
+  data/archive/<имя>/<имя>-YYYYMMDD-HHMMSS.jsonl.gz. Поток записи только
+  переименовывает его в <имя>.jsonl.rotating, сжимает фоновый поток.
+- data/archive/<имя>/manifest.json хранит для каждого сегмента диапазон
+  времени (ts_min/ts_max), число записей и размер — читатели пропускают
+  сегменты вне нужного окна (iter_log_events).
+- Каждый сегмент имеет номер seq (растёт с каждой ротацией), активный файл —
+  следующий номер (next_seq в манифесте). Положение строки — (seq, смещение):
+  оно не меняется при ротации, в отличие от inode, который ФС переиспользует.
+  Пока идёт сжатие (есть <имя>.jsonl.rotating), он получит next_seq, а активный
+  файл — следующий номер; iter_log_records это учитывает, остальные читатели
+  ждут или пропускают запуск (rotation_in_progress).
+
+Чтение для аналитики (scripts/):
+- iter_log_events — потоковый генератор по сегментам и активному файлу;
+- split_line_ranges + iter_range_events + parallel_map — разбор больших
+  файлов кусками по границам строк в пуле процессов (map); свёртку
+  результатов (reduce) делает вызывающий.
+
+Переменные окружения (читаются в bot.py):
+- EVENT_FLUSH_INTERVAL  (default: 1.0) секунд между сбросами на диск
+- EVENT_FSYNC           (default: 1)   0 — не вызывать fsync
+- EVENT_QUEUE_SIZE      (default: 10000) максимальная глубина очереди, сверх неё события отбрасываются
+- EVENT_ROTATE_DAILY    (default: 1)   0 — не резать логи по суткам
+- EVENT_ROTATE_MAX_MB   (default: 64)  размер активного файла для ротации, 0 — без лимита
+"""
+
+import os
+import gzip
+import json
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки
+    fcntl = None
+
+logger = logging.getLogger("AiAntiblokBot")
+
+_STOP = object()
+
+MANIFEST_NAME = "manifest.json"
+
+
+# -----------------------------
+# Segments / manifest
+# -----------------------------
+def event_ts(event):
+    """Время события в unix ts: поле ts бывает int (dialogs) или ISO-строкой (feedback)."""
+    ts = event.get("ts") if isinstance(event, dict) else None
+    if isinstance(ts, (int, float)):
+        return int(ts)
+    if isinstance(ts, str) and ts:
+        try:
+            if "T" in ts:
+                dt = datetime.strptime(ts.replace("Z", ""), "%Y-%m-%dT%H:%M:%S")
+                return int((dt - datetime(1970, 1, 1)).total_seconds())
+            return int(ts)
+        except Exception:
+            return None
+    return None
+
+
+def log_name(path):
+    """dialogs.jsonl -> dialogs"""
+    name = os.path.basename(path)
+    return name[:-len(".jsonl")] if name.endswith(".jsonl") else name
+
+
+def log_archive_dir(path):
+    """Папка сегментов лога: <dir>/archive/<имя>/"""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), "archive", log_name(path))
+
+
+def load_manifest(archive_dir):
+    """Манифест сегментов; у каждого есть seq, next_seq — номер активного файла."""
+    data = None
+    try:
+        with open(os.path.join(archive_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        pass
+    if not isinstance(data, dict) or not isinstance(data.get("segments"), list):
+        data = {"segments": []}
+    # Манифесты до появления seq: номера по порядку сегментов (они только дописываются)
+    last = 0
+    for i, entry in enumerate(data["segments"]):
+        if not isinstance(entry.get("seq"), int):
+            entry["seq"] = max(i + 1, last + 1)
+        last = entry["seq"]
+    if not isinstance(data.get("next_seq"), int) or data["next_seq"] <= last:
+        data["next_seq"] = last + 1
+    return data
+
+
+def active_segment_seq(path):
+    """Номер сегмента, которым станет активный файл лога при ротации."""
+    return load_manifest(log_archive_dir(path))["next_seq"] + (1 if rotation_in_progress(path) else 0)
+
+
+def encode_event(event):
+    """Строка JSONL события в байтах — ровно так её пишет EventWriter."""
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@contextmanager
+def append_lock(f):
+    """Эксклюзивная блокировка (flock) открытого файла лога на время дозаписи."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def append_line(path, data):
+    """Дописывает байты в лог под append_lock (для внешних скриптов вроде send_outbox.py).
+
+    Если файл, пока ждали блокировку, ушёл в ротацию, открывает новый активный.
+    """
+    while True:
+        with open(path, "ab") as f:
+            with append_lock(f):
+                try:
+                    same = os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+                except OSError:
+                    same = False
+                if same:
+                    f.write(data)
+                    f.flush()
+                    return
+
+
+def rotation_in_progress(path):
+    return os.path.exists(path + ".rotating")
+
+
+def save_manifest(archive_dir, manifest):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _archive_file(src, archive_dir, name):
+    """Сжимает src в новый gzip-сегмент с номером next_seq, дописывает его в манифест и удаляет src."""
+    ts_min = ts_max = None
+    records = 0
+    size = 0
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+    seg_name = "%s-%s.jsonl.gz" % (name, stamp)
+    n = 1
+    while os.path.exists(os.path.join(archive_dir, seg_name)):
+        n += 1
+        seg_name = "%s-%s-%d.jsonl.gz" % (name, stamp, n)
+    seg_path = os.path.join(archive_dir, seg_name)
+
+    with open(src, "rb") as fin, gzip.open(seg_path + ".part", "wb") as fout:
+        for raw in fin:
+            fout.write(raw)
+            size += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            records += 1
+            try:
+                ts = event_ts(json.loads(line.decode("utf-8")))
+            except Exception:
+                ts = None
+            if ts is None:
+                continue
+            ts_min = ts if ts_min is None else min(ts_min, ts)
+            ts_max = ts if ts_max is None else max(ts_max, ts)
+    os.replace(seg_path + ".part", seg_path)
+
+    manifest = load_manifest(archive_dir)
+    entry = {
+        "file": seg_name,
+        "seq": manifest["next_seq"],
+        "ts_min": ts_min,
+        "ts_max": ts_max,
+        "records": records,
+        "bytes": size,
+        "rotated_ts": int(time.time()),
+    }
+    manifest["segments"].append(entry)
+    manifest["next_seq"] = entry["seq"] + 1
+    save_manifest(archive_dir, manifest)
+    os.remove(src)
+    logger.info("Log segment archived: %s (%d records)", seg_name, records)
+    return entry
+
+
+def recover_rotation(path):
+    """Дожимает прерванную ротацию (падение между rename и сжатием): .rotating получает свой seq
+    раньше, чем новый активный файл. Возвращает запись манифеста или None."""
+    tmp = path + ".rotating"
+    if not os.path.exists(tmp):
+        return None
+    archive_dir = log_archive_dir(path)
+    os.makedirs(archive_dir, exist_ok=True)
+    return _archive_file(tmp, archive_dir, log_name(path))
+
+
+def rotate_log(path):
+    """Переносит активный лог в сжатый сегмент. Возвращает запись манифеста или None."""
+    archive_dir = log_archive_dir(path)
+    tmp = path + ".rotating"
+    os.makedirs(archive_dir, exist_ok=True)
+    recover_rotation(path)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    os.replace(path, tmp)
+    return _archive_file(tmp, archive_dir, log_name(path))
+
+
+def iter_log_segments(path, since=None, until=None):
+    """Файлы лога по порядку: сегменты из манифеста, пересекающие [since, until], затем
+    сжимаемый сейчас <имя>.jsonl.rotating (запись {"seq"}) и активный (None)."""
+    archive_dir = log_archive_dir(path)
+    manifest = load_manifest(archive_dir)
+    for entry in manifest["segments"]:
+        if since is not None and entry.get("ts_max") is not None and entry["ts_max"] < since:
+            continue
+        if until is not None and entry.get("ts_min") is not None and entry["ts_min"] > until:
+            continue
+        seg_path = os.path.join(archive_dir, entry.get("file", ""))
+        if os.path.isfile(seg_path):
+            yield seg_path, entry
+    if rotation_in_progress(path):
+        yield path + ".rotating", {"seq": manifest["next_seq"]}
+    if os.path.exists(path):
+        yield path, None
+
+
+def iter_log_events(path, since=None, until=None):
+    """Потоково отдаёт события лога (включая архивные сегменты) в окне [since, until]."""
+    archive_dir = log_archive_dir(path)
+    for seg_path, entry in iter_log_segments(path, since=since, until=until):
+        f = _open_segment(seg_path, entry["seq"] if entry is not None else None, archive_dir)
+        if f is None:
+            continue
+        with f:
+            for raw in f:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line.decode("utf-8"))
+                except Exception:
+                    continue
+                if since is not None or until is not None:
+                    ts = event_ts(event)
+                    if ts is not None and ((since is not None and ts < since) or (until is not None and ts > until)):
+                        continue
+                yield event
+
+
+def iter_log_records(path, after=None):
+    """Как iter_log_events, но отдаёт (event, seq, offset) — положение строки в исходном файле.
+
+    seq — номер сегмента из манифеста (для активного файла — next_seq), offset —
+    смещение в несжатом потоке, т.е. то же, что было у строки в активном файле
+    до ротации. Во время ротации номера сегментов неоднозначны — см. rotation_in_progress.
+
+    after=(seq, offset) — отдавать только строки после этого положения: более
+    ранние сегменты пропускаются, в активном файле чтение начинается с seek.
+    Недописанная последняя строка активного файла не отдаётся.
+    """
+    for event, seq, start, _ in iter_log_lines(path, after=after):
+        yield event, seq, start
+
+
+def iter_log_lines(path, after=None):
+    """iter_log_records, но с концом строки: (event, seq, start, end)."""
+    archive_dir = log_archive_dir(path)
+    manifest = load_manifest(archive_dir)
+    files = [(os.path.join(archive_dir, e.get("file", "")), e["seq"]) for e in manifest["segments"]]
+    active_seq = manifest["next_seq"]
+    rotating = path + ".rotating"
+    if os.path.exists(rotating):
+        # Идёт сжатие: .rotating получит next_seq, активный файл — следующий номер
+        files.append((rotating, active_seq))
+        active_seq += 1
+    files.append((path, active_seq))
+    for seg_path, seq in files:
+        if after is not None and seq < after[0]:
+            continue
+        skip = after[1] if after is not None and seq == after[0] else None
+        f = _open_segment(seg_path, seq, archive_dir)
+        if f is None:
+            continue
+        active = seg_path == path
+        offset = 0
+        with f:
+            if skip is not None and skip > 0 and active:
+                f.seek(skip)
+                offset = skip
+            for raw in f:
+                start = offset
+                offset += len(raw)
+                if active and not raw.endswith(b"\n"):
+                    break
+                if skip is not None and start <= skip:
+                    continue
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line.decode("utf-8"))
+                except Exception:
+                    continue
+                yield event, seq, start, offset
+
+
+def _open_segment(seg_path, seq, archive_dir):
+    """Открывает файл лога для iter_log_lines; .rotating, сжатый за это время, ищется в манифесте."""
+    try:
+        return (gzip.open if seg_path.endswith(".gz") else open)(seg_path, "rb")
+    except (IOError, OSError):
+        pass
+    if not seg_path.endswith(".rotating"):
+        return None
+    for entry in load_manifest(archive_dir)["segments"]:
+        if entry["seq"] == seq:
+            try:
+                return gzip.open(os.path.join(archive_dir, entry.get("file", "")), "rb")
+            except (IOError, OSError):
+                return None
+    return None
+
+
+def split_line_ranges(path, chunk_bytes, end=None):
+    """Делит файл на диапазоны [start, end) примерно по chunk_bytes, границы — начала строк.
+
+    end по умолчанию — конец последней полной строки (недописанный хвост
+    активного лога не попадает ни в один диапазон).
+    """
+    with open(path, "rb") as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+            # откатываемся к последнему \n
+            pos = end
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                buf = f.read(step)
+                nl = buf.rfind(b"\n")
+                if nl >= 0:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            end = pos
+        ranges = []
+        start = 0
+        chunk_bytes = max(1, int(chunk_bytes))
+        while start < end:
+            stop = start + chunk_bytes
+            if stop >= end:
+                stop = end
+            else:
+                f.seek(stop)
+                f.readline()
+                stop = min(f.tell(), end)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def iter_range_events(path, start=0, end=None):
+    """Потоково отдаёт события из диапазона байт файла; .gz читается целиком (start/end игнорируются)."""
+    if path.endswith(".gz"):
+        f = gzip.open(path, "rb")
+        start, end = 0, None
+    else:
+        f = open(path, "rb")
+        if start:
+            f.seek(start)
+    with f:
+        pos = start
+        for raw in f:
+            pos += len(raw)
+            if not raw.endswith(b"\n"):
+                # строка ещё дописывается
+                break
+            line = raw.strip()
+            if line:
+                try:
+                    yield json.loads(line.decode("utf-8"))
+                except Exception:
+                    pass
+            if end is not None and pos >= end:
+                break
+
+
+def parallel_map(fn, tasks, workers=None, initializer=None, initargs=()):
+    """map-часть map-reduce: fn(*task) для каждого task в пуле процессов.
+
+    Результаты отдаются генератором в порядке tasks, так что свёртка (reduce)
+    может идти по мере готовности. fn и initializer — функции уровня модуля;
+    initializer(*initargs) вызывается один раз в каждом процессе пула.
+    workers <= 1 — всё в текущем процессе, без пула.
+    """
+    tasks = list(tasks)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(int(workers), len(tasks))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield fn(*task)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        for result in pool.imap(_apply_task, [(fn, task) for task in tasks]):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _apply_task(item):
+    fn, task = item
+    return fn(*task)
+
+
+def _first_record_day(path):
+    """День (UTC, YYYYMMDD) первой записи активного файла."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                ts = event_ts(json.loads(line))
+                if ts is not None:
+                    return time.strftime("%Y%m%d", time.gmtime(ts))
+    except Exception:
+        pass
+    return None
+
+
+class _FlushRequest(object):
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class EventWriter(object):
+    def __init__(self, flush_interval=1.0, fsync=True, max_queue=10000, max_batch=1000,
+                 rotate_daily=True, rotate_max_bytes=64 * 1024 * 1024):
+        self.flush_interval = float(flush_interval) if flush_interval else 0.0
+        self.fsync = bool(fsync)
+        self.max_batch = int(max_batch) if max_batch else 1000
+        self.rotate_daily = bool(rotate_daily)
+        self.rotate_max_bytes = int(rotate_max_bytes) if rotate_max_bytes else 0
+        self._segment_day = {}
+        self._segment_seq = {}  # путь -> seq активного файла
+        self._compressors = {}  # путь -> поток, сжимающий <путь>.rotating
+        self._listeners = []
+
+        self._queue = queue.Queue(maxsize=int(max_queue) if max_queue else 0)
+        self._thread = None
+        self._files = {}
+        # Запись пачек, ротация и вызов слушателей — под _io_lock: синхронная запись
+        # (write_now) не перемешивается с пачкой потока записи
+        self._io_lock = threading.Lock()
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_flush_ts = 0
+
+    # -----------------------------
+    # Public API (вызывается из обработчиков)
+    # -----------------------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def add_listener(self, fn):
+        """fn(path, events, seq, offsets) вызывается в потоке записи после каждой пачки.
+
+        seq — номер сегмента активного файла (см. active_segment_seq), offsets — смещения строк в нём.
+        """
+        # Список заменяется целиком: поток записи обходит его без блокировки
+        self._listeners = self._listeners + [fn]
+
+    def remove_listener(self, fn):
+        self._listeners = [f for f in self._listeners if f != fn]
+
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def write(self, path, event):
+        """Ставит событие в очередь без ожидания. При переполнении отбрасывает его (False, счётчик dropped)."""
+        try:
+            self._queue.put_nowait((path, event))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.error("Event queue full (%d), %d events dropped so far (last for %s)",
+                             self._queue.qsize(), self.dropped, path)
+            return False
+
+    def write_now(self, path, event):
+        """Пишет событие сразу, в обход очереди, тем же путём, что и поток записи.
+
+        Ротация и слушатели (индексы, rollups, живой дашборд) срабатывают как для пачки.
+        Когда поток записи не запущен, файл после записи закрывается.
+        """
+        with self._io_lock:
+            self._write_batch(path, [event])
+            if not self.running():
+                self._close_file(path)
+
+    def flush(self, timeout=5.0):
+        """Ждёт, пока всё поставленное в очередь до вызова будет записано на диск."""
+        if not self.running():
+            return False
+        req = _FlushRequest()
+        try:
+            self._queue.put(req, timeout=timeout)
+        except queue.Full:
+            return False
+        return req.done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Дописывает очередь до конца и останавливает поток."""
+        if self.running():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        with self._io_lock:
+            self._close_files()
+            self._wait_compressors(timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_flush_ts": self.last_flush_ts,
+        }
+
+    # -----------------------------
+    # Writer thread
+    # -----------------------------
+    def _run(self):
+        pending = {}
+        count = 0
+        waiters = []
+        stop = False
+        deadline = time.time() + self.flush_interval
+        while not stop:
+            timeout = max(0.0, deadline - time.time())
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, _FlushRequest):
+                waiters.append(item)
+            elif item is not None:
+                path, event = item
+                pending.setdefault(path, []).append(event)
+                count += 1
+
+            if stop or waiters or count >= self.max_batch or time.time() >= deadline:
+                # Забираем всё, что уже лежит в очереди, чтобы закоммитить одной пачкой
+                while count < self.max_batch * 4:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                    elif isinstance(item, _FlushRequest):
+                        waiters.append(item)
+                    else:
+                        pending.setdefault(item[0], []).append(item[1])
+                        count += 1
+                with self._io_lock:
+                    for path, events in pending.items():
+                        self._write_batch(path, events)
+                pending = {}
+                count = 0
+                for w in waiters:
+                    w.done.set()
+                waiters = []
+                deadline = time.time() + self.flush_interval
+        with self._io_lock:
+            self._close_files()
+
+    def _get_file(self, path):
+        f = self._files.get(path)
+        if f is None or f.closed:
+            f = open(path, "ab")
+            self._files[path] = f
+        return f
+
+    def _close_file(self, path):
+        f = self._files.pop(path, None)
+        if f is not None:
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    def _current_seq(self, path):
+        seq = self._segment_seq.get(path)
+        if seq is None:
+            # Сначала дожимаем прерванную ротацию, иначе новый файл получил бы её номер
+            try:
+                recover_rotation(path)
+            except Exception as e:
+                self.errors += 1
+                logger.error("Failed to recover rotation of %s: %s", path, e)
+            seq = self._segment_seq[path] = active_segment_seq(path)
+        return seq
+
+    def _maybe_rotate(self, path):
+        if not self.rotate_daily and not self.rotate_max_bytes:
+            return
+        today = time.strftime("%Y%m%d", time.gmtime())
+        if path not in self._segment_day:
+            self._segment_day[path] = _first_record_day(path) or today
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            self._segment_day[path] = today
+            return
+        if not size:
+            return
+        if (self.rotate_daily and self._segment_day[path] != today) or \
+                (self.rotate_max_bytes and size >= self.rotate_max_bytes):
+            self._close_file(path)
+            self._rotate(path)
+            self._segment_day[path] = today
+
+    def _rotate(self, path):
+        """Переименовывает активный файл в .rotating и отдаёт сжатие фоновому потоку."""
+        # Прошлое сжатие должно закончиться: у .rotating должен быть один владелец
+        pending = self._compressors.pop(path, None)
+        if pending is not None:
+            pending.join()
+        seq = self._current_seq(path)
+        try:
+            recover_rotation(path)
+            # Под блокировкой: внешний скрипт не допишет в уже переименованный файл (см. append_line)
+            with open(path, "ab") as f:
+                with append_lock(f):
+                    os.replace(path, path + ".rotating")
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed to rotate %s: %s", path, e)
+            self._segment_seq.pop(path, None)
+            return
+        # .rotating получит seq при сжатии, новый активный файл — следующий
+        self._segment_seq[path] = seq + 1
+        t = threading.Thread(target=self._compress, args=(path,), name="event-log-compress")
+        t.daemon = True
+        self._compressors[path] = t
+        t.start()
+
+    def _compress(self, path):
+        try:
+            recover_rotation(path)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed to archive %s: %s", path + ".rotating", e)
+
+    def _wait_compressors(self, timeout=None):
+        for t in list(self._compressors.values()):
+            t.join(timeout)
+        self._compressors = {}
+
+    def _close_files(self):
+        for f in list(self._files.values()):
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._files = {}
+
+    def _write_batch(self, path, events):
+        lines = []
+        written_events = []
+        for event in events:
+            try:
+                lines.append(encode_event(event))
+                written_events.append(event)
+            except Exception as e:
+                self.errors += 1
+                logger.error("Failed to serialize event for %s: %s", path, e)
+        if not lines:
+            return
+        try:
+            self._current_seq(path)
+            self._maybe_rotate(path)
+            seq = self._current_seq(path)
+            f = self._get_file(path)
+            with append_lock(f):
+                # конец файла под блокировкой: с учётом строк, дописанных другими процессами
+                start = f.seek(0, os.SEEK_END)
+                f.write(b"".join(lines))
+                f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.written += len(lines)
+            self.batches += 1
+            self.last_flush_ts = int(time.time())
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed to write to %s: %s", path, e)
+            self._close_file(path)
+            return
+        if not self._listeners:
+            return
+        offsets = []
+        pos = start
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line)
+        for fn in self._listeners:
+            try:
+                fn(path, written_events, seq, offsets)
+            except Exception as e:
+                self.errors += 1
+                logger.error("Event listener failed for %s: %s", path, e)
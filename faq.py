@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Готовые ответы на частые вопросы (data/faq_answers.json) без RAG и GigaChat.
+
+Файл строит scripts/build_faq_answers.py по dialogs.jsonl: кластеры похожих
+вопросов (интенты) по ветке, лучший по оценкам ответ бота или ответ,
+сгенерированный заново. Отдаются только интенты с "approved": true —
+флаг (и при желании текст ответа) правит человек после проверки.
+
+Сходство — коэффициент Жаккара по множествам «основ» слов (первые
+STEM_LEN букв, без стоп-слов): грубо, но устойчиво к падежам и быстро.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("AiAntiblokBot")
+
+STEM_LEN = 6
+WORD_RE = re.compile(r"[a-zа-я0-9]+")
+STOP_WORDS = frozenset((
+    "что", "как", "где", "когда", "если", "для", "это", "мне", "меня", "мой", "моя", "мои",
+    "или", "при", "так", "уже", "ещё", "еще", "все", "всё", "можно", "нужно", "надо", "ли",
+    "был", "была", "было", "были", "есть", "нет", "том", "там", "тут", "вот", "бы", "же",
+    "подскажите", "пожалуйста", "скажите", "здравствуйте", "добрый", "день",
+))
+
+
+def faq_terms(text):
+    """Множество основ слов вопроса."""
+    text = (text or "").lower().replace("ё", "е")
+    return frozenset(w[:STEM_LEN] for w in WORD_RE.findall(text)
+                     if (len(w) >= 3 or w.isdigit()) and w not in STOP_WORDS)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return float(len(a & b)) / len(a | b)
+
+
+class FaqMatcher(object):
+    """Сопоставляет вопрос с одобренными интентами; файл перечитывается при изменении."""
+
+    RELOAD_CHECK_SEC = 60
+
+    def __init__(self, path, min_score=0.75):
+        self.path = path
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0
+        self._intents = []
+        self._index = {}  # основа -> [(i интента, j образца)]
+        self.hits = 0
+        self.misses = 0
+        self.reload()
+
+    def __len__(self):
+        return len(self._intents)
+
+    def reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        intents = []
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                intents = [it for it in data.get("intents") or []
+                           if it.get("approved") and (it.get("answer") or "").strip()]
+            except Exception as e:
+                logger.warning("FAQ answers load failed (%s): %s", self.path, e)
+                return
+        index = {}
+        for i, it in enumerate(intents):
+            it["_samples"] = [faq_terms(q) for q in it.get("questions") or []]
+            for j, terms in enumerate(it["_samples"]):
+                for t in terms:
+                    index.setdefault(t, []).append((i, j))
+        with self._lock:
+            self._intents, self._index, self._mtime = intents, index, mtime
+        if intents:
+            logger.info("FAQ answers loaded: %d approved intents", len(intents))
+
+    def _maybe_reload(self):
+        now = time.time()
+        if now - self._checked < self.RELOAD_CHECK_SEC:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self.reload()
+
+    def match(self, text, branch=None):
+        """(интент, оценка) при оценке не ниже min_score, иначе (None, лучшая оценка)."""
+        self._maybe_reload()
+        terms = faq_terms(text)
+        with self._lock:
+            intents, index = self._intents, self._index
+        best, best_score = None, 0.0
+        seen = set()
+        for t in terms:
+            for ref in index.get(t, ()):
+                if ref in seen:
+                    continue
+                seen.add(ref)
+                it = intents[ref[0]]
+                if branch and it.get("branch") and it["branch"] != branch:
+                    continue
+                score = jaccard(terms, it["_samples"][ref[1]])
+                if score > best_score:
+                    best, best_score = it, score
+        hit = best is not None and best_score >= self.min_score
+        with self._lock:
+            # match() зовут из нескольких потоков: += не атомарен
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return (best, best_score) if hit else (None, best_score)
+
+    def stats(self):
+        with self._lock:
+            return {"intents": len(self._intents), "hits": self.hits, "misses": self.misses}
@@ -5,8 +5,16 @@ GigaChat API client for Python 3.6+ (requests-based).
 
 - Fetches access token via POST https://ngw.devices.sberbank.ru:9443/api/v2/oauth
   using Basic <Authorization key> and form {scope}.
-- Caches token in-memory (optionally to file) until expiry.
-- Calls https://gigachat.devices.sberbank.ru/api/v1/chat/completions
+- Caches token in-memory (optionally to file) until expiry. Concurrent refreshes
+  collapse into one OAuth request; start_refresher() renews the token in the
+  background before it expires, and a 401/403 forces one refresh and retry.
+- Calls https://gigachat.devices.sberbank.ru/api/v1/chat/completions,
+  either waiting for the whole answer (chat) or in streaming SSE mode
+  (chat_stream, yields text deltas as they are generated; its timeout is
+  a deadline for the whole stream, not per read)
+- All requests go through one requests.Session with a keep-alive connection
+  pool, so TCP+TLS handshakes happen once per connection, not per message.
+  Create one client at startup and share it between handler threads.
 
 Environment variables (load from .env is done in bot.py by default):
 - GIGACHAT_AUTH_KEY   (required)  Authorization key (WITHOUT "Basic ")
@@ -14,6 +22,9 @@ Environment variables (load from .env is done in bot.py by default):
 - GIGACHAT_MODEL      (default: GigaChat)
 - GIGACHAT_CA_BUNDLE  (default: data/ca/ca_bundle.pem) path to CA bundle for SSL verify
 - GIGACHAT_VERIFY     (default: 1) set to 0 to disable SSL verify (NOT recommended)
+- GIGACHAT_POOL_SIZE  (default: 10) max keep-alive connections per host
+- GIGACHAT_OAUTH_URL / GIGACHAT_API_BASE  override the endpoints above,
+  e.g. to point the bot at scripts/mock_gigachat.py for load testing
 """
 
 import os
@@ -21,8 +32,10 @@ import time
 import uuid
 import json
 import logging
+import threading
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class GigaChatClient(object):
@@ -35,17 +48,45 @@ class GigaChatClient(object):
                  model="GigaChat",
                  ca_bundle_path=None,
                  verify=True,
-                 timeout=30):
+                 timeout=30,
+                 pool_size=10,
+                 session=None,
+                 oauth_url=None,
+                 api_base=None):
         self.auth_key = (auth_key or "").strip()
         self.scope = (scope or "GIGACHAT_API_PERS").strip()
         self.model = (model or "GigaChat").strip()
         self.timeout = int(timeout) if timeout else 30
+        self.oauth_url = (oauth_url or self.OAUTH_URL).strip()
+        self.api_base = (api_base or self.API_BASE).strip().rstrip("/")
 
         self.ca_bundle_path = ca_bundle_path
         self.verify = verify
 
         self._token = None
         self._token_exp_ts = 0
+        self._token_ttl = 0
+        # Only one OAuth request in flight; other threads wait for its result
+        self._token_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
+
+        self.session = session or self._make_session(pool_size)
+
+    @staticmethod
+    def _make_session(pool_size):
+        # Two hosts (oauth + api); pool_maxsize is how many connections
+        # per host stay open for concurrent handler threads
+        pool_size = max(1, int(pool_size or 10))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.stop_refresher()
+        self.session.close()
 
     def _verify_arg(self):
         # verify=True / False / path
@@ -58,10 +99,65 @@ class GigaChatClient(object):
     def token_valid(self):
         return bool(self._token) and (time.time() < (self._token_exp_ts - 10))
 
-    def get_access_token(self, force=False):
+    def get_access_token(self, force=False, stale_token=None):
+        """Cached token; refreshes it if expired (or force=True, e.g. after a 401).
+
+        Concurrent callers share one OAuth request: whoever gets the lock first
+        refreshes, the rest reuse its token. With stale_token (the token that got
+        a 401) a forced refresh is skipped if another thread already replaced it.
+        """
         if (not force) and self.token_valid():
             return self._token
+        with self._token_lock:
+            if self.token_valid() and (not force or (stale_token and self._token != stale_token)):
+                return self._token
+            self._set_token(*self._fetch_token())
+            return self._token
+
+    def _set_token(self, tok, exp_ts):
+        self._token, self._token_exp_ts = tok, exp_ts
+        self._token_ttl = max(0, exp_ts - int(time.time()))
 
+    def start_refresher(self, margin=120):
+        """Background thread that refreshes the token margin seconds before expiry,
+        so requests on the hot path normally never wait for OAuth."""
+        if self._refresher is not None:
+            return
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(margin,),
+                                           name="GigaChatTokenRefresher")
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stop_refresher(self):
+        if self._refresher is None:
+            return
+        self._refresher_stop.set()
+        self._refresher.join(timeout=5)
+        self._refresher = None
+
+    def _refresh_loop(self, margin):
+        backoff = 5
+        while not self._refresher_stop.is_set():
+            # Short-lived tokens: refresh at half-life rather than in a tight loop
+            early = min(margin, self._token_ttl // 2) if self._token_ttl else margin
+            wait = self._token_exp_ts - early - time.time()
+            if self._token and wait > 0:
+                # Wake up early enough even if the token was refreshed by someone else meanwhile
+                self._refresher_stop.wait(min(wait, 300))
+                continue
+            try:
+                with self._token_lock:
+                    if not self._token or self._token_exp_ts - early <= time.time():
+                        self._set_token(*self._fetch_token())
+                backoff = 5
+            except Exception as e:
+                logging.warning("GigaChat token refresh failed: %s (retry in %ds)", e, backoff)
+                self._refresher_stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _fetch_token(self):
+        """POST to OAuth; returns (token, expiry unix ts). Caller holds _token_lock."""
         if not self.auth_key:
             raise RuntimeError("GIGACHAT_AUTH_KEY is empty")
 
@@ -73,8 +169,8 @@ class GigaChatClient(object):
         }
         data = {"scope": self.scope}
 
-        r = requests.post(
-            self.OAUTH_URL,
+        r = self.session.post(
+            self.oauth_url,
             headers=headers,
             data=data,
             timeout=self.timeout,
@@ -103,25 +199,18 @@ class GigaChatClient(object):
                     exp_ts = int(exp_at)
                     if exp_ts > 10**12:
                         exp_ts = exp_ts // 1000
-                    self._token_exp_ts = exp_ts
-                    self._token = tok
-                    return tok
+                    return tok, exp_ts
             except Exception:
                 pass
 
         if not exp:
             exp = 30 * 60  # 30 minutes default per docs
 
-        self._token = tok
-        self._token_exp_ts = int(time.time()) + exp
-        return tok
-
-    def chat(self, system_prompt, user_prompt, temperature=0.2, max_tokens=800):
-        token = self.get_access_token()
-        url = self.API_BASE + "/api/v1/chat/completions"
+        return tok, int(time.time()) + exp
 
+    def _payload(self, system_prompt, user_prompt, temperature, max_tokens, model):
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
@@ -131,39 +220,82 @@ class GigaChatClient(object):
         # Some versions support max_tokens; harmless if ignored
         if max_tokens is not None:
             payload["max_tokens"] = int(max_tokens)
+        return payload
 
+    def _post_completions(self, payload, timeout, stream=False):
+        token = self.get_access_token()
+        url = self.api_base + "/api/v1/chat/completions"
         headers = {
-            "Accept": "application/json",
+            "Accept": "text/event-stream" if stream else "application/json",
             "Authorization": "Bearer " + token,
             "Content-Type": "application/json",
         }
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
 
-        r = requests.post(
-            url,
-            headers=headers,
-            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-            timeout=self.timeout,
-            verify=self._verify_arg(),
-        )
+        r = self.session.post(url, headers=headers, data=body, timeout=timeout,
+                              verify=self._verify_arg(), stream=stream)
         # If token expired unexpectedly, retry once
         if r.status_code in (401, 403):
             logging.warning("GigaChat auth failed (%s), refreshing token and retrying once", r.status_code)
-            token = self.get_access_token(force=True)
+            r.close()
+            token = self.get_access_token(force=True, stale_token=token)
             headers["Authorization"] = "Bearer " + token
-            r = requests.post(
-                url,
-                headers=headers,
-                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-                timeout=self.timeout,
-                verify=self._verify_arg(),
-            )
+            r = self.session.post(url, headers=headers, data=body, timeout=timeout,
+                                  verify=self._verify_arg(), stream=stream)
 
+        if r.status_code >= 400:
+            r.close()
         r.raise_for_status()
+        return r
+
+    def chat(self, system_prompt, user_prompt, temperature=0.2, max_tokens=800, model=None, timeout=None):
+        payload = self._payload(system_prompt, user_prompt, temperature, max_tokens, model)
+        r = self._post_completions(payload, timeout or self.timeout)
         obj = r.json()
 
         # Standard OpenAI-like: choices[0].message.content
+        choices = obj.get("choices") or []
+        if not choices:
+            raise RuntimeError("No choices in response: %s" % json.dumps(obj, ensure_ascii=False)[:300])
+        return (choices[0].get("message") or {}).get("content") or ""
+
+    def chat_stream(self, system_prompt, user_prompt, temperature=0.2, max_tokens=800, model=None, timeout=None):
+        """Streaming mode (stream: true, SSE): yields text deltas as they arrive.
+
+        timeout is the deadline for the whole generation: it applies to connect and
+        each read, and is also checked between SSE events, so a stream that keeps
+        trickling tokens is cut off with requests.exceptions.Timeout. A stalled
+        read can overrun the deadline by at most one read timeout.
+        """
+        timeout = timeout or self.timeout
+        deadline = time.time() + timeout
+        payload = self._payload(system_prompt, user_prompt, temperature, max_tokens, model)
+        payload["stream"] = True
+        r = self._post_completions(payload, timeout, stream=True)
         try:
-            return obj["choices"][0]["message"]["content"]
-        except Exception:
-            # Fallback: return raw text
-            return json.dumps(obj, ensure_ascii=False)[:1500]
+            for delta in iter_sse_deltas(r.iter_lines(decode_unicode=False), deadline):
+                yield delta
+        finally:
+            r.close()
+
+
+def iter_sse_deltas(lines, deadline=None):
+    """Text deltas from SSE lines of a streaming completion (bytes, without line breaks).
+
+    "data: {...}" lines carry chunks, blank lines separate events, other fields
+    (event:, id:, ": comment") are skipped, "data: [DONE]" ends the stream.
+    Raises requests.exceptions.Timeout once time.time() passes deadline.
+    """
+    for line in lines:
+        if deadline is not None and time.time() > deadline:
+            raise requests.exceptions.Timeout("GigaChat stream exceeded the overall deadline")
+        if not line or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        obj = json.loads(data.decode("utf-8"))
+        for choice in obj.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                yield delta
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Живой дашборд: HTTP-сервер в процессе бота (включается LIVE_DASHBOARD_PORT).
+
+- Агрегаты (DashboardAggregate) живут в памяти: при старте собираются по
+  логам, дальше обновляются listener'ом EventWriter — без cron.
+- GET /, /index.html — dashboard/index.html (страница от scripts/build_dashboard.py)
+- GET /data/<файл>.json — те же summary/index/filters/rollups и страницы тредов,
+  что пишет build_dashboard.py, но из памяти; пересобираются по запросу,
+  не чаще rebuild_interval секунд
+- GET /api/events — server-sent events: новые оценки/комментарии, ответы
+  админов и результаты отправки ответов из дашборда
+- POST /api/reply (target=thread_id|answer_id, text) — ответ пользователю уходит
+  в очередь job_queue бота, результат приходит в /api/events
+
+Доступ: LIVE_DASHBOARD_TOKEN обязателен — страницы тредов и SSE отдают
+тексты диалогов, а на общей машине 127.0.0.1 доступен всем её пользователям.
+Каждый запрос передаёт токен (?token=... / поле token / заголовок X-Dash-Token);
+без токена LiveDashboard не создаётся. По умолчанию сервер слушает только
+127.0.0.1; на другом адресе токен идёт по HTTP открытым текстом — нужен TLS-прокси.
+
+Переменные окружения (читаются в bot.py):
+- LIVE_DASHBOARD_PORT   (default: 0)          0 — сервер выключен
+- LIVE_DASHBOARD_HOST   (default: 127.0.0.1)
+- LIVE_DASHBOARD_TOKEN  (обязателен при LIVE_DASHBOARD_PORT)
+
+Python 3.6: ThreadingMixIn + HTTPServer (ThreadingHTTPServer появился в 3.7).
+"""
+
+import os
+import hmac
+import socket
+import ipaddress
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from dashboard_data import DEFAULT_PAGE_SIZE, DashboardAggregate, build_payloads
+from event_log import iter_log_records, load_manifest, log_archive_dir, log_name
+
+logger = logging.getLogger("AiAntiblokBot")
+
+# Максимальный размер тела POST /api/reply
+MAX_BODY = 64 * 1024
+# Клиент SSE, не успевающий читать, отключается при переполнении очереди
+SUBSCRIBER_QUEUE = 1000
+SSE_PING_INTERVAL = 15
+
+
+def is_loopback(host):
+    """True, если host — адрес (или имя) только локального интерфейса."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class LiveDashboard(object):
+    def __init__(self, dash_dir, dialogs_path, feedback_path, reply_fn=None, token="",
+                 page_size=DEFAULT_PAGE_SIZE, rebuild_interval=2.0):
+        """reply_fn(target, text, done) ставит ответ в очередь бота; done(ok, result) вызывается после отправки.
+
+        Без token — ValueError: сервер без токена не поднимается ни на каком адресе.
+        """
+        if not token:
+            raise ValueError("LIVE_DASHBOARD_TOKEN is required for the live dashboard")
+        self.dash_dir = dash_dir
+        self.dialogs_path = dialogs_path
+        self.feedback_path = feedback_path
+        self.reply_fn = reply_fn
+        self.token = token
+        self.page_size = page_size
+        self.rebuild_interval = float(rebuild_interval)
+
+        self.agg = DashboardAggregate()
+        self.ready = False
+        # _lock — короткий: очередь пачек от писателя и подписчики SSE
+        self._lock = threading.Lock()
+        self._pending = []
+        self._subscribers = set()
+        # _build_lock — применение событий к агрегатам и сборка JSON (не держит поток писателя)
+        self._build_lock = threading.Lock()
+        self._seen = {}
+        self._version = 0
+        self._built_version = -1
+        self._built_at = 0.0
+        self._payloads = {}
+
+        self._server = None
+        self._thread = None
+
+    # -----------------------------
+    # Запуск / остановка
+    # -----------------------------
+    def start(self, host, port):
+        if not is_loopback(host):
+            logger.warning("Live dashboard on %s: the token travels over plain HTTP, put it behind TLS", host)
+        self._server = _Server((host, int(port)), _Handler)
+        self._server.live = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="live-dashboard", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._seed, name="live-dashboard-seed", daemon=True).start()
+        logger.info("Live dashboard listening on http://%s:%d/", host, int(port))
+
+    def stop(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _seed(self):
+        """Первичная сборка агрегатов по логам; пачки писателя тем временем копятся в _pending."""
+        with self._build_lock:
+            t0 = time.time()
+            # Первая запись после рестарта часто ротирует вчерашний лог — если ротация
+            # шла или прошла во время чтения, читаем заново
+            attempts = 10
+            for attempt in range(attempts):
+                before = self._segments()
+                if any(rotating for _, rotating in before) and attempt < attempts - 1:
+                    time.sleep(0.5)
+                    continue
+                agg = DashboardAggregate()
+                seen = {}
+                n = 0
+                for path, name in ((self.dialogs_path, "dialogs"), (self.feedback_path, "feedback")):
+                    add = agg.add_dialog if name == "dialogs" else agg.add_feedback
+                    for event, seq, offset in iter_log_records(path):
+                        add(event)
+                        key = (name, seq)
+                        if offset > seen.get(key, -1):
+                            seen[key] = offset
+                        n += 1
+                if self._segments() == before:
+                    break
+                logger.info("Live dashboard: logs rotated while seeding, rereading")
+            self.agg = agg
+            self._seen = seen
+            self._drain()
+            # всё прочитанное при старте уже применено, дальше пачки только новые
+            self._seen = {}
+            self.ready = True
+            logger.info("Live dashboard seeded: %d events in %.1fs", n, time.time() - t0)
+
+    def _segments(self):
+        """Состояние ротации: [(сегменты из манифеста, идёт ли перенос .rotating)] по логам."""
+        return [
+            ([e.get("file") for e in load_manifest(log_archive_dir(path))["segments"]],
+             os.path.exists(path + ".rotating"))
+            for path in (self.dialogs_path, self.feedback_path)
+        ]
+
+    # -----------------------------
+    # События (поток EventWriter)
+    # -----------------------------
+    def on_events(self, path, events, seq, offsets):
+        """Listener для EventWriter.add_listener."""
+        name = log_name(path)
+        if name not in ("dialogs", "feedback"):
+            return
+        with self._lock:
+            self._pending.append((name, events, seq, offsets))
+        # Агрегаты обновляем сразу, только если никто не собирает JSON — писатель не ждёт
+        if self._build_lock.acquire(False):
+            try:
+                if self.ready:
+                    self._drain()
+            finally:
+                self._build_lock.release()
+        for event in events:
+            msg = _notification(name, event)
+            if msg:
+                self.publish(msg)
+
+    def _drain(self):
+        """Применяет накопленные пачки (вызывается под _build_lock)."""
+        with self._lock:
+            batches, self._pending = self._pending, []
+        for name, events, seq, offsets in batches:
+            # то, что уже прочитано при старте, повторно не считаем
+            seen = self._seen.get((name, seq), -1)
+            add = self.agg.add_dialog if name == "dialogs" else self.agg.add_feedback
+            for event, offset in zip(events, offsets):
+                if offset > seen:
+                    add(event)
+        if batches:
+            self._version += 1
+
+    # -----------------------------
+    # Данные страницы
+    # -----------------------------
+    def payload(self, name):
+        """JSON-файл dashboard/data/<name> в байтах или None."""
+        with self._build_lock:
+            self._drain()
+            stale = self._built_version != self._version
+            if stale and (not self._payloads or time.time() - self._built_at >= self.rebuild_interval):
+                stats, threads = self.agg.build()
+                payloads = build_payloads(stats, threads, self.agg.rollups, self.page_size)
+                payloads["summary.json"]["live"] = True
+                self._payloads = {
+                    k: json.dumps(v, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                    for k, v in payloads.items()
+                }
+                self._built_version = self._version
+                self._built_at = time.time()
+            return self._payloads.get(name)
+
+    # -----------------------------
+    # SSE
+    # -----------------------------
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, msg):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(msg)
+            except queue.Full:
+                logger.warning("Live dashboard: slow SSE client dropped")
+                self.unsubscribe(q)
+                try:
+                    q.get_nowait()
+                    q.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    # -----------------------------
+    # Ответы админа
+    # -----------------------------
+    def queue_reply(self, target, text):
+        """Ставит ответ в очередь бота. Возвращает request_id; результат — событие reply_result."""
+        request_id = uuid.uuid4().hex[:12]
+
+        def done(ok, result):
+            self.publish({"type": "reply_result", "request_id": request_id, "target": target,
+                          "ok": bool(ok), "result": result})
+
+        self.reply_fn(target, text, done)
+        return request_id
+
+
+def _notification(name, event):
+    """Короткое событие для SSE или None."""
+    if not isinstance(event, dict):
+        return None
+    if name == "feedback":
+        comment = event.get("comment")
+        if not comment and event.get("type") == "comment":
+            comment = event.get("text")
+        if event.get("rating") is None and not comment:
+            return None
+        return {
+            "type": "feedback",
+            "ts": event.get("ts"),
+            "user_id": event.get("user_id"),
+            "thread_id": event.get("thread_id"),
+            "answer_id": event.get("answer_id"),
+            "branch": event.get("branch"),
+            "rating": event.get("rating"),
+            "comment": (comment or "")[:500],
+        }
+    if name == "dialogs" and event.get("role") == "admin":
+        return {
+            "type": "admin_reply",
+            "ts": event.get("ts"),
+            "user_id": event.get("user_id"),
+            "thread_id": event.get("thread_id"),
+            "text": (event.get("text") or "")[:500],
+        }
+    return None
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "AiAntiblokLive/1.0"
+
+    @property
+    def live(self):
+        return self.server.live
+
+    def log_message(self, fmt, *args):
+        logger.debug("live dashboard: " + fmt, *args)
+
+    def _send(self, code, body, content_type="application/json; charset=utf-8"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, query, form=None):
+        token = self.live.token
+        if not token:
+            return False
+        given = (self.headers.get("X-Dash-Token")
+                 or (query.get("token") or [""])[0]
+                 or ((form or {}).get("token") or [""])[0])
+        return hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if not self._authorized(query):
+            self._send(403, {"ok": False, "error": "bad token"})
+            return
+        path = url.path
+        if path in ("/", "/index.html"):
+            self._send_index()
+        elif path.startswith("/data/"):
+            if not self.live.ready:
+                self._send(503, {"ok": False, "error": "warming up"})
+                return
+            body = self.live.payload(path[len("/data/"):])
+            if body is None:
+                self._send(404, {"ok": False, "error": "not found"})
+            else:
+                self._send(200, body)
+        elif path == "/api/events":
+            self._stream_events()
+        else:
+            self._send(404, {"ok": False, "error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/api/reply":
+            self._send(404, {"ok": False, "error": "not found"})
+            return
+        if self.live.reply_fn is None:
+            self._send(403, {"ok": False, "error": "replies disabled"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = 0
+        if length <= 0 or length > MAX_BODY:
+            self._send(400, {"ok": False, "error": "bad body"})
+            return
+        raw = self.rfile.read(length).decode("utf-8", "replace")
+        if (self.headers.get("Content-Type") or "").startswith("application/json"):
+            try:
+                form = {k: [str(v)] for k, v in json.loads(raw).items()}
+            except Exception:
+                self._send(400, {"ok": False, "error": "bad json"})
+                return
+        else:
+            form = parse_qs(raw)
+        if not self._authorized(parse_qs(url.query), form):
+            self._send(403, {"ok": False, "error": "bad token"})
+            return
+        target = (form.get("target") or form.get("answer_id") or [""])[0].strip()
+        text = (form.get("text") or [""])[0].strip()
+        if not target or not text:
+            self._send(400, {"ok": False, "error": "missing fields"})
+            return
+        request_id = self.live.queue_reply(target, text)
+        self._send(202, {"ok": True, "queued": True, "request_id": request_id})
+
+    def _send_index(self):
+        path = os.path.join(self.live.dash_dir, "index.html")
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            self._send(404, "dashboard/index.html not found: run scripts/build_dashboard.py once",
+                       "text/plain; charset=utf-8")
+            return
+        self._send(200, body, "text/html; charset=utf-8")
+
+    def _stream_events(self):
+        q = self.live.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.flush()
+            while True:
+                try:
+                    msg = q.get(timeout=SSE_PING_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    continue
+                if msg is None:
+                    break
+                data = json.dumps(msg, ensure_ascii=False)
+                self.wfile.write(("data: %s\n\n" % data).encode("utf-8"))
+                self.wfile.flush()
+        except (OSError, ValueError):
+            # клиент закрыл соединение
+            pass
+        finally:
+            self.live.unsubscribe(q)
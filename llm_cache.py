@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кэш ответов LLM на диске (SQLite, data/llm_cache.sqlite3).
+
+Ключ — sha256 от модели, системного промпта, нормализованного промпта
+(регистр и пробелы не важны) и версии индекса KB: после пересборки KB
+старые ответы просто перестают находиться и вытесняются.
+
+- TTL: запись старше ttl секунд считается промахом и удаляется
+- LRU по размеру: если ответы занимают больше max_bytes, удаляются
+  давно не использованные, пока размер не станет ниже 90% лимита
+- stats(): попадания/промахи/вытеснения с момента запуска и размер кэша
+
+Кэшируются только успешные ответы; при temperature=0.2 ответы на один и тот
+же промпт взаимозаменяемы. Промпты с историей треда или данными кейса у каждого
+пользователя свои — bot.gigachat_call(personal=True) кэш для них не использует,
+так что в кэш попадают промпты из вопроса, ветки и фрагментов KB.
+"""
+
+import re
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("AiAntiblokBot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key         TEXT PRIMARY KEY,
+    model       TEXT,
+    answer      TEXT,
+    size        INTEGER,
+    created_ts  INTEGER,
+    used_ts     REAL,
+    hits        INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_used_ts ON entries (used_ts);
+"""
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    return _SPACE_RE.sub(" ", (text or "").strip()).lower()
+
+
+def make_key(model, system_prompt, prompt, kb_version=""):
+    raw = json.dumps([model or "", system_prompt or "", normalize_prompt(prompt), kb_version or ""],
+                     ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache(object):
+    def __init__(self, db_path, ttl=7 * 86400, max_bytes=50 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl = int(ttl)
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, key):
+        """Ответ по ключу или None (промах, в том числе по TTL)."""
+        now = int(time.time())
+        with self._lock:
+            row = self._conn.execute("SELECT answer, size, created_ts FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            answer, size, created_ts = row
+            if self.ttl and now - (created_ts or 0) > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self._bytes -= size or 0
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET used_ts = ?, hits = hits + 1 WHERE key = ?",
+                               (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return answer
+
+    def put(self, key, model, answer):
+        if not answer:
+            return
+        now = int(time.time())
+        size = len(answer.encode("utf-8"))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._bytes -= row[0] or 0
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, model, answer, size, created_ts, used_ts, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, model, answer, size, now, time.time()),
+            )
+            self._bytes += size
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """Удаляет просроченные записи, затем самые давно использованные до 90% лимита."""
+        cur = self._conn.cursor()
+        if self.ttl:
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE created_ts < ?",
+                        (now - self.ttl,))
+            n, size = cur.fetchone()
+            if n:
+                cur.execute("DELETE FROM entries WHERE created_ts < ?", (now - self.ttl,))
+                self._bytes -= size
+                self.expired += n
+        target = int(self.max_bytes * 0.9)
+        if self._bytes <= target:
+            return
+        keys = []
+        freed = 0
+        for key, size in cur.execute("SELECT key, size FROM entries ORDER BY used_ts"):
+            keys.append((key,))
+            freed += size or 0
+            if self._bytes - freed <= target:
+                break
+        cur.executemany("DELETE FROM entries WHERE key = ?", keys)
+        self._bytes -= freed
+        self.evicted += len(keys)
+
+    def stats(self):
+        with self._lock:
+            n = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": n,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(float(self.hits) / lookups, 3) if lookups else 0.0,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
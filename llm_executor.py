@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ограниченный пул для долгих задач (запросы к LLM) вне потоков диспетчера PTB.
+
+- max_workers — сколько задач выполняется одновременно
+- max_queue   — сколько ещё может ждать в очереди; сверх этого submit()
+  возвращает None, и обработчик сразу отвечает пользователю «занято»
+
+Диспетчер только ставит задачу в очередь и освобождается для оценок,
+кнопок меню и команд; результат задача сама отправляет в чат.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("AiAntiblokBot")
+
+
+class LLMExecutor(object):
+    def __init__(self, max_workers=4, max_queue=50):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Свободные места: выполняются + ждут; занимается в submit, освобождается по завершении
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Ставит fn(*args, **kwargs) в очередь. None — очередь заполнена."""
+        if not self._slots.acquire(False):
+            with self._lock:
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.pending += 1
+        try:
+            return self._pool.submit(self._run, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            raise
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self.pending -= 1
+            self.running += 1
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        except Exception:
+            logger.exception("LLM task failed")
+        finally:
+            with self._lock:
+                self.running -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queued": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
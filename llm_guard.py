@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Защита вызовов LLM от деградации GigaChat.
+
+CircuitBreaker — автомат closed / open / half_open по недавним вызовам:
+- closed: вызовы идут; за последние window секунд копятся исходы и задержки.
+  Если вызовов не меньше min_calls и доля ошибок (включая таймауты)
+  не ниже error_rate — автомат открывается
+- open: вызовы сразу отклоняются (бот отвечает по RAG без ожидания),
+  через cooldown секунд — half_open
+- half_open: пропускается один пробный вызов; успех закрывает автомат,
+  ошибка снова открывает его на cooldown
+
+timeout() — адаптивный таймаут: p95 успешных вызовов × timeout_factor
+в пределах [min_timeout, max_timeout]; пока замеров мало — max_timeout.
+Потоковые вызовы (stream=True) длятся до конца генерации, а не до ответа
+целиком, поэтому их задержки копятся и дают таймаут отдельно.
+
+BreakerPool — свой CircuitBreaker на каждую модель: сбой или медленный p95
+одной модели не отключает и не удлиняет таймауты другой.
+
+RateLimiter — token bucket на вызовы LLM: общий (под квоту API) и по
+пользователю. Пользователь сверх лимита сразу получает отказ; при пустом
+общем ведре вызов может подождать до max_wait секунд, пока накопится токен.
+Проверять автомат нужно до acquire(); release() возвращает токены вызова,
+который так и не ушёл в LLM.
+
+InFlight — склейка одинаковых запросов, которые выполняются одновременно:
+первый (лидер) идёт в LLM, остальные ждут его результат со своим таймаутом
+и получают промежуточный текст потокового ответа. Промежуточный текст
+раздаётся в пуле notify_workers, а не в потоке, читающем ответ лидера:
+медленные правки сообщений у N ожидающих не задерживают чтение; пока идёт
+раздача, фрагменты схлопываются до самого свежего.
+"""
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger("AiAntiblokBot")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values, q):
+    """Перцентиль q (0..1) по списку чисел, ближайший ранг."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(math.ceil(q * len(ordered))) - 1))
+    return ordered[idx]
+
+
+class CircuitBreaker(object):
+    def __init__(self, name="llm", window=60, min_calls=5, error_rate=0.5, cooldown=30,
+                 min_timeout=10, max_timeout=60, timeout_factor=1.5, min_samples=20):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._opened_ts = 0.0
+        self._probe_in_flight = False
+        self._calls = deque()                # (ts, ok) за окно
+        # задержки успешных вызовов, сек: обычных и потоковых
+        self._latencies = {False: deque(maxlen=200), True: deque(maxlen=200)}
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self):
+        """Можно ли делать вызов сейчас. В half_open пропускает один пробный вызов."""
+        with self._lock:
+            if self.state == OPEN and time.time() - self._opened_ts >= self.cooldown:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        """Вызов, пропущенный allow(), не состоялся (например, отказ лимита): освобождает пробу half_open."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record(self, ok, latency=None, stream=False):
+        """Исход вызова, пропущенного allow(); latency — длительность в секундах, stream — потоковый вызов."""
+        now = time.time()
+        with self._lock:
+            if ok and latency is not None:
+                self._latencies[bool(stream)].append(latency)
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._calls.clear()
+                    self._set_state(CLOSED)
+                else:
+                    self._open(now)
+                return
+            self._calls.append((now, bool(ok)))
+            self._trim(now)
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                errors = sum(1 for _, good in self._calls if not good)
+                if float(errors) / len(self._calls) >= self.error_rate:
+                    self._open(now)
+
+    def timeout(self, stream=False):
+        """Таймаут следующего вызова по p95 недавних успешных задержек того же вида."""
+        with self._lock:
+            samples = list(self._latencies[bool(stream)])
+        if len(samples) < self.min_samples:
+            return self.max_timeout
+        p95 = percentile(samples, 0.95)
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_factor))
+
+    def _open(self, now):
+        self._opened_ts = now
+        self.opened += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("Circuit breaker %s: %s -> %s", self.name, self.state, state)
+            self.state = state
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.time())
+            calls = len(self._calls)
+            errors = sum(1 for _, good in self._calls if not good)
+            samples = list(self._latencies[False])
+            stream_samples = list(self._latencies[True])
+            state = self.state
+            retry_in = max(0.0, self.cooldown - (time.time() - self._opened_ts)) if state == OPEN else 0.0
+        p95 = percentile(samples, 0.95)
+        stream_p95 = percentile(stream_samples, 0.95)
+        return {
+            "state": state,
+            "calls": calls,
+            "errors": errors,
+            "error_rate": round(float(errors) / calls, 3) if calls else 0.0,
+            "p95": round(p95, 2) if p95 is not None else None,
+            "timeout": round(self.timeout(), 1),
+            "stream_p95": round(stream_p95, 2) if stream_p95 is not None else None,
+            "stream_timeout": round(self.timeout(stream=True), 1),
+            "retry_in": round(retry_in, 1),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerPool(object):
+    """CircuitBreaker по ключу (модели), создаётся при первом обращении с общими настройками."""
+
+    def __init__(self, name="llm", **settings):
+        self.name = name
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker("%s:%s" % (self.name, key), **self.settings)
+            return breaker
+
+    def stats(self):
+        """key -> CircuitBreaker.stats()."""
+        with self._lock:
+            items = list(self._breakers.items())
+        return {key: breaker.stats() for key, breaker in items}
+
+
+class TokenBucket(object):
+    """rate токенов в секунду, не больше capacity. Не потокобезопасен — под локом владельца."""
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.ts = time.time() if now is None else now
+
+    def _refill(self, now):
+        if now > self.ts:
+            self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def wait_time(self, now):
+        """Через сколько секунд появится целый токен."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1.0)
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter(object):
+    # Сколько пользовательских ведер держать, прежде чем выбросить полные (неактивных)
+    MAX_USERS = 10000
+
+    def __init__(self, global_rate=2.0, global_burst=10, user_rate=5 / 60.0, user_burst=3, max_wait=2.0):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._users = {}
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.waited = 0
+        self.user_limited = 0
+        self.global_limited = 0
+
+    def acquire(self, user_id=None):
+        """None — вызов разрешён; "user" / "global" — какой лимит превышен."""
+        with self._lock:
+            now = time.time()
+            bucket = None
+            if user_id is not None and self.user_rate > 0:
+                bucket = self._users.get(user_id)
+                if bucket is None:
+                    if len(self._users) >= self.MAX_USERS:
+                        self._users = {k: b for k, b in self._users.items() if not b.full(now)}
+                    bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst, now)
+                if not bucket.take(now):
+                    self.user_limited += 1
+                    return "user"
+            if self._global is None or self._global.take(now):
+                self.allowed += 1
+                return None
+            wait = self._global.wait_time(now)
+            if wait > self.max_wait:
+                if bucket is not None:
+                    bucket.give_back()
+                self.global_limited += 1
+                return "global"
+            # Резервируем будущий токен: следующий вызывающий будет ждать дольше
+            self._global.tokens -= 1.0
+            self.waited += 1
+            self.allowed += 1
+        time.sleep(wait)
+        return None
+
+    def release(self, user_id=None):
+        """Возвращает токены, взятые acquire(user_id), если вызов не состоялся."""
+        with self._lock:
+            if self._global is not None:
+                self._global.give_back()
+            bucket = self._users.get(user_id) if user_id is not None else None
+            if bucket is not None:
+                bucket.give_back()
+            self.allowed -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "waited": self.waited,
+                "user_limited": self.user_limited,
+                "global_limited": self.global_limited,
+                "users": len(self._users),
+            }
+
+
+class _Flight(object):
+    def __init__(self, executor=None):
+        self.future = Future()
+        self.listeners = []
+        self.done = False
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._text = None
+        self._scheduled = False
+
+    def add_listener(self, fn):
+        with self._lock:
+            self.listeners.append(fn)
+
+    def remove_listener(self, fn):
+        with self._lock:
+            if fn in self.listeners:
+                self.listeners.remove(fn)
+
+    def broadcast(self, text):
+        """on_text лидера: отдаёт промежуточный текст на раздачу ожидающим и сразу возвращается."""
+        with self._lock:
+            if self.done:
+                return
+            self._text = text
+            if self._scheduled:
+                return
+            self._scheduled = True
+        if self._executor is None:
+            self._deliver()
+            return
+        try:
+            self._executor.submit(self._deliver)
+        except RuntimeError:  # пул уже остановлен
+            with self._lock:
+                self._scheduled = False
+
+    def _deliver(self):
+        while True:
+            with self._lock:
+                text = self._text
+                self._text = None
+                if self.done or text is None:
+                    self._scheduled = False
+                    return
+                listeners = list(self.listeners)
+            for fn in listeners:
+                try:
+                    fn(text)
+                except Exception as e:
+                    logger.info("In-flight listener failed: %s", e)
+
+    def close(self):
+        """Больше не раздавать промежуточный текст (итог — через future)."""
+        with self._lock:
+            self.done = True
+            self._text = None
+
+
+class InFlight(object):
+    def __init__(self, notify_workers=4):
+        self._notify = ThreadPoolExecutor(max_workers=notify_workers) if notify_workers > 0 else None
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def join(self, key, on_text=None):
+        """Запрос с таким ключом уже выполняется? Тогда подписывает on_text и возвращает его _Flight."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                if on_text is not None:
+                    flight.add_listener(on_text)
+                self.coalesced += 1
+            return flight
+
+    def begin(self, key, on_text=None):
+        """(flight, leader): leader=True — вызывающий выполняет запрос и обязан вызвать finish()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                if on_text is not None:
+                    flight.add_listener(on_text)
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(self._notify)
+            if on_text is not None:
+                flight.add_listener(on_text)
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.close()
+        flight.future.set_result(result)
+
+    def wait(self, flight, timeout, on_text=None):
+        """Результат лидера или None, если не дождались за timeout секунд."""
+        try:
+            return flight.future.result(timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            if on_text is not None:
+                # Раздача могла уже взять список слушателей: вызывающий сам игнорирует
+                # поздние фрагменты после своего итогового текста (StreamingReply.finish)
+                flight.remove_listener(on_text)
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
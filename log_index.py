@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Индекс по логам событий (SQLite, data/log_index.sqlite3).
+
+- threads: thread_id -> user_id, chat_id и положение последнего сообщения треда
+- answers: answer_id -> thread_id, user_id, chat_id и положение ответа бота
+- comments: комментарии из feedback.jsonl по времени (для /inbox); eff_rating —
+  оценка самого комментария или, без неё, последняя оценка ответа: фильтр
+  rating<=N идёт по индексу, без join
+- answer_ratings: последняя оценка ответа (по ней обновляется eff_rating
+  комментариев без оценки, а rollups вычитают прежнюю оценку при переоценке)
+- comment_reads: что из комментариев уже видел каждый админ
+- rollups: почасовые и суточные счётчики по веткам (см. rollups.py, /stats)
+- log_positions: положение последней проиндексированной строки каждого лога
+
+Положение хранится как (log_seq, log_offset): номер сегмента лога (seq из
+манифеста ротации, см. event_log.py) и смещение строки в нём — оно не
+меняется при ротации и не повторяется. Индекс версии 3 и старше был по inode;
+при открытии такого индекса отметки о прочтении переносятся по (ts, user_id,
+текст комментария), а сам индекс пересобирается по логам.
+
+Индекс обновляется из потока EventWriter (on_events) и всегда может быть
+пересобран из логов: rebuild() или scripts/rebuild_log_index.py.
+
+Пропуски (упавший слушатель, падение между записью в лог и commit, строки,
+дописанные send_outbox.py) догоняются по log_positions: при старте бота —
+catch_up(), на ходу — когда пачка начинается не там, где кончилась предыдущая.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+
+from event_log import (
+    encode_event, event_ts, iter_log_lines, iter_log_records, load_manifest, log_archive_dir, log_name, rotation_in_progress,
+)
+from rollups import FIELDS as ROLLUP_FIELDS, Rollups
+
+logger = logging.getLogger("AiAntiblokBot")
+
+# Увеличивается при добавлении таблиц: индекс старой версии пересобирается по логам
+SCHEMA_VERSION = 7
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id   TEXT PRIMARY KEY,
+    user_id     INTEGER,
+    chat_id     INTEGER,
+    last_ts     INTEGER,
+    log_seq     INTEGER,
+    log_offset  INTEGER
+);
+CREATE TABLE IF NOT EXISTS answers (
+    answer_id   TEXT PRIMARY KEY,
+    thread_id   TEXT,
+    user_id     INTEGER,
+    chat_id     INTEGER,
+    ts          INTEGER,
+    log_seq     INTEGER,
+    log_offset  INTEGER
+);
+CREATE TABLE IF NOT EXISTS comments (
+    ts          INTEGER,
+    user_id     INTEGER,
+    chat_id     INTEGER,
+    thread_id   TEXT,
+    answer_id   TEXT,
+    branch      TEXT,
+    rating      INTEGER,
+    eff_rating  INTEGER,
+    comment     TEXT,
+    log_seq     INTEGER,
+    log_offset  INTEGER,
+    PRIMARY KEY (log_seq, log_offset)
+);
+CREATE INDEX IF NOT EXISTS comments_ts ON comments (ts);
+-- фильтры /inbox (list_comments) с сортировкой по времени; answer_id — обновление eff_rating
+CREATE INDEX IF NOT EXISTS comments_branch_ts ON comments (branch, ts);
+CREATE INDEX IF NOT EXISTS comments_answer ON comments (answer_id);
+CREATE TABLE IF NOT EXISTS answer_ratings (
+    answer_id   TEXT PRIMARY KEY,
+    rating      INTEGER,
+    ts          INTEGER,
+    branch      TEXT
+);
+CREATE TABLE IF NOT EXISTS comment_reads (
+    admin_id    INTEGER,
+    log_seq     INTEGER,
+    log_offset  INTEGER,
+    PRIMARY KEY (admin_id, log_seq, log_offset)
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    period      TEXT,
+    bucket      INTEGER,
+    branch      TEXT,
+    %s,
+    PRIMARY KEY (period, bucket, branch)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS log_positions (
+    log         TEXT PRIMARY KEY,
+    log_seq     INTEGER,
+    log_offset  INTEGER
+);
+""" % ",\n    ".join("%s INTEGER NOT NULL DEFAULT 0" % f for f in ROLLUP_FIELDS)
+
+_ROLLUP_UPDATE = "UPDATE rollups SET %s WHERE period = ? AND bucket = ? AND branch = ?" % (
+    ", ".join("%s = %s + ?" % (f, f) for f in ROLLUP_FIELDS))
+_ROLLUP_INSERT = "INSERT INTO rollups (period, bucket, branch, %s) VALUES (?, ?, ?, %s)" % (
+    ", ".join(ROLLUP_FIELDS), ", ".join("?" * len(ROLLUP_FIELDS)))
+
+
+class _StoredRatings(dict):
+    """Rollups.ratings поверх answer_ratings: оценки ответов не из текущей пачки читаются из индекса."""
+
+    def __init__(self, cur):
+        dict.__init__(self)
+        self._cur = cur
+
+    def get(self, answer_id, default=None):
+        if answer_id not in self:
+            row = self._cur.execute(
+                "SELECT ts, branch, rating FROM answer_ratings WHERE answer_id = ?", (answer_id,)).fetchone()
+            dict.__setitem__(self, answer_id, list(row) if row else None)
+        return dict.get(self, answer_id) or default
+
+
+class LogIndex(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._legacy_reads = self._migrate_inode_schema()
+            self._conn.executescript(SCHEMA)
+            cols = [r[1] for r in self._conn.execute("PRAGMA table_info(answer_ratings)").fetchall()]
+            if "branch" not in cols:
+                # индекс v5 и старше: колонка нужна rollups, сам индекс пересоберётся по user_version
+                self._conn.execute("ALTER TABLE answer_ratings ADD COLUMN branch TEXT")
+            cols = [r[1] for r in self._conn.execute("PRAGMA table_info(comments)").fetchall()]
+            if "eff_rating" not in cols:
+                # индекс v6 и старше: заполнится при пересборке
+                self._conn.execute("ALTER TABLE comments ADD COLUMN eff_rating INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS comments_eff_rating_ts ON comments (eff_rating, ts)")
+            self._conn.commit()
+            self._version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            # имя лога -> (seq, offset) последней проиндексированной строки (копия log_positions)
+            self._positions = self._load_positions()
+            # имя лога -> (seq, offset), с которого должна начаться следующая пачка
+            self._next = {}
+
+    def _migrate_inode_schema(self):
+        """Индекс v3 (ключи по inode): запоминает прочитанные комментарии и удаляет таблицы с позициями."""
+        cols = [r[1] for r in self._conn.execute("PRAGMA table_info(comments)").fetchall()]
+        if "log_inode" not in cols:
+            return []
+        reads = self._conn.execute(
+            "SELECT rd.admin_id, c.ts, c.user_id, c.comment FROM comment_reads rd "
+            "JOIN comments c ON rd.log_inode = c.log_inode AND rd.log_offset = c.log_offset"
+        ).fetchall()
+        for table in ("threads", "answers", "comments", "comment_reads"):
+            self._conn.execute("DROP TABLE IF EXISTS %s" % table)
+        self._conn.execute("PRAGMA user_version = 0")
+        logger.info("Log index: inode-keyed schema dropped, %d read marks kept for rebuild", len(reads))
+        return [tuple(r) for r in reads]
+
+    def _restore_legacy_reads(self, cur):
+        for admin_id, ts, user_id, comment in self._legacy_reads:
+            cur.execute(
+                "INSERT OR IGNORE INTO comment_reads (admin_id, log_seq, log_offset) "
+                "SELECT ?, log_seq, log_offset FROM comments WHERE ts IS ? AND user_id IS ? AND comment = ?",
+                (admin_id, ts, user_id, comment),
+            )
+        self._legacy_reads = []
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self):
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()
+        return not row[0]
+
+    def needs_rebuild(self):
+        """Индекс ни разу не строился по логам или построен старой версией схемы."""
+        with self._lock:
+            return self._version < SCHEMA_VERSION or not self._positions
+
+    # -----------------------------
+    # Запись (поток EventWriter)
+    # -----------------------------
+    def on_events(self, path, events, seq, offsets):
+        """Listener для EventWriter.add_listener.
+
+        Если пачка начинается не сразу за последней проиндексированной строкой,
+        пропущенный кусок сначала дочитывается из лога.
+        """
+        name = log_name(path)
+        with self._lock:
+            cur = self._conn.cursor()
+            rollups = Rollups(ratings=_StoredRatings(cur))
+            try:
+                if not self._follows(path, name, seq, offsets[0]):
+                    self._replay(cur, path, name, (seq, offsets[0]), rollups)
+                for event, offset in zip(events, offsets):
+                    # rollups — до индекса: прежняя оценка ответа ещё в answer_ratings
+                    rollups.add(name, event)
+                    self._index_event(cur, name, event, seq, offset)
+                self._apply_rollups(cur, rollups)
+                self._save_position(cur, name, (seq, offsets[-1]))
+                self._conn.commit()
+            except Exception:
+                # Ничего из пачки не попадает в индекс: следующая пачка дочитает её из лога
+                self._conn.rollback()
+                self._positions = self._load_positions()
+                self._next.pop(name, None)
+                raise
+            self._next[name] = (seq, offsets[-1] + len(encode_event(events[-1])))
+
+    def catch_up(self, dialogs_path, feedback_path=None):
+        """Дочитывает в индекс строки логов после сохранённых положений (при старте бота)."""
+        n = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            rollups = Rollups(ratings=_StoredRatings(cur))
+            for path in (dialogs_path, feedback_path):
+                if not path:
+                    continue
+                name = log_name(path)
+                self._next.pop(name, None)
+                if rotation_in_progress(path):
+                    # номер активного файла не определён; догонит первая пачка после ротации
+                    continue
+                n += self._replay(cur, path, name, None, rollups)
+            self._apply_rollups(cur, rollups)
+            self._conn.commit()
+        if n:
+            logger.info("Log index caught up: %d events", n)
+        return n
+
+    def _follows(self, path, name, seq, offset):
+        """Пачка (seq, offset) идёт сразу за проиндексированной частью лога."""
+        if name not in self._positions:
+            return True
+        expected = self._next.get(name)
+        if expected is None:
+            return False
+        if (seq, offset) == expected:
+            return True
+        if offset != 0 or seq != expected[0] + 1:
+            return False
+        # Ротация: прошлый сегмент закончился там, где кончилась проиндексированная часть
+        for entry in load_manifest(log_archive_dir(path))["segments"]:
+            if entry["seq"] == expected[0]:
+                return entry.get("bytes") == expected[1]
+        try:
+            # сегмент ещё сжимается (event_log: .rotating получит seq позже)
+            return os.path.getsize(path + ".rotating") == expected[1]
+        except OSError:
+            return False
+
+    def _replay(self, cur, path, name, until, rollups):
+        """Индексирует строки лога после сохранённого положения и до until=(seq, offset)."""
+        after = self._positions.get(name)
+        n = 0
+        last = None
+        for event, seq, offset, end in iter_log_lines(path, after=after):
+            if until is not None and (seq, offset) >= until:
+                break
+            rollups.add(name, event)
+            self._index_event(cur, name, event, seq, offset)
+            last = (seq, offset)
+            self._next[name] = (seq, end)
+            n += 1
+        if last is not None:
+            self._save_position(cur, name, last)
+        if n:
+            logger.warning("Log index: %d events of %s replayed from the log", n, name)
+        return n
+
+    def _save_position(self, cur, name, pos):
+        cur.execute("INSERT OR REPLACE INTO log_positions (log, log_seq, log_offset) VALUES (?, ?, ?)",
+                    (name,) + tuple(pos))
+        self._positions[name] = tuple(pos)
+
+    def _load_positions(self):
+        return dict((r[0], (r[1], r[2])) for r in self._conn.execute("SELECT * FROM log_positions").fetchall())
+
+    def _index_event(self, cur, name, event, seq, offset):
+        if not isinstance(event, dict):
+            return
+        if name == "feedback":
+            self._index_feedback(cur, event, seq, offset)
+            return
+        if name != "dialogs":
+            return
+        thread_id = event.get("thread_id")
+        if not thread_id:
+            return
+        user_id = event.get("user_id")
+        chat_id = event.get("chat_id") or user_id
+        ts = event.get("ts") if isinstance(event.get("ts"), int) else None
+        # Без UPSERT: SQLite на серверах с Python 3.6 может быть старше 3.24
+        cur.execute(
+            "UPDATE threads SET last_ts = ?, log_seq = ?, log_offset = ? WHERE thread_id = ?",
+            (ts, seq, offset, thread_id),
+        )
+        if cur.rowcount == 0:
+            cur.execute(
+                "INSERT INTO threads (thread_id, user_id, chat_id, last_ts, log_seq, log_offset) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (thread_id, user_id, chat_id, ts, seq, offset),
+            )
+        answer_id = (event.get("meta") or {}).get("answer_id")
+        if event.get("role") == "bot" and answer_id:
+            cur.execute(
+                "INSERT OR REPLACE INTO answers (answer_id, thread_id, user_id, chat_id, ts, log_seq, log_offset) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (answer_id, thread_id, user_id, chat_id, ts, seq, offset),
+            )
+
+    def _index_feedback(self, cur, event, seq, offset):
+        ts = event_ts(event)
+        answer_id = event.get("answer_id")
+        rating = event.get("rating")
+        if rating is not None and answer_id:
+            try:
+                cur.execute(
+                    "INSERT OR REPLACE INTO answer_ratings (answer_id, rating, ts, branch) VALUES (?, ?, ?, ?)",
+                    (answer_id, int(rating), ts, event.get("branch") or ""),
+                )
+                # комментарии ответа без своей оценки берут последнюю оценку ответа
+                cur.execute("UPDATE comments SET eff_rating = ? WHERE answer_id = ? AND rating IS NULL",
+                            (int(rating), answer_id))
+            except (TypeError, ValueError):
+                pass
+        comment = event.get("comment")
+        if not comment and event.get("type") == "comment":
+            comment = event.get("text")
+        if not comment or not str(comment).strip():
+            return
+        eff_rating = rating
+        if eff_rating is None and answer_id:
+            row = cur.execute("SELECT rating FROM answer_ratings WHERE answer_id = ?", (answer_id,)).fetchone()
+            eff_rating = row[0] if row else None
+        cur.execute(
+            "INSERT OR REPLACE INTO comments "
+            "(ts, user_id, chat_id, thread_id, answer_id, branch, rating, eff_rating, comment, log_seq, log_offset) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (ts, event.get("user_id"), event.get("chat_id"), event.get("thread_id"), answer_id,
+             event.get("branch"), rating, eff_rating, comment, seq, offset),
+        )
+
+    def _apply_rollups(self, cur, rollups):
+        """Прибавляет накопленные счётчики к таблице rollups (без UPSERT, см. выше)."""
+        for (period, bucket, branch), counts in rollups.buckets.items():
+            cur.execute(_ROLLUP_UPDATE, tuple(counts) + (period, bucket, branch))
+            if cur.rowcount == 0:
+                cur.execute(_ROLLUP_INSERT, (period, bucket, branch) + tuple(counts))
+
+    def rebuild(self, dialogs_path, feedback_path=None):
+        """Пересобирает индекс с нуля по логам и их архивным сегментам (отметки о прочтении сохраняются)."""
+        n = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("DELETE FROM threads")
+            cur.execute("DELETE FROM answers")
+            cur.execute("DELETE FROM comments")
+            cur.execute("DELETE FROM answer_ratings")
+            cur.execute("DELETE FROM rollups")
+            cur.execute("DELETE FROM log_positions")
+            self._positions = {}
+            self._next = {}
+            rollups = Rollups()
+            for path in (dialogs_path, feedback_path):
+                if not path:
+                    continue
+                name = log_name(path)
+                # Пустой лог: положение "до первой строки" активного файла
+                last = (load_manifest(log_archive_dir(path))["next_seq"], -1)
+                for event, seq, offset in iter_log_records(path):
+                    rollups.add(name, event)
+                    self._index_event(cur, name, event, seq, offset)
+                    last = (seq, offset)
+                    n += 1
+                self._save_position(cur, name, last)
+            self._apply_rollups(cur, rollups)
+            self._restore_legacy_reads(cur)
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            self._conn.commit()
+            self._version = SCHEMA_VERSION
+        logger.info("Log index rebuilt: %d events", n)
+        return n
+
+    # -----------------------------
+    # Чтение
+    # -----------------------------
+    def lookup_thread(self, thread_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return dict(row) if row else None
+
+    def lookup_answer(self, answer_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM answers WHERE answer_id = ?", (answer_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_comments(self, admin_id, offset=0, limit=10, branch=None, max_rating=None):
+        """Страница комментариев (новые первыми) с эффективной оценкой и флагом прочтения.
+
+        Фильтры идут по индексам comments (branch, ts) и (eff_rating, ts).
+        """
+        where = []
+        args = [admin_id]
+        if branch:
+            where.append("c.branch = ?")
+            args.append(branch)
+        if max_rating is not None:
+            where.append("c.eff_rating <= ?")
+            args.append(int(max_rating))
+        sql = (
+            "SELECT c.*, (rd.admin_id IS NOT NULL) AS is_read "
+            "FROM comments c "
+            "LEFT JOIN comment_reads rd ON rd.admin_id = ? "
+            "AND rd.log_seq = c.log_seq AND rd.log_offset = c.log_offset"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY c.ts DESC, c.rowid DESC LIMIT ? OFFSET ?"
+        args.extend([int(limit), int(offset)])
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [dict(r) for r in rows]
+
+    def mark_read(self, admin_id, comments):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO comment_reads (admin_id, log_seq, log_offset) VALUES (?, ?, ?)",
+                [(admin_id, c["log_seq"], c["log_offset"]) for c in comments],
+            )
+            self._conn.commit()
+
+    def unread_count(self, admin_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM comments c WHERE NOT EXISTS ("
+                "SELECT 1 FROM comment_reads rd WHERE rd.admin_id = ? "
+                "AND rd.log_seq = c.log_seq AND rd.log_offset = c.log_offset)",
+                (admin_id,),
+            ).fetchone()
+        return row[0]
+
+    def rollup_rows(self, period, since=None, until=None, branch=None):
+        """Строки rollups периода ("h" / "d") с bucket в [since, until]: (period, bucket, branch, *счётчики)."""
+        where = ["period = ?"]
+        args = [period]
+        if since is not None:
+            where.append("bucket >= ?")
+            args.append(int(since))
+        if until is not None:
+            where.append("bucket <= ?")
+            args.append(int(until))
+        if branch is not None:
+            where.append("branch = ?")
+            args.append(branch)
+        sql = "SELECT period, bucket, branch, %s FROM rollups WHERE %s ORDER BY bucket" % (
+            ", ".join(ROLLUP_FIELDS), " AND ".join(where))
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [tuple(r) for r in rows]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выбор модели GigaChat по сложности вопроса.
+
+Таблица правил (data/model_routes.json или DEFAULT_ROUTES) просматривается
+сверху вниз, срабатывает первое подходящее правило. Условия правила
+(все необязательные, проверяются вместе):
+- min_chars / max_chars         — длина вопроса
+- patterns                      — хотя бы одна подстрока в вопросе (нижний регистр)
+- branches                      — ветка кейса
+- min_case_step / max_case_step — шаг опроса кейса (case_data.step)
+- min_top_score / max_top_score — BM25 лучшего фрагмента KB
+
+Модель правила — "model" (имя) или "tier": "light" / "strong", которые
+задаются GIGACHAT_MODEL_LIGHT / GIGACHAT_MODEL_STRONG (по умолчанию обе —
+GIGACHAT_MODEL, т.е. без настройки поведение прежнее, но маршрут и задержки
+уже пишутся в лог).
+
+record() копит по каждой модели число вызовов, ошибок и задержки (p50/p95).
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import deque
+
+from llm_guard import percentile
+
+logger = logging.getLogger("AiAntiblokBot")
+
+DEFAULT_ROUTES = [
+    # Короткий вопрос-определение: «что такое МВК?»
+    {"name": "definition", "tier": "light", "max_chars": 120,
+     "patterns": ["что такое", "что значит", "что означает", "расшифр", "кто такие", "это что"]},
+    # Анкета кейса пройдена — полный разбор ситуации
+    {"name": "case", "tier": "strong", "min_case_step": 4},
+    {"name": "long", "tier": "strong", "min_chars": 350},
+    # Короткий вопрос, на который в KB есть уверенное попадание
+    {"name": "short_kb", "tier": "light", "max_chars": 100, "min_top_score": 3.0},
+    {"name": "default", "tier": "strong"},
+]
+
+
+def question_features(text, branch=None, case_data=None, scores=None):
+    """Дешёвые признаки вопроса для правил."""
+    text = (text or "").strip()
+    return {
+        "text": text.lower(),
+        "chars": len(text),
+        "branch": branch or "",
+        "case_step": int((case_data or {}).get("step") or 0),
+        "top_score": max(scores) if scores else 0.0,
+    }
+
+
+def _matches(rule, f):
+    if "min_chars" in rule and f["chars"] < rule["min_chars"]:
+        return False
+    if "max_chars" in rule and f["chars"] > rule["max_chars"]:
+        return False
+    if rule.get("patterns") and not any(p in f["text"] for p in rule["patterns"]):
+        return False
+    if rule.get("branches") and f["branch"] not in rule["branches"]:
+        return False
+    if "min_case_step" in rule and f["case_step"] < rule["min_case_step"]:
+        return False
+    if "max_case_step" in rule and f["case_step"] > rule["max_case_step"]:
+        return False
+    if "min_top_score" in rule and f["top_score"] < rule["min_top_score"]:
+        return False
+    if "max_top_score" in rule and f["top_score"] > rule["max_top_score"]:
+        return False
+    return True
+
+
+class ModelRouter(object):
+    def __init__(self, default_model, light_model=None, strong_model=None, routes=None):
+        self.default_model = default_model
+        self.tiers = {
+            "light": light_model or default_model,
+            "strong": strong_model or default_model,
+        }
+        self.routes = routes or DEFAULT_ROUTES
+        self._lock = threading.Lock()
+        self._stats = {}  # model -> {"calls", "errors", "routes": {name: n}, "latencies": deque}
+
+    @classmethod
+    def from_file(cls, path, default_model, light_model=None, strong_model=None):
+        """Правила из JSON-файла ({"routes": [...]} или список), если он есть."""
+        routes = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                routes = data.get("routes") if isinstance(data, dict) else data
+                logger.info("Model routes loaded: %s (%d rules)", path, len(routes or []))
+            except Exception as e:
+                logger.warning("Model routes load failed (%s), using defaults: %s", path, e)
+        return cls(default_model, light_model, strong_model, routes)
+
+    def route(self, features):
+        """(модель, имя правила); выбор учитывается в stats()[model]["routes"]."""
+        model, name = self.default_model, "default"
+        for rule in self.routes:
+            if _matches(rule, features):
+                model = rule.get("model") or self.tiers.get(rule.get("tier")) or self.default_model
+                name = rule.get("name") or "?"
+                break
+        with self._lock:
+            routes = self._model_stats(model)["routes"]
+            routes[name] = routes.get(name, 0) + 1
+        return model, name
+
+    def record(self, model, latency, ok=True):
+        """Исход запроса к модели (кэш и склеенные запросы сюда не попадают)."""
+        with self._lock:
+            st = self._model_stats(model)
+            st["calls"] += 1
+            if not ok:
+                st["errors"] += 1
+            elif latency is not None:
+                st["latencies"].append(latency)
+
+    def _model_stats(self, model):
+        st = self._stats.get(model)
+        if st is None:
+            st = self._stats[model] = {"calls": 0, "errors": 0, "routes": {},
+                                       "latencies": deque(maxlen=500)}
+        return st
+
+    def stats(self):
+        """model -> {calls, errors, p50, p95, routes}."""
+        out = {}
+        with self._lock:
+            items = [(m, dict(st, latencies=list(st["latencies"]), routes=dict(st["routes"])))
+                     for m, st in self._stats.items()]
+        for model, st in items:
+            p50 = percentile(st["latencies"], 0.5)
+            p95 = percentile(st["latencies"], 0.95)
+            out[model] = {
+                "calls": st["calls"],
+                "errors": st["errors"],
+                "p50": round(p50, 2) if p50 is not None else None,
+                "p95": round(p95, 2) if p95 is not None else None,
+                "routes": st["routes"],
+            }
+        return out
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Счётчики по времени (rollups) для статистики без пересканирования логов.
+
+Корзина — (период, начало периода в unix ts UTC, ветка), в ней счётчики FIELDS:
+- messages       — сообщения пользователей (ветка не известна, branch = "")
+- answers        — ответы бота; rag_used / gigachat_used — из них с RAG / GigaChat
+- r1 .. r6       — гистограмма оценок (r6 — платная ⭐6); у ответа считается
+                   только последняя оценка: повторная вычитается из корзины прежней
+- comments       — комментарии к ответам
+- admin_replies  — ответы админов
+
+Периоды: "h" — час, "d" — сутки (UTC). Корзины можно копить по кускам лога
+и сводить merge() в порядке кусков. Для переоценок Rollups помнит последнюю
+оценку каждого answer_id (ratings: answer_id -> [ts, branch, rating]).
+
+Используется в log_index.py (таблица rollups для /stats) и в
+scripts/build_dashboard.py (dashboard/data/rollups.json).
+"""
+
+from event_log import event_ts
+
+PERIODS = {"h": 3600, "d": 86400}
+
+FIELDS = (
+    "messages", "answers", "rag_used", "gigachat_used",
+    "r1", "r2", "r3", "r4", "r5", "r6",
+    "comments", "admin_replies",
+)
+_FIELD_POS = {name: i for i, name in enumerate(FIELDS)}
+
+
+class Rollups(object):
+    def __init__(self, periods=("h", "d"), ratings=None):
+        self.periods = tuple(periods)
+        # (period, bucket, branch) -> [счётчики в порядке FIELDS]
+        self.buckets = {}
+        # answer_id -> [ts, branch, rating] учтённой оценки; log_index.py подставляет
+        # сюда оценки из answer_ratings, чтобы переоценка вычиталась и между пачками
+        self.ratings = {} if ratings is None else ratings
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, name, event):
+        """Учитывает событие лога name ("dialogs" / "feedback")."""
+        if not isinstance(event, dict):
+            return
+        ts = event_ts(event)
+        if ts is None:
+            return
+        if name == "dialogs":
+            role = event.get("role")
+            meta = event.get("meta") or {}
+            if role == "user":
+                self._inc(ts, "", "messages")
+            elif role == "bot" and meta.get("answer_id"):
+                branch = meta.get("branch") or ""
+                self._inc(ts, branch, "answers")
+                if meta.get("rag_used"):
+                    self._inc(ts, branch, "rag_used")
+                if meta.get("gigachat_used"):
+                    self._inc(ts, branch, "gigachat_used")
+            elif role == "admin":
+                self._inc(ts, "", "admin_replies")
+        elif name == "feedback":
+            branch = event.get("branch") or ""
+            try:
+                rating = int(event.get("rating"))
+            except (TypeError, ValueError):
+                rating = None
+            if rating is not None and 1 <= rating <= 6:
+                answer_id = event.get("answer_id")
+                if answer_id:
+                    self._retract(answer_id)
+                    self.ratings[answer_id] = [ts, branch, rating]
+                self._inc(ts, branch, "r%d" % rating)
+            comment = event.get("comment")
+            if not comment and event.get("type") == "comment":
+                comment = event.get("text")
+            if comment and str(comment).strip():
+                self._inc(ts, branch, "comments")
+
+    def _inc(self, ts, branch, field, n=1):
+        pos = _FIELD_POS[field]
+        for period in self.periods:
+            size = PERIODS[period]
+            key = (period, ts - ts % size, branch)
+            counts = self.buckets.get(key)
+            if counts is None:
+                counts = self.buckets[key] = [0] * len(FIELDS)
+            counts[pos] += n
+
+    def _retract(self, answer_id):
+        prev = self.ratings.get(answer_id)
+        if prev and prev[0] is not None and 1 <= prev[2] <= 6:
+            self._inc(prev[0], prev[1], "r%d" % prev[2], -1)
+
+    def merge(self, other):
+        """Добавляет корзины следующего куска лога: его оценки заменяют наши оценки тех же ответов."""
+        for answer_id in other.ratings:
+            self._retract(answer_id)
+        self.ratings.update(other.ratings)
+        for key, counts in other.buckets.items():
+            mine = self.buckets.get(key)
+            if mine is None:
+                self.buckets[key] = list(counts)
+            else:
+                for i, v in enumerate(counts):
+                    mine[i] += v
+
+    def rows(self, period=None):
+        """[(period, bucket, branch, *счётчики)] по возрастанию времени."""
+        return [key + tuple(counts) for key, counts in sorted(self.buckets.items())
+                if period is None or key[0] == period]
+
+    @classmethod
+    def from_rows(cls, rows, periods=("h", "d"), ratings=None):
+        r = cls(periods, ratings=dict(ratings or {}))
+        for row in rows or []:
+            r.buckets[(row[0], int(row[1]), row[2])] = [int(v) for v in row[3:3 + len(FIELDS)]]
+        return r
+
+
+def summarize(rows):
+    """Сводка по строкам rollups одного периода: итог и разбивка по веткам.
+
+    rows — [(period, bucket, branch, *счётчики)] (как Rollups.rows или из SQLite).
+    """
+    total = dict.fromkeys(FIELDS, 0)
+    branches = {}
+    for row in rows:
+        branch = row[2] or ""
+        per_branch = branches.setdefault(branch, dict.fromkeys(FIELDS, 0))
+        for name, v in zip(FIELDS, row[3:]):
+            total[name] += v
+            per_branch[name] += v
+    for counts in [total] + list(branches.values()):
+        rated = [counts["r%d" % i] for i in range(1, 6)]
+        n = sum(rated)
+        counts["ratings_1_5"] = n
+        counts["avg_rating_1_5"] = round(sum(i * c for i, c in enumerate(rated, 1)) / n, 2) if n else 0.0
+    return {"total": total, "branches": branches}
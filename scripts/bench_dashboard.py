@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк build_dashboard.py на синтетических логах.
+
+Генерирует dialogs.jsonl/feedback.jsonl заданного размера во временной папке,
+собирает дашборд и печатает время и скорость для каждого размера — при
+линейной сложности events/s остаётся примерно постоянным.
+
+Запуск:
+  venv/bin/python scripts/bench_dashboard.py                 # 10k, 100k, 1M событий
+  venv/bin/python scripts/bench_dashboard.py 50000 200000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import build_dashboard
+
+BRANCHES = ["115fz", "zsk", "161fz", "tax", "bailiffs", None]
+
+def generate_logs(out_dir, n_events, seed=1):
+    """Синтетический лог примерно из n_events событий (вопрос, ответ, оценки, комментарии, ответы админа)."""
+    rnd = random.Random(seed)
+    dialogs_path = os.path.join(out_dir, "dialogs.jsonl")
+    feedback_path = os.path.join(out_dir, "feedback.jsonl")
+    n_users = max(10, n_events // 20)
+    threads = {}
+    ts = 1700000000
+    written = 0
+    with open(dialogs_path, "w", encoding="utf-8") as d, open(feedback_path, "w", encoding="utf-8") as fb:
+        i = 0
+        while written < n_events:
+            i += 1
+            ts += rnd.randint(1, 30)
+            uid = rnd.randint(1, n_users)
+            thread_id = threads.setdefault(uid, "t-%d" % uid)
+            question = "вопрос %d про блокировку счёта" % i
+            answer_id = "a-%d" % i
+            d.write(json.dumps({"ts": ts, "user_id": uid, "user_name": "u%d" % uid, "chat_id": uid,
+                                "role": "user", "text": question, "meta": {}}, ensure_ascii=False) + "\n")
+            d.write(json.dumps({"ts": ts + 1, "user_id": uid, "user_name": "u%d" % uid, "chat_id": uid,
+                                "role": "bot", "text": "ответ " * 40, "thread_id": thread_id,
+                                "meta": {"answer_id": answer_id, "question": question,
+                                         "branch": rnd.choice(BRANCHES), "rag_used": True,
+                                         "gigachat_used": rnd.random() < 0.8}}, ensure_ascii=False) + "\n")
+            written += 2
+            iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts + 5))
+            if rnd.random() < 0.5:
+                # часть оценок без answer_id — привязка через thread_id
+                fb.write(json.dumps({"ts": iso, "user_id": uid, "rating": rnd.randint(1, 6),
+                                     "comment": None, "thread_id": thread_id,
+                                     "answer_id": answer_id if rnd.random() < 0.7 else None},
+                                    ensure_ascii=False) + "\n")
+                written += 1
+            if rnd.random() < 0.1:
+                fb.write(json.dumps({"ts": iso, "user_id": uid, "rating": None,
+                                     "comment": "комментарий %d" % i, "thread_id": thread_id,
+                                     "answer_id": None}, ensure_ascii=False) + "\n")
+                written += 1
+            if rnd.random() < 0.05:
+                d.write(json.dumps({"ts": ts + 60, "user_id": uid, "chat_id": uid, "role": "admin",
+                                    "text": "ответ админа", "thread_id": thread_id,
+                                    "meta": {"admin_id": 1}}, ensure_ascii=False) + "\n")
+                written += 1
+    return dialogs_path, feedback_path, written
+
+def run(n_events):
+    tmp = tempfile.mkdtemp(prefix="dash_bench_")
+    try:
+        dialogs_path, feedback_path, written = generate_logs(tmp, n_events)
+        build_dashboard.DIALOGS_PATH = dialogs_path
+        build_dashboard.FEEDBACK_PATH = feedback_path
+        build_dashboard.DASH_DIR = os.path.join(tmp, "dashboard")
+        build_dashboard.CHECKPOINT_PATH = os.path.join(tmp, "checkpoint.json")
+        t0 = time.time()
+        build_dashboard.main(full=True)
+        dt = time.time() - t0
+        print("BENCH events=%d time=%.2fs rate=%.0f events/s" % (written, dt, written / dt if dt else 0))
+        return written, dt
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000, 1000000]
+    for n in sizes:
+        run(n)
+
+if __name__ == "__main__":
+    main()
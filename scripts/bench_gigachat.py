@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузка на GigaChat (обычно scripts/mock_gigachat.py) через bot.gigachat_call —
+с теми же лимитами, circuit breaker, склейкой одинаковых промптов и потоком,
+что и в боте (кэш ответов LLM не подключается).
+
+Запускает --requests вызовов в --concurrency потоков; промпты выбираются
+из --distinct вариантов, пользователи — из --users. Печатает задержки
+(p50/p95/p99), исходы по типам ошибок и статистику breaker / лимитов / склейки.
+
+Запуск (mock в соседнем терминале):
+    GIGACHAT_OAUTH_URL=http://127.0.0.1:8099/api/v2/oauth GIGACHAT_API_BASE=http://127.0.0.1:8099 \\
+    GIGACHAT_AUTH_KEY=mock venv/bin/python scripts/bench_gigachat.py --requests 300 --concurrency 20 --stream
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import bot
+from llm_guard import percentile
+
+
+def error_kind(err):
+    """Текст ошибки gigachat_call -> короткий тип для сводки."""
+    for prefix, kind in (("rate limited (user)", "user_limit"), ("rate limited (global)", "global_limit"),
+                         ("circuit open", "circuit_open"), ("auth error", "auth"),
+                         ("coalesced wait", "coalesced_timeout")):
+        if prefix in err:
+            return kind
+    if "timed out" in err.lower() or "timeout" in err.lower():
+        return "timeout"
+    for code in ("401", "429", "500", "502", "503"):
+        if code in err:
+            return "http_%s" % code
+    return "other"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test gigachat_call against a (mock) GigaChat")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--distinct", type=int, default=50, help="разных промптов (меньше — больше склейки)")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--stream", action="store_true", help="потоковые ответы, как при GIGACHAT_STREAM=1")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if bot.init_gigachat() is None:
+        print("GIGACHAT_AUTH_KEY not set")
+        return 1
+    rnd = random.Random(args.seed)
+    jobs = [(rnd.randint(1, args.users), rnd.randint(1, args.distinct)) for _ in range(args.requests)]
+
+    def one(job):
+        user_id, n = job
+        first = []
+        started = time.time()
+
+        def on_text(text):
+            if not first:
+                first.append(time.time() - started)
+
+        answer, err = bot.gigachat_call("Вопрос %d: банк заблокировал счёт, что делать?" % n,
+                                        user_id=user_id, on_text=on_text if args.stream else None)
+        return time.time() - started, (first[0] if first else None), err
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, jobs))
+    wall = time.time() - started
+
+    ok = [r for r in results if r[2] is None]
+    outcomes = {}
+    for _, _, err in results:
+        kind = "ok" if err is None else error_kind(err)
+        outcomes[kind] = outcomes.get(kind, 0) + 1
+    lat = [r[0] for r in ok]
+    ttft = [r[1] for r in ok if r[1] is not None]
+
+    def fmt(values):
+        if not values:
+            return "—"
+        return "p50 %.2f  p95 %.2f  p99 %.2f  max %.2f" % (
+            percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99), max(values))
+
+    print("Requests: %d in %.1f s (%.1f req/s), concurrency %d" % (
+        len(results), wall, len(results) / wall if wall else 0, args.concurrency))
+    print("Outcomes: %s" % ", ".join("%s %d" % kv for kv in sorted(outcomes.items())))
+    print("Latency ok, s:      %s" % fmt(lat))
+    if args.stream:
+        print("First token, s:     %s" % fmt(ttft))
+    print("Breakers: %s" % bot.GIGACHAT_BREAKERS.stats())
+    print("Limiter:  %s" % bot.LLM_RATE_LIMITER.stats())
+    print("InFlight: %s" % bot.LLM_INFLIGHT.stats())
+    print("Models:   %s" % bot.MODEL_ROUTER.stats())
+    bot.GIGACHAT.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,62 +4,154 @@
 Генератор статического HTML дашборда для AiAntiblokBot.
 
 Читает feedback.jsonl и dialogs.jsonl, генерирует:
-- dashboard/index.html (статический HTML с фильтрами)
+- dashboard/index.html (страница без данных, подгружает JSON из dashboard/data/)
 - dashboard/stats.json
-- dashboard/comments.json
+- dashboard/data/summary.json — статистика и список шардов
+- dashboard/data/index.json — лёгкие строки таблицы для фильтров и поиска
+- dashboard/data/rollups.json — суточные счётчики по веткам (rollups.py): карточки
+  статистики за выбранный период считаются только по ним
+- dashboard/data/filters.json — готовые списки позиций строк по ветке, статусу,
+  оценке, дню, наличию комментария и ⭐6 (фильтр = пересечение списков)
+- dashboard/data/threads/<YYYY-MM>/<статус>-NNNN.json — полные треды страницами
+  (страница подгружается, только когда в ней открывают детали)
+- dashboard/comments.json — все треды одним файлом, только при DASH_WRITE_COMMENTS_JSON=1
+
+Сборка инкрементальная: в data/dashboard_checkpoint.json сохраняются
+позиции в логах (номер сегмента seq из манифеста ротации + смещение,
+обработанные архивные сегменты), агрегаты по ответам без полных текстов и
+хэши страниц-шардов. Тексты вопросов и ответов дописываются в
+data/dashboard_texts-<время>.jsonl (новый файл — при полной пересборке),
+в чекпоинте — только позиция строки. Следующий запуск дочитывает только
+новые строки логов и перезаписывает только изменившиеся шарды. Если лог усечён или заменён без записи в
+манифесте ротации — полная пересборка. Принудительно: build_dashboard.py --full
+Пока идёт ротация лога, запуск пропускается (cron повторит).
+
+Полная пересборка разбирает логи кусками (по границам строк) в пуле
+процессов и сводит частичные агрегаты через DashboardAggregate.merge.
+DASH_WORKERS — число процессов (0 — по числу CPU), DASH_CHUNK_MB — размер
+куска активного лога (архивные .gz-сегменты — по одному на процесс).
 """
 
+import gzip
+import hashlib
 import json
 import os
+import sys
 import time
-from collections import defaultdict
-from datetime import datetime
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from event_log import (iter_range_events, load_manifest, log_archive_dir, parallel_map, rotation_in_progress,
+                       split_line_ranges)
+from dashboard_data import ANSWER_MAX, QUESTION_MAX, DashboardAggregate, build_payloads
 DATA_DIR = os.path.join(BASE_DIR, "data")
 DASH_DIR = os.path.join(BASE_DIR, "dashboard")
 
 FEEDBACK_PATH = os.getenv("FEEDBACK_PATH", os.path.join(DATA_DIR, "feedback.jsonl"))
 DIALOGS_PATH = os.getenv("DIALOGS_PATH", os.path.join(DATA_DIR, "dialogs.jsonl"))
+CHECKPOINT_PATH = os.getenv("DASH_CHECKPOINT_PATH", os.path.join(DATA_DIR, "dashboard_checkpoint.json"))
+
+CHECKPOINT_VERSION = 5
+
+# Тредов на одну страницу-шард
+PAGE_SIZE = int(os.getenv("DASH_PAGE_SIZE", "200"))
+WRITE_COMMENTS_JSON = os.getenv("DASH_WRITE_COMMENTS_JSON", "0").strip() == "1"
+
+# Полная пересборка: процессов для разбора (0 — по числу CPU) и размер куска активного лога
+WORKERS = int(os.getenv("DASH_WORKERS", "0"))
+CHUNK_BYTES = int(float(os.getenv("DASH_CHUNK_MB", "32")) * 1024 * 1024)
+
+class FullRebuildNeeded(Exception):
+    pass
 
-def read_jsonl(path):
-    """Читает JSONL файл."""
-    if not os.path.exists(path):
-        return []
-    out = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
+def _iter_lines(path, skip=0):
+    """Строки файла (gzip или обычного) начиная с байта skip. Отдаёт (event, позиция после строки)."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        if skip:
+            f.seek(skip)
+        pos = skip
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                # строка ещё дописывается — заберём в следующий раз
+                break
+            pos += len(raw)
+            line = raw.strip()
             if not line:
                 continue
             try:
-                out.append(json.loads(line))
+                yield json.loads(line.decode("utf-8")), pos
             except Exception:
                 continue
-    return out
 
-def parse_ts(ts_str):
-    """Парсит timestamp (ISO или int)."""
-    if isinstance(ts_str, int):
-        return ts_str
-    if isinstance(ts_str, str):
-        try:
-            # ISO format: 2024-01-01T12:00:00Z
-            if "T" in ts_str:
-                dt = datetime.strptime(ts_str.replace("Z", ""), "%Y-%m-%dT%H:%M:%S")
-                return int(dt.timestamp())
-            return int(ts_str)
-        except Exception:
-            pass
-    return 0
-
-def ts_str(ts):
-    """Форматирует timestamp в строку."""
+def iter_new_events(path, log_ck):
+    """События лога, которых ещё нет в чекпоинте. log_ck обновляется на месте.
+
+    log_ck: {"seq": ..., "offset": ..., "segments": [обработанные сегменты]}.
+    Активный файл прошлого запуска после ротации — сегмент манифеста с тем же seq;
+    он должен быть первым необработанным и дочитывается с сохранённого смещения,
+    остальные сегменты — целиком. Неоднозначность, усечение или неизвестная
+    замена -> FullRebuildNeeded.
+    """
+    archive_dir = log_archive_dir(path)
+    manifest = load_manifest(archive_dir)
+    done = set(log_ck.get("segments") or [])
+    old_seq = log_ck.get("seq")
+    old_offset = log_ck.get("offset") or 0
+    
+    pending = [e for e in manifest["segments"] if e.get("file") and e["file"] not in done]
+    matches = [i for i, e in enumerate(pending) if old_seq is not None and e.get("seq") == old_seq]
+    if len(matches) > 1:
+        raise FullRebuildNeeded("%s: %d segments with seq %s" % (path, len(matches), old_seq))
+    if matches and matches[0] != 0:
+        raise FullRebuildNeeded("%s: unread segments before seq %s" % (path, old_seq))
+    rotated_old = bool(matches)
+    
+    for i, entry in enumerate(pending):
+        seg_path = os.path.join(archive_dir, entry["file"])
+        if not os.path.isfile(seg_path):
+            continue
+        skip = old_offset if rotated_old and i == 0 else 0
+        for event, _ in _iter_lines(seg_path, skip):
+            yield event
+        done.add(entry["file"])
+    
+    seq, offset = manifest["next_seq"], 0
+    if os.path.exists(path):
+        start = 0
+        if old_seq is not None and not rotated_old:
+            if seq != old_seq:
+                raise FullRebuildNeeded("%s replaced without rotation manifest" % path)
+            if os.path.getsize(path) < old_offset:
+                raise FullRebuildNeeded("%s truncated" % path)
+            start = old_offset
+        offset = start
+        for event, pos in _iter_lines(path, start):
+            offset = pos
+            yield event
+    elif old_seq is not None and not rotated_old:
+        raise FullRebuildNeeded("%s removed" % path)
+    
+    log_ck["seq"] = seq
+    log_ck["offset"] = offset
+    log_ck["segments"] = sorted(done)
+
+def load_checkpoint():
     try:
-        ts_val = parse_ts(ts)
-        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts_val))
+        with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+            ck = json.load(f)
+        if isinstance(ck, dict) and ck.get("version") == CHECKPOINT_VERSION:
+            return ck
     except Exception:
-        return str(ts)
+        pass
+    return None
+
+def save_checkpoint(ck):
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ck, f, ensure_ascii=False)
+    os.replace(tmp, CHECKPOINT_PATH)
 
 def escape_html(text):
     """Экранирует HTML."""
@@ -72,190 +164,258 @@ def escape_html(text):
             .replace('"', "&quot;")
             .replace("'", "&#x27;"))
 
-def main():
-    fb = read_jsonl(FEEDBACK_PATH)
-    dialogs = read_jsonl(DIALOGS_PATH)
-    
-    # Собираем Q&A из dialogs
-    qa = {}
-    user_name = {}
-    thread_to_user = {}
-    
-    for e in dialogs:
-        uid = e.get("user_id")
-        if uid:
-            if e.get("user_name"):
-                user_name[int(uid)] = e.get("user_name")
-            thread_id = e.get("thread_id")
-            if thread_id:
-                thread_to_user[thread_id] = int(uid)
-        
-        # Ответы бота
-        if e.get("role") == "bot":
-            meta = e.get("meta", {})
-            answer_id = meta.get("answer_id")
-            if answer_id:
-                qa[answer_id] = {
-                    "question": meta.get("question", ""),
-                    "answer": e.get("text", ""),
-                    "user_id": int(uid or 0),
-                    "user_name": e.get("user_name", ""),
-                    "thread_id": thread_id,
-                    "branch": meta.get("branch"),
-                    "ts": e.get("ts", 0),
-                }
-    
-    # Собираем оценки и комментарии
-    ratings = defaultdict(list)
-    comments = defaultdict(list)
-    admin_replies = defaultdict(list)
+def collect(full=False, ck=None):
+    """Агрегаты с учётом чекпоинта: дочитывает новые строки или пересобирает всё."""
+    if ck is None and not full:
+        ck = load_checkpoint()
+    if ck is not None and not full:
+        try:
+            agg = DashboardAggregate.from_dict(ck.get("aggregate") or {})
+            logs = ck.get("logs") or {}
+            logs.setdefault("dialogs", {})
+            logs.setdefault("feedback", {})
+            for e in iter_new_events(DIALOGS_PATH, logs["dialogs"]):
+                agg.add_dialog(e)
+            for e in iter_new_events(FEEDBACK_PATH, logs["feedback"]):
+                agg.add_feedback(e)
+            return agg, logs, "incremental"
+        except FullRebuildNeeded as e:
+            print("Full rebuild: %s" % e)
     
-    for e in fb:
-        aid = e.get("answer_id")
-        if not aid:
-            # Может быть привязан к thread_id
-            thread_id = e.get("thread_id")
-            if thread_id:
-                # Ищем answer_id по thread_id
-                for a_id, qa_data in qa.items():
-                    if qa_data.get("thread_id") == thread_id:
-                        aid = a_id
-                        break
-        
-        if not aid:
+    # Полная пересборка: map по кускам логов в пуле процессов, reduce через merge.
+    # feedback разбирается после dialogs — кускам нужны первые ответы тредов.
+    agg = DashboardAggregate()
+    logs = {"dialogs": {}, "feedback": {}}
+    for part in parallel_map(_map_dialogs, log_tasks(DIALOGS_PATH, logs["dialogs"]), WORKERS):
+        agg.merge(part)
+    first_answers = {t: aids[0] for t, aids in agg.thread_answers.items() if aids}
+    for part in parallel_map(_map_feedback, log_tasks(FEEDBACK_PATH, logs["feedback"]), WORKERS,
+                             initializer=_set_known_answers, initargs=(first_answers,)):
+        agg.merge(part)
+    return agg, logs, "full"
+
+def log_tasks(path, log_ck):
+    """Куски лога для полной пересборки: архивные сегменты целиком и диапазоны активного файла.
+
+    log_ck заполняется так же, как после iter_new_events по всему логу.
+    """
+    archive_dir = log_archive_dir(path)
+    manifest = load_manifest(archive_dir)
+    tasks = []
+    segments = []
+    for entry in manifest["segments"]:
+        name = entry.get("file")
+        seg_path = os.path.join(archive_dir, name or "")
+        if not name or not os.path.isfile(seg_path):
             continue
-        
-        rating = e.get("rating")
-        if rating is not None:
-            ratings[aid].append(int(rating))
-        
-        comment = e.get("comment") or e.get("text")
-        if comment and comment.strip():
-            comments[aid].append({
-                "text": comment,
-                "ts": parse_ts(e.get("ts", 0)),
-                "ts_str": ts_str(e.get("ts", 0)),
-                "user_id": e.get("user_id"),
-            })
+        tasks.append((seg_path, 0, None))
+        segments.append(name)
+    offset = 0
+    if os.path.exists(path):
+        ranges = split_line_ranges(path, CHUNK_BYTES)
+        tasks.extend((path, start, end) for start, end in ranges)
+        if ranges:
+            offset = ranges[-1][1]
+    log_ck["seq"] = manifest["next_seq"]
+    log_ck["offset"] = offset
+    log_ck["segments"] = sorted(segments)
+    return tasks
+
+_known_answers = None
+
+def _set_known_answers(first_answers):
+    global _known_answers
+    _known_answers = first_answers
+
+def _map_dialogs(path, start, end):
+    agg = DashboardAggregate()
+    for e in iter_range_events(path, start, end):
+        agg.add_dialog(e)
+    return agg
+
+def _map_feedback(path, start, end):
+    agg = DashboardAggregate()
+    agg.known_answers = _known_answers
+    for e in iter_range_events(path, start, end):
+        agg.add_feedback(e)
+    agg.known_answers = None
+    return agg
+
+def texts_path(name):
+    """Файл текстов лежит рядом с чекпоинтом."""
+    return os.path.join(os.path.dirname(CHECKPOINT_PATH), name)
+
+def store_texts(agg, path, fresh=False):
+    """Дописывает тексты ответов, прочитанных из логов в этом запуске, и ставит им text_at.
+
+    У ответов из чекпоинта текста в памяти нет — их строки уже в файле.
+    fresh — начать файл заново (полная пересборка).
+    """
+    with open(path, "wb" if fresh else "ab") as f:
+        pos = f.seek(0, os.SEEK_END)
+        for aid, base in agg.qa.items():
+            if "answer" not in base:
+                continue
+            line = (json.dumps({"id": aid,
+                                "q": (base.get("question") or "")[:QUESTION_MAX],
+                                "a": (base.get("answer") or "")[:ANSWER_MAX]},
+                               ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            base["text_at"] = pos
+            pos += len(line)
+
+def load_texts(path, positions):
+    """{позиция: (вопрос, ответ)} — читает только нужные строки файла текстов."""
+    texts = {}
+    if not positions:
+        return texts
+    with open(path, "rb") as f:
+        for pos in sorted(positions):
+            f.seek(pos)
+            item = json.loads(f.readline().decode("utf-8"))
+            texts[pos] = (item.get("q") or "", item.get("a") or "")
+    return texts
+
+def _page_hash(page, qa):
+    """Хэш страницы без текстов: тексты в файле не меняются, их заменяет text_at."""
+    items = []
+    for t in page:
+        item = dict(t, question=None, answer=None)
+        item["text_at"] = qa[t["answer_id"]].get("text_at")
+        items.append(item)
+    raw = json.dumps(items, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _write_json(path, obj, indent=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if indent:
+            json.dump(obj, f, ensure_ascii=False, indent=indent)
+        else:
+            json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def write_dashboard_data(stats, threads, rollups, qa, texts_file, old_hashes=None):
+    """Пишет dashboard/data/: только шарды, чей хэш изменился, затем индексы и summary.
+
+    Тексты подставляются только в перезаписываемые шарды. Шарды, которых больше
+    нет, удаляются после summary.json. Возвращает (число шардов, {файл: хэш}).
+    """
+    data_dir = os.path.join(DASH_DIR, "data")
+    old_hashes = old_hashes or {}
+    payloads = build_payloads(stats, threads, rollups, PAGE_SIZE)
+    shard_files = [sh["file"] for sh in payloads["summary.json"]["shards"]]
     
-    # Собираем ответы админов из dialogs
-    for e in dialogs:
-        if e.get("role") == "admin":
-            thread_id = e.get("thread_id")
-            if thread_id:
-                # Находим answer_id по thread_id
-                for a_id, qa_data in qa.items():
-                    if qa_data.get("thread_id") == thread_id:
-                        admin_replies[a_id].append({
-                            "text": e.get("text", ""),
-                            "ts": e.get("ts", 0),
-                            "ts_str": ts_str(e.get("ts", 0)),
-                        })
-                        break
+    hashes = {}
+    changed = []
+    for name in shard_files:
+        hashes[name] = _page_hash(payloads[name]["threads"], qa)
+        if hashes[name] != old_hashes.get(name) or not os.path.exists(os.path.join(data_dir, name)):
+            changed.append(name)
     
-    # Формируем треды
-    threads = []
-    total_ratings = 0
-    paid_6 = 0
-    sum_1_5 = 0
-    cnt_1_5 = 0
-    answers_with_rating = 0
-    branch_stats = defaultdict(int)
+    positions = set()
+    for name in changed:
+        for t in payloads[name]["threads"]:
+            base = qa[t["answer_id"]]
+            if "answer" not in base:
+                positions.add(base["text_at"])
+    texts = load_texts(texts_file, positions)
+    for name in changed:
+        page = []
+        for t in payloads[name]["threads"]:
+            base = qa[t["answer_id"]]
+            if "answer" not in base:
+                question, answer = texts[base["text_at"]]
+                t = dict(t, question=question, answer=answer)
+            page.append(t)
+        _write_json(os.path.join(data_dir, name), {"threads": page})
     
-    for aid, base in qa.items():
-        r = ratings.get(aid, [])
-        c = comments.get(aid, [])
-        a = admin_replies.get(aid, [])
-        
-        if r:
-            answers_with_rating += 1
-        
-        total_ratings += len(r)
-        paid_6 += sum(1 for x in r if x == 6)
-        r15 = [x for x in r if 1 <= x <= 5]
-        if r15:
-            sum_1_5 += sum(r15)
-            cnt_1_5 += len(r15)
-        avg_1_5 = (sum(r15) / len(r15)) if r15 else 0.0
-        
-        branch = base.get("branch") or "unknown"
-        branch_stats[branch] += 1
-        
-        uid = int(base.get("user_id") or 0)
-        uname = base.get("user_name") or user_name.get(uid, "")
-        
-        # Статус: новый/в работе/закрыт
-        status = "новый"
-        if a:
-            status = "закрыт"
-        elif c:
-            status = "в работе"
-        
-        threads.append({
-            "answer_id": aid,
-            "thread_id": base.get("thread_id", ""),
-            "user_id": uid,
-            "user_name": uname,
-            "question": (base.get("question") or "")[:2000],
-            "answer": (base.get("answer") or "")[:4000],
-            "ratings": {
-                "count": len(r),
-                "avg_1_5": round(avg_1_5, 2),
-                "paid_6": sum(1 for x in r if x == 6),
-                "all": r,
-            },
-            "comments": c[-50:],
-            "admin_replies": a[-50:],
-            "branch": branch,
-            "ts": base.get("ts", 0),
-            "ts_str": ts_str(base.get("ts", 0)),
-            "status": status,
-        })
+    for name in ("index.json", "filters.json", "rollups.json"):
+        _write_json(os.path.join(data_dir, name), payloads[name])
+    _write_json(os.path.join(data_dir, "summary.json"), payloads["summary.json"], indent=2)
     
-    # Сортируем треды (новые комментарии первыми)
-    threads.sort(key=lambda x: (
-        x["comments"][-1]["ts"] if x["comments"] else 0,
-        x["ratings"]["count"]
-    ), reverse=True)
+    keep = set(shard_files)
+    threads_dir = os.path.join(data_dir, "threads")
+    for root, _, files in os.walk(threads_dir, topdown=False):
+        for fname in files:
+            path = os.path.join(root, fname)
+            if os.path.relpath(path, data_dir).replace(os.sep, "/") not in keep:
+                os.remove(path)
+        if root != threads_dir and not os.listdir(root):
+            os.rmdir(root)
+    print("Shards rewritten: %d of %d" % (len(changed), len(shard_files)))
+    return len(shard_files), hashes
+
+def wait_for_rotation(paths, timeout=10.0):
+    """True, когда ни один лог не ротируется; номера сегментов во время ротации неоднозначны."""
+    deadline = time.time() + timeout
+    while any(rotation_in_progress(p) for p in paths):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.5)
+    return True
+
+def main(full=False):
+    if not wait_for_rotation((DIALOGS_PATH, FEEDBACK_PATH)):
+        print("Log rotation in progress, skipping this run")
+        return
+    # чекпоинт читаем и при --full: старый файл текстов удаляется после сохранения нового
+    ck = load_checkpoint()
+    agg, logs, mode = collect(full=(full or ck is None), ck=ck)
     
-    # Статистика
-    stats = {
-        "generated_ts": int(time.time()),
-        "generated_ts_str": ts_str(int(time.time())),
-        "answers_with_rating": answers_with_rating,
-        "total_ratings": total_ratings,
-        "avg_rating_1_5": round((sum_1_5 / cnt_1_5) if cnt_1_5 else 0.0, 2),
-        "paid_star_6": paid_6,
-        "threads": len(threads),
-        "branch_stats": dict(branch_stats),
-    }
+    # Тексты новых ответов — в файл рядом с чекпоинтом; полная пересборка начинает новый
+    old_texts = (ck or {}).get("texts")
+    if mode == "full" or not old_texts:
+        texts = "dashboard_texts-%d.jsonl" % int(time.time() * 1000)
+        old_hashes = {}
+    else:
+        texts = old_texts
+        old_hashes = ck.get("shards") or {}
+    store_texts(agg, texts_path(texts), fresh=(texts != old_texts))
+    stats, threads = agg.build()
     
     # Сохраняем JSON
     os.makedirs(DASH_DIR, exist_ok=True)
     with open(os.path.join(DASH_DIR, "stats.json"), "w", encoding="utf-8") as f:
         json.dump(stats, f, ensure_ascii=False, indent=2)
-    with open(os.path.join(DASH_DIR, "comments.json"), "w", encoding="utf-8") as f:
-        json.dump({
-            "generated_ts": int(time.time()),
-            "threads": threads
-        }, f, ensure_ascii=False, indent=2)
+    n_shards, hashes = write_dashboard_data(stats, threads, agg.rollups, agg.qa, texts_path(texts), old_hashes)
+    if WRITE_COMMENTS_JSON:
+        missing = {agg.qa[t["answer_id"]]["text_at"] for t in threads if "answer" not in agg.qa[t["answer_id"]]}
+        full_texts = load_texts(texts_path(texts), missing)
+        for t in threads:
+            base = agg.qa[t["answer_id"]]
+            if "answer" not in base:
+                t["question"], t["answer"] = full_texts[base["text_at"]]
+        with open(os.path.join(DASH_DIR, "comments.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "generated_ts": int(time.time()),
+                "threads": threads
+            }, f, ensure_ascii=False, indent=2)
     
     # Генерируем HTML
-    html_content = generate_html(stats, threads)
+    html_content = generate_html()
     with open(os.path.join(DASH_DIR, "index.html"), "w", encoding="utf-8") as f:
         f.write(html_content)
     
-    print("Dashboard generated: %s/index.html" % DASH_DIR)
-    print("Stats: %d threads, %d ratings, avg %.2f" % (
-        len(threads), total_ratings, stats["avg_rating_1_5"]
+    save_checkpoint({
+        "version": CHECKPOINT_VERSION,
+        "saved_ts": int(time.time()),
+        "logs": logs,
+        "aggregate": agg.to_dict(),
+        "texts": texts,
+        "shards": hashes,
+    })
+    if old_texts and old_texts != texts and os.path.exists(texts_path(old_texts)):
+        os.remove(texts_path(old_texts))
+    
+    print("Dashboard generated (%s): %s/index.html" % (mode, DASH_DIR))
+    print("Stats: %d threads, %d ratings, avg %.2f, %d shards" % (
+        len(threads), stats["total_ratings"], stats["avg_rating_1_5"], n_shards
     ))
 
-def generate_html(stats, threads):
-    """Генерирует статический HTML дашборд."""
-    
-    # Подготавливаем данные для JS
-    threads_json = json.dumps(threads, ensure_ascii=False)
-    stats_json = json.dumps(stats, ensure_ascii=False)
+def generate_html():
+    """Генерирует HTML дашборда. Данные страница берёт из dashboard/data/."""
     
     html = """<!DOCTYPE html>
 <html lang="ru">
@@ -322,7 +482,25 @@ def generate_html(stats, threads):
         .status-closed { color: #27ae60; font-weight: bold; }
         .rating { display: inline-block; margin-right: 5px; }
         .comment-preview { max-width: 300px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-        .thread-details { display: none; margin-top: 10px; padding: 10px; background: #f9f9f9; border-radius: 4px; }
+        .table-viewport {
+            height: 70vh;
+            overflow-y: auto;
+            background: white;
+            border-radius: 8px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        .table-viewport table { table-layout: fixed; box-shadow: none; border-radius: 0; }
+        .table-viewport thead th { position: sticky; top: 0; background: #2c3e50; z-index: 1; }
+        #threads-table tr.row td { height: 44px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+        #threads-table tr.row.selected { background: #eef5fb; }
+        #threads-table tr.spacer td { padding: 0; border: 0; }
+        .table-info { margin: 10px 0; color: #666; }
+        .live-feed { display: none; background: white; padding: 15px 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); margin-bottom: 20px; max-height: 180px; overflow-y: auto; }
+        .live-feed.show { display: block; }
+        .live-feed h3 { font-size: 14px; color: #666; margin-bottom: 8px; }
+        .live-feed p { margin: 3px 0; font-size: 14px; }
+        .reply-form textarea { width: 100%; min-height: 80px; margin: 10px 0; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
+        .thread-details { display: none; margin-top: 20px; padding: 20px; background: white; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
         .thread-details.show { display: block; }
         .thread-details h4 { margin-bottom: 10px; }
         .thread-details p { margin: 5px 0; }
@@ -349,6 +527,10 @@ def generate_html(stats, threads):
                 <h3>Тредов</h3>
                 <div class="value" id="stat-threads">-</div>
             </div>
+            <div class="stat-card">
+                <h3>RAG / GigaChat</h3>
+                <div class="value" id="stat-rag">-</div>
+            </div>
         </div>
         
         <div class="filters">
@@ -376,6 +558,10 @@ def generate_html(stats, threads):
                     <option value="6">⭐6 PRO</option>
                 </select>
             </label>
+            <label>
+                Поиск:
+                <input type="search" id="filter-search" placeholder="вопрос, комментарий, user">
+            </label>
             <label>
                 <input type="checkbox" id="filter-comments-only"> Только с комментариями
             </label>
@@ -393,45 +579,95 @@ def generate_html(stats, threads):
             </label>
         </div>
         
-        <table>
-            <thead>
-                <tr>
-                    <th>Дата</th>
-                    <th>User ID</th>
-                    <th>Ветка</th>
-                    <th>Рейтинг</th>
-                    <th>Комментарий</th>
-                    <th>Статус</th>
-                    <th>Действия</th>
-                </tr>
-            </thead>
-            <tbody id="threads-table">
-            </tbody>
-        </table>
+        <div class="live-feed" id="live-feed">
+            <h3>🟢 Live: новые события</h3>
+            <div id="live-items"></div>
+        </div>
+        
+        <div class="table-info" id="table-info">Загрузка…</div>
+        <div class="table-viewport" id="table-viewport">
+            <table>
+                <thead>
+                    <tr>
+                        <th style="width: 150px">Дата</th>
+                        <th style="width: 110px">User ID</th>
+                        <th style="width: 140px">Ветка</th>
+                        <th style="width: 130px">Рейтинг</th>
+                        <th>Комментарий</th>
+                        <th style="width: 100px">Статус</th>
+                        <th style="width: 120px">Действия</th>
+                    </tr>
+                </thead>
+                <tbody id="threads-table">
+                </tbody>
+            </table>
+        </div>
+        <div class="thread-details" id="thread-details"></div>
     </div>
     
     <script>
-        const stats = """ + stats_json + """;
-        const threads = """ + threads_json + """;
+        const ROW_HEIGHT = 44;   // совпадает с высотой tr.row в CSS
+        const OVERSCAN = 10;     // запас строк над и под видимой областью
         
-        // Обновляем статистику
-        document.getElementById('stat-total').textContent = stats.threads;
-        document.getElementById('stat-avg').textContent = stats.avg_rating_1_5.toFixed(2);
-        document.getElementById('stat-paid').textContent = stats.paid_star_6;
-        document.getElementById('stat-threads').textContent = stats.threads;
+        // Токен живого дашборда (live_dashboard.py) передаётся в адресе: index.html?token=...
+        const TOKEN = new URLSearchParams(location.search).get('token') || '';
         
-        // Заполняем фильтр веток
-        const branches = [...new Set(threads.map(t => t.branch).filter(Boolean))];
-        const branchSelect = document.getElementById('filter-branch');
-        branches.forEach(b => {
-            const opt = document.createElement('option');
-            opt.value = b;
-            opt.textContent = b;
-            branchSelect.appendChild(opt);
-        });
+        let summary = null;
+        let rows = [];
+        let fidx = null;         // filters.json
+        let rollups = null;      // rollups.json: суточные счётчики по веткам
+        let visible = [];        // позиции строк rows после фильтров
+        let selectedId = null;
+        let searchText = null;   // строки для поиска, собираются при первом поиске
+        const shardCache = {};
+        const markCache = new Map();
+        
+        async function fetchJson(path) {
+            const v = summary ? summary.generated_ts : Date.now();
+            const auth = TOKEN ? '&token=' + encodeURIComponent(TOKEN) : '';
+            const r = await fetch(path + '?v=' + v + auth, {cache: 'no-store'});
+            if (!r.ok) throw new Error('HTTP ' + r.status + ' for ' + path);
+            return await r.json();
+        }
+        
+        // Страница-шард с полными тредами грузится один раз, при первом открытии деталей
+        function loadShard(idx) {
+            if (!shardCache[idx]) {
+                shardCache[idx] = fetchJson('data/' + summary.shards[idx].file).then(d => {
+                    const byId = {};
+                    (d.threads || []).forEach(t => { byId[t.answer_id] = t; });
+                    return byId;
+                });
+            }
+            return shardCache[idx];
+        }
         
-        // Функция фильтрации
-        function filterThreads() {
+        // Битовая маска списка позиций (кэшируется: списки из filters.json не меняются)
+        function markOf(list) {
+            let m = markCache.get(list);
+            if (!m) {
+                m = new Uint8Array(fidx.n);
+                for (let i = 0; i < list.length; i++) m[list[i]] = 1;
+                markCache.set(list, m);
+            }
+            return m;
+        }
+        
+        // Объединение списков дней из диапазона [from, to]
+        function daysList(from, to) {
+            const m = new Uint8Array(fidx.n);
+            Object.keys(fidx.day).forEach(d => {
+                if ((from && d < from) || (to && d > to)) return;
+                const list = fidx.day[d];
+                for (let i = 0; i < list.length; i++) m[list[i]] = 1;
+            });
+            const out = [];
+            for (let i = 0; i < m.length; i++) if (m[i]) out.push(i);
+            return out;
+        }
+        
+        // Функция фильтрации: пересечение готовых списков, начиная с самого короткого
+        function filterThreads(keepScroll) {
             const dateFrom = document.getElementById('filter-date-from').value;
             const dateTo = document.getElementById('filter-date-to').value;
             const branch = document.getElementById('filter-branch').value;
@@ -439,90 +675,146 @@ def generate_html(stats, threads):
             const commentsOnly = document.getElementById('filter-comments-only').checked;
             const paidOnly = document.getElementById('filter-paid-only').checked;
             const status = document.getElementById('filter-status').value;
+            const search = document.getElementById('filter-search').value.trim().toLowerCase();
+            
+            const lists = [];
+            if (branch) lists.push(fidx.branch[branch] || []);
+            if (status) lists.push(fidx.status[status] || []);
+            if (rating) lists.push(fidx.rating[rating] || []);
+            if (commentsOnly) lists.push(fidx.has_comment);
+            if (paidOnly) lists.push(fidx.paid_6);
+            if (dateFrom || dateTo) lists.push(daysList(dateFrom, dateTo));
             
-            let filtered = threads.filter(t => {
-                if (branch && t.branch !== branch) return false;
-                if (status && t.status !== status) return false;
-                if (commentsOnly && (!t.comments || t.comments.length === 0)) return false;
-                if (paidOnly && t.ratings.paid_6 === 0) return false;
-                if (rating) {
-                    const hasRating = t.ratings.all && t.ratings.all.includes(parseInt(rating));
-                    if (!hasRating) return false;
+            let result;
+            if (lists.length === 0) {
+                result = new Array(fidx.n);
+                for (let i = 0; i < fidx.n; i++) result[i] = i;
+            } else {
+                lists.sort((a, b) => a.length - b.length);
+                result = lists[0].slice();
+                for (let k = 1; k < lists.length && result.length; k++) {
+                    const m = markOf(lists[k]);
+                    result = result.filter(i => m[i]);
                 }
-                if (dateFrom || dateTo) {
-                    const ts = t.ts || 0;
-                    const date = new Date(ts * 1000);
-                    if (dateFrom) {
-                        const from = new Date(dateFrom);
-                        if (date < from) return false;
-                    }
-                    if (dateTo) {
-                        const to = new Date(dateTo);
-                        to.setHours(23, 59, 59);
-                        if (date > to) return false;
-                    }
+            }
+            
+            if (search) {
+                if (!searchText) {
+                    searchText = rows.map(t =>
+                        ((t.q || '') + ' ' + (t.cp || '') + ' ' + (t.n || '') + ' ' + t.u + ' ' + t.id).toLowerCase());
                 }
-                return true;
+                result = result.filter(i => searchText[i].includes(search));
+            }
+            
+            visible = result;
+            document.getElementById('table-info').textContent =
+                'Показано тредов: ' + visible.length + ' из ' + rows.length;
+            updateStats(dateFrom, dateTo, branch);
+            if (keepScroll !== true) document.getElementById('table-viewport').scrollTop = 0;
+            renderWindow();
+        }
+        
+        function pct(part, whole) {
+            return whole ? Math.round(100 * part / whole) + '%' : '—';
+        }
+        
+        // Карточки за период и ветку — сумма суточных rollups (дни в UTC)
+        function updateStats(dateFrom, dateTo, branch) {
+            const f = {};
+            rollups.fields.forEach((name, i) => { f[name] = i + 2; });
+            const sum = {};
+            rollups.fields.forEach(name => { sum[name] = 0; });
+            rollups.rows.forEach(r => {
+                const day = new Date(r[0] * 1000).toISOString().substring(0, 10);
+                if ((dateFrom && day < dateFrom) || (dateTo && day > dateTo)) return;
+                if (branch && r[1] !== branch) return;
+                rollups.fields.forEach(name => { sum[name] += r[f[name]]; });
             });
+            let n15 = 0, s15 = 0;
+            for (let i = 1; i <= 5; i++) { n15 += sum['r' + i]; s15 += i * sum['r' + i]; }
             
-            renderTable(filtered);
+            document.getElementById('stat-total').textContent = sum.answers;
+            document.getElementById('stat-avg').textContent = (n15 ? s15 / n15 : 0).toFixed(2);
+            document.getElementById('stat-paid').textContent = sum.r6;
+            document.getElementById('stat-threads').textContent = visible.length;
+            document.getElementById('stat-rag').textContent =
+                pct(sum.rag_used, sum.answers) + ' / ' + pct(sum.gigachat_used, sum.answers);
+        }
+        
+        function rowHtml(t) {
+            const ratingText = t.r && t.r.length > 0 ? t.r.map(r => '⭐' + r).join(' ') : '—';
+            const commentPreview = t.cc ? t.cp.substring(0, 50) + '...' : '—';
+            const statusClass = 'status-' + (t.s === 'новый' ? 'new' : t.s === 'в работе' ? 'work' : 'closed');
+            const cls = 'row' + (t.id === selectedId ? ' selected' : '');
+            return `<tr class="${cls}">
+                <td>${escapeHtml(t.ts_str || '')}</td>
+                <td>${t.u}</td>
+                <td>${escapeHtml(t.b || '—')}</td>
+                <td>${ratingText}</td>
+                <td class="comment-preview" title="${escapeHtml(commentPreview)}">${escapeHtml(commentPreview)}</td>
+                <td><span class="${statusClass}">${escapeHtml(t.s)}</span></td>
+                <td><button onclick="showDetails('${t.id}', ${t.sh})">Подробнее</button></td>
+            </tr>`;
         }
         
-        // Рендеринг таблицы
-        function renderTable(threadsToShow) {
-            const tbody = document.getElementById('threads-table');
-            tbody.innerHTML = '';
+        // Виртуальная таблица: в DOM только видимые строки плюс OVERSCAN,
+        // высоту остальных держат две строки-распорки
+        function renderWindow() {
+            const vp = document.getElementById('table-viewport');
+            const first = Math.max(0, Math.floor(vp.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const count = Math.ceil(vp.clientHeight / ROW_HEIGHT) + 2 * OVERSCAN;
+            const last = Math.min(visible.length, first + count);
             
-            threadsToShow.forEach(t => {
-                const tr = document.createElement('tr');
-                const ratingText = t.ratings.all && t.ratings.all.length > 0
-                    ? t.ratings.all.map(r => '⭐' + r).join(' ')
-                    : '—';
-                const commentPreview = t.comments && t.comments.length > 0
-                    ? t.comments[t.comments.length - 1].text.substring(0, 50) + '...'
-                    : '—';
-                const statusClass = 'status-' + (t.status === 'новый' ? 'new' : t.status === 'в работе' ? 'work' : 'closed');
-                
-                tr.innerHTML = `
-                    <td>${escapeHtml(t.ts_str || '')}</td>
-                    <td>${t.user_id}</td>
-                    <td>${escapeHtml(t.branch || '—')}</td>
-                    <td>${ratingText}</td>
-                    <td class="comment-preview" title="${escapeHtml(commentPreview)}">${escapeHtml(commentPreview)}</td>
-                    <td><span class="${statusClass}">${escapeHtml(t.status)}</span></td>
-                    <td><button onclick="toggleDetails('${t.answer_id}')">Подробнее</button></td>
-                `;
-                tbody.appendChild(tr);
-                
-                // Детали треда
-                const detailsTr = document.createElement('tr');
-                detailsTr.id = 'details-' + t.answer_id;
-                detailsTr.className = 'thread-details';
-                detailsTr.innerHTML = `
-                    <td colspan="7">
-                        <div>
-                            <h4>Вопрос:</h4>
-                            <p>${escapeHtml(t.question || '—')}</p>
-                            <h4>Ответ:</h4>
-                            <p>${escapeHtml(t.answer || '—')}</p>
-                            <h4>Комментарии:</h4>
-                            ${t.comments && t.comments.length > 0
-                                ? t.comments.map(c => `<p><strong>${escapeHtml(c.ts_str)}:</strong> ${escapeHtml(c.text)}</p>`).join('')
-                                : '<p>Нет комментариев</p>'}
-                            <h4>Ответы админа:</h4>
-                            ${t.admin_replies && t.admin_replies.length > 0
-                                ? t.admin_replies.map(a => `<p><strong>${escapeHtml(a.ts_str)}:</strong> ${escapeHtml(a.text)}</p>`).join('')
-                                : '<p>Нет ответов</p>'}
-                        </div>
-                    </td>
-                `;
-                tbody.appendChild(detailsTr);
-            });
+            let html = `<tr class="spacer"><td colspan="7" style="height: ${first * ROW_HEIGHT}px"></td></tr>`;
+            for (let k = first; k < last; k++) html += rowHtml(rows[visible[k]]);
+            html += `<tr class="spacer"><td colspan="7" style="height: ${(visible.length - last) * ROW_HEIGHT}px"></td></tr>`;
+            document.getElementById('threads-table').innerHTML = html;
+        }
+        
+        function renderDetails(t) {
+            return `
+                <h4>Вопрос:</h4>
+                <p>${escapeHtml(t.question || '—')}</p>
+                <h4>Ответ:</h4>
+                <p>${escapeHtml(t.answer || '—')}</p>
+                <h4>Комментарии:</h4>
+                ${t.comments && t.comments.length > 0
+                    ? t.comments.map(c => `<p><strong>${escapeHtml(c.ts_str)}:</strong> ${escapeHtml(c.text)}</p>`).join('')
+                    : '<p>Нет комментариев</p>'}
+                <h4>Ответы админа:</h4>
+                ${t.admin_replies && t.admin_replies.length > 0
+                    ? t.admin_replies.map(a => `<p><strong>${escapeHtml(a.ts_str)}:</strong> ${escapeHtml(a.text)}</p>`).join('')
+                    : '<p>Нет ответов</p>'}
+                ${summary.live && t.answer_id ? `
+                <div class="reply-form">
+                    <textarea id="reply-text" placeholder="Ответ пользователю"></textarea>
+                    <button onclick="sendReply('${t.answer_id}')">Ответить</button>
+                    <span id="reply-status"></span>
+                </div>` : ''}
+            `;
         }
         
-        function toggleDetails(answerId) {
-            const details = document.getElementById('details-' + answerId);
-            details.classList.toggle('show');
+        // Детали одного треда рендерятся только по клику, в отдельной панели под таблицей
+        async function showDetails(answerId, shardIdx) {
+            const panel = document.getElementById('thread-details');
+            if (selectedId === answerId && panel.classList.contains('show')) {
+                selectedId = null;
+                panel.classList.remove('show');
+                renderWindow();
+                return;
+            }
+            selectedId = answerId;
+            renderWindow();
+            panel.classList.add('show');
+            panel.innerHTML = 'Загрузка…';
+            try {
+                const byId = await loadShard(shardIdx);
+                if (selectedId !== answerId) return;
+                panel.innerHTML = renderDetails(byId[answerId] || {});
+            } catch (e) {
+                panel.innerHTML = 'Ошибка загрузки: ' + escapeHtml(String(e));
+            }
+            panel.scrollIntoView({behavior: 'smooth', block: 'nearest'});
         }
         
         function escapeHtml(text) {
@@ -532,17 +824,128 @@ def generate_html(stats, threads):
             return div.innerHTML;
         }
         
+        async function loadData() {
+            summary = await fetchJson('data/summary.json');
+            const [index, filters, daily] = await Promise.all([
+                fetchJson('data/index.json'),
+                fetchJson('data/filters.json'),
+                fetchJson('data/rollups.json'),
+            ]);
+            rows = index.rows || [];
+            fidx = filters;
+            rollups = daily;
+            searchText = null;
+            markCache.clear();
+            Object.keys(shardCache).forEach(k => { delete shardCache[k]; });
+            
+            // Заполняем фильтр веток
+            const branchSelect = document.getElementById('filter-branch');
+            const known = new Set(Array.from(branchSelect.options || []).map(o => o.value));
+            Object.keys(fidx.branch).sort().forEach(b => {
+                if (known.has(b)) return;
+                const opt = document.createElement('option');
+                opt.value = b;
+                opt.textContent = b;
+                branchSelect.appendChild(opt);
+            });
+        }
+        
+        async function init() {
+            await loadData();
+            filterThreads();
+            if (summary.live) startLive();
+        }
+        
+        // Живой режим: события по SSE, данные перечитываются не чаще раза в несколько секунд
+        let reloadTimer = null;
+        const replyStatus = {};
+        
+        function scheduleReload() {
+            if (reloadTimer) return;
+            reloadTimer = setTimeout(async () => {
+                reloadTimer = null;
+                try {
+                    await loadData();
+                    filterThreads(true);
+                } catch (e) {
+                    console.warn('live reload failed', e);
+                }
+            }, 3000);
+        }
+        
+        function addLiveItem(m) {
+            const feed = document.getElementById('live-items');
+            const p = document.createElement('p');
+            const when = new Date().toLocaleTimeString();
+            if (m.type === 'feedback') {
+                p.textContent = when + ' — user ' + m.user_id + (m.branch ? ' [' + m.branch + ']' : '') +
+                    (m.rating ? ' ⭐' + m.rating : '') + (m.comment ? ': ' + m.comment : '');
+            } else if (m.type === 'admin_reply') {
+                p.textContent = when + ' — ответ админа user ' + m.user_id + ': ' + m.text;
+            } else {
+                return;
+            }
+            feed.insertBefore(p, feed.firstChild);
+            while (feed.children.length > 50) feed.removeChild(feed.lastChild);
+        }
+        
+        function startLive() {
+            document.getElementById('live-feed').classList.add('show');
+            const es = new EventSource('api/events' + (TOKEN ? '?token=' + encodeURIComponent(TOKEN) : ''));
+            es.onmessage = ev => {
+                const m = JSON.parse(ev.data);
+                if (m.type === 'reply_result') {
+                    replyStatus[m.request_id] = m;
+                    const el = document.getElementById('reply-status');
+                    if (el && el.dataset.requestId === m.request_id) el.textContent = m.result;
+                    return;
+                }
+                addLiveItem(m);
+                scheduleReload();
+            };
+        }
+        
+        async function sendReply(answerId) {
+            const text = document.getElementById('reply-text').value.trim();
+            const status = document.getElementById('reply-status');
+            if (!text) return;
+            status.textContent = '⏳ Отправка…';
+            try {
+                const body = new URLSearchParams({target: answerId, text: text, token: TOKEN});
+                const r = await fetch('api/reply', {method: 'POST', body: body});
+                const res = await r.json();
+                if (!res.ok) {
+                    status.textContent = '❌ ' + res.error;
+                    return;
+                }
+                status.dataset.requestId = res.request_id;
+                const done = replyStatus[res.request_id];
+                status.textContent = done ? done.result : '⏳ В очереди бота…';
+                if (!done || done.ok) document.getElementById('reply-text').value = '';
+            } catch (e) {
+                status.textContent = '❌ ' + String(e);
+            }
+        }
+        
         // Привязываем фильтры
-        document.getElementById('filter-date-from').addEventListener('change', filterThreads);
-        document.getElementById('filter-date-to').addEventListener('change', filterThreads);
-        document.getElementById('filter-branch').addEventListener('change', filterThreads);
-        document.getElementById('filter-rating').addEventListener('change', filterThreads);
-        document.getElementById('filter-comments-only').addEventListener('change', filterThreads);
-        document.getElementById('filter-paid-only').addEventListener('change', filterThreads);
-        document.getElementById('filter-status').addEventListener('change', filterThreads);
+        ['filter-date-from', 'filter-date-to', 'filter-branch', 'filter-rating',
+         'filter-comments-only', 'filter-paid-only', 'filter-status'].forEach(id => {
+            document.getElementById(id).addEventListener('change', filterThreads);
+        });
+        document.getElementById('filter-search').addEventListener('input', filterThreads);
+        
+        let scrollPending = false;
+        document.getElementById('table-viewport').addEventListener('scroll', () => {
+            if (scrollPending) return;
+            scrollPending = true;
+            requestAnimationFrame(() => { scrollPending = false; renderWindow(); });
+        });
+        window.addEventListener('resize', renderWindow);
         
         // Первоначальная загрузка
-        filterThreads();
+        init().catch(e => {
+            document.getElementById('table-info').textContent = 'Не удалось загрузить данные: ' + String(e);
+        });
     </script>
 </body>
 </html>"""
@@ -550,4 +953,4 @@ def generate_html(stats, threads):
     return html
 
 if __name__ == "__main__":
-    main()
+    main(full="--full" in sys.argv[1:])
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Собирает частые вопросы из dialogs.jsonl (с архивом) в data/faq_answers.json.
+
+- вопросы (meta.question ответов бота) группируются по ветке в кластеры
+  похожих (Жаккар по основам слов, см. faq.py) — это интенты
+- остаются кластеры не меньше --min-count вопросов, не больше --top штук
+- ответ интента — лучший по оценкам из feedback.jsonl ответ бота в кластере
+  (средняя оценка не ниже --min-rating); с --generate интенты без такого
+  ответа получают ответ GigaChat по базе знаний (как в боте)
+
+Все новые интенты пишутся с "approved": false — бот их не отдаёт, пока
+человек не проверит ответ и не поставит true. При повторном запуске
+одобренные интенты (и правки их ответов) сохраняются: кластер получает id
+прежнего интента той же ветки, если с ним совпадает не меньше INTENT_OVERLAP
+примеров вопросов (центр кластера от смены трафика может сдвинуться).
+
+Запуск (cron, раз в сутки):
+    venv/bin/python scripts/build_faq_answers.py [--min-count 5] [--top 30] [--generate]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+sys.path.insert(0, BASE_DIR)
+
+from event_log import iter_log_events
+from faq import faq_terms, jaccard
+
+DIALOGS_PATH = os.getenv("DIALOGS_PATH", os.path.join(DATA_DIR, "dialogs.jsonl"))
+FEEDBACK_PATH = os.getenv("FEEDBACK_PATH", os.path.join(DATA_DIR, "feedback.jsonl"))
+FAQ_PATH = os.getenv("FAQ_ANSWERS_PATH", os.path.join(DATA_DIR, "faq_answers.json"))
+
+# Порог сходства вопроса с кластером (ниже, чем порог ответа в боте: кластер шире)
+CLUSTER_SIM = 0.6
+SAMPLE_QUESTIONS = 10
+# Доля примеров прежнего интента, которые должны встретиться в кластере, чтобы он сохранил id
+INTENT_OVERLAP = 0.5
+
+
+def load_ratings():
+    """answer_id -> [оценки 1..5] (⭐6 считается как 5)."""
+    ratings = {}
+    for e in iter_log_events(FEEDBACK_PATH):
+        aid = e.get("answer_id")
+        try:
+            r = int(e.get("rating"))
+        except (TypeError, ValueError):
+            continue
+        if aid and 1 <= r <= 6:
+            ratings.setdefault(aid, []).append(min(r, 5))
+    return ratings
+
+
+def load_answers():
+    """Ответы бота с вопросом: [{question, branch, answer, answer_id}]."""
+    out = []
+    for e in iter_log_events(DIALOGS_PATH):
+        if e.get("role") != "bot":
+            continue
+        meta = e.get("meta") or {}
+        q = (meta.get("question") or "").strip()
+        if not q or not meta.get("answer_id"):
+            continue
+        out.append({
+            "question": q,
+            "branch": meta.get("branch") or "",
+            "answer": e.get("text") or "",
+            "answer_id": meta["answer_id"],
+            # ответы, уже выданные из FAQ, не выбираем заново как «лучшие»
+            "from_faq": bool(meta.get("faq_id")),
+        })
+    return out
+
+
+def cluster(items):
+    """Жадная кластеризация вопросов одной ветки: частые формулировки становятся центрами."""
+    by_terms = {}
+    for it in items:
+        terms = faq_terms(it["question"])
+        if terms:
+            by_terms.setdefault(terms, []).append(it)
+    clusters = []
+    index = {}  # основа -> номера кластеров, чей центр её содержит
+    for terms, group in sorted(by_terms.items(), key=lambda kv: -len(kv[1])):
+        best, best_score = None, 0.0
+        for n in set(c for t in terms for c in index.get(t, ())):
+            score = jaccard(terms, clusters[n]["terms"])
+            if score > best_score:
+                best, best_score = n, score
+        if best is not None and best_score >= CLUSTER_SIM:
+            clusters[best]["items"].extend(group)
+            continue
+        clusters.append({"terms": terms, "items": list(group)})
+        for t in terms:
+            index.setdefault(t, []).append(len(clusters) - 1)
+    return clusters
+
+
+def best_answer(items, ratings, min_rating):
+    best, best_key = None, None
+    for it in items:
+        rs = ratings.get(it["answer_id"])
+        if not rs or it["from_faq"]:
+            continue
+        avg = float(sum(rs)) / len(rs)
+        if avg < min_rating:
+            continue
+        key = (avg, len(rs))
+        if best_key is None or key > best_key:
+            best, best_key = it, key
+    if best is None:
+        return None
+    return {"answer": best["answer"], "source": "log:%s" % best["answer_id"],
+            "avg_rating": round(best_key[0], 2), "ratings": best_key[1]}
+
+
+def generate_answer(question, branch):
+    """Ответ по тому же пути, что и в боте: RAG по KB + GigaChat."""
+    import bot
+    if bot.GIGACHAT is None:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(BASE_DIR, ".env"))
+        if bot.init_gigachat() is None:
+            return None
+    idx = bot.load_kb_index()
+    snippets = bot.retrieve_kb_snippets(question, idx, top_k=6)
+    prompt = bot.build_llm_prompt(question, snippets, branch=branch or None)
+    answer, err = bot.gigachat_call(prompt, kb_version=bot.kb_index_version(idx))
+    if err or not answer:
+        print("  generate failed: %s" % err)
+        return None
+    return {"answer": bot.prettify_answer(answer), "source": "generated"}
+
+
+def intent_id(branch, terms):
+    return "%s-%s" % (branch or "any", hashlib.sha1(" ".join(sorted(terms)).encode("utf-8")).hexdigest()[:8])
+
+
+def intent_overlap(old, cluster_terms):
+    """Доля примеров вопросов прежнего интента, формулировки которых есть в кластере."""
+    samples = [faq_terms(q) for q in old.get("questions") or []]
+    samples = [t for t in samples if t]
+    if not samples:
+        return 0.0
+    return float(sum(1 for t in samples if t in cluster_terms)) / len(samples)
+
+
+def match_existing(branch, items, existing, used):
+    """id прежнего интента ветки branch с наибольшим пересечением примеров (не меньше INTENT_OVERLAP)."""
+    cluster_terms = set(faq_terms(it["question"]) for it in items)
+    best, best_score = None, 0.0
+    # Одобренные первыми: при равном пересечении выигрывает проверенный человеком ответ
+    for iid, old in sorted(existing.items(), key=lambda kv: not kv[1].get("approved")):
+        if iid in used or (old.get("branch") or "") != branch:
+            continue
+        score = intent_overlap(old, cluster_terms)
+        if score > best_score:
+            best, best_score = iid, score
+    return best if best_score >= INTENT_OVERLAP else None
+
+
+def load_existing():
+    try:
+        with open(FAQ_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {it["id"]: it for it in data.get("intents") or [] if it.get("id")}
+    except Exception:
+        return {}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build data/faq_answers.json from dialog logs")
+    ap.add_argument("--min-count", type=int, default=5, help="минимум вопросов в кластере")
+    ap.add_argument("--top", type=int, default=30, help="сколько интентов оставить")
+    ap.add_argument("--min-rating", type=float, default=4.0, help="минимальная средняя оценка ответа из логов")
+    ap.add_argument("--generate", action="store_true", help="генерировать ответ GigaChat, если подходящего нет")
+    args = ap.parse_args()
+
+    ratings = load_ratings()
+    answers = load_answers()
+    by_branch = {}
+    for it in answers:
+        by_branch.setdefault(it["branch"], []).append(it)
+
+    found = []
+    for branch, items in by_branch.items():
+        for c in cluster(items):
+            if len(c["items"]) >= args.min_count:
+                found.append((branch, c))
+    found.sort(key=lambda bc: -len(bc[1]["items"]))
+    found = found[:args.top]
+
+    existing = load_existing()
+    used = set()
+    intents = []
+    for branch, c in found:
+        iid = match_existing(branch, c["items"], existing, used)
+        if iid is None:
+            iid = intent_id(branch, c["terms"])
+            if iid in used:
+                iid = "%s-%d" % (iid, len(intents))
+        used.add(iid)
+        counts = {}
+        for it in c["items"]:
+            q = " ".join(it["question"].split())
+            counts[q] = counts.get(q, 0) + 1
+        questions = [q for q, _ in sorted(counts.items(), key=lambda kv: -kv[1])[:SAMPLE_QUESTIONS]]
+        intent = {
+            "id": iid,
+            "branch": branch,
+            "count": len(c["items"]),
+            "questions": questions,
+            "answer": "",
+            "source": None,
+            "approved": False,
+        }
+        old = existing.pop(iid, None)
+        if old and old.get("approved"):
+            # Проверенный человеком ответ не трогаем, обновляем только статистику и примеры
+            for k in ("answer", "source", "avg_rating", "ratings", "approved"):
+                if k in old:
+                    intent[k] = old[k]
+        else:
+            picked = best_answer(c["items"], ratings, args.min_rating)
+            if picked is None and args.generate:
+                print("Generating answer for %s: %s" % (iid, questions[0]))
+                picked = generate_answer(questions[0], branch)
+            if picked is None and old and old.get("answer"):
+                picked = {k: old[k] for k in ("answer", "source", "avg_rating", "ratings") if k in old}
+            if picked:
+                intent.update(picked)
+        intents.append(intent)
+    # Одобренные интенты, которые выпали из топа, оставляем
+    for old in existing.values():
+        if old.get("approved"):
+            intents.append(old)
+
+    os.makedirs(os.path.dirname(FAQ_PATH), exist_ok=True)
+    tmp = FAQ_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"generated_ts": int(time.time()), "intents": intents}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, FAQ_PATH)
+    print("FAQ answers: %d intents (%d approved, %d without answer) -> %s" % (
+        len(intents), sum(1 for it in intents if it.get("approved")),
+        sum(1 for it in intents if not it.get("answer")), FAQ_PATH))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выгружает бинарные логи событий (*.evb) в JSONL.
+
+Запуск:
+  venv/bin/python scripts/export_events.py data/evb/dialogs-20260101.evb > dialogs.jsonl
+  venv/bin/python scripts/export_events.py data/evb/*.evb -o export.jsonl
+
+Испорченный файл (битый кадр) сообщается в stderr: события до битого кадра
+выгружаются, остальные файлы — тоже; код выхода 1.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from event_codec import CodecError, iter_evb_events
+
+def main():
+    ap = argparse.ArgumentParser(description="Export .evb event logs to JSONL")
+    ap.add_argument("files", nargs="+", help=".evb файлы")
+    ap.add_argument("-o", "--output", help="файл JSONL (по умолчанию stdout)")
+    args = ap.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    n = 0
+    bad = []
+    try:
+        for path in args.files:
+            try:
+                for event in iter_evb_events(path):
+                    out.write(json.dumps(event, ensure_ascii=False) + "\n")
+                    n += 1
+            except CodecError as e:
+                print("Damaged segment: %s" % e, file=sys.stderr)
+                bad.append(path)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print("Exported %d events" % n, file=sys.stderr)
+    if bad:
+        print("Damaged files: %d (%s)" % (len(bad), ", ".join(bad)), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
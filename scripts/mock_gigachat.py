@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный mock GigaChat для нагрузочных тестов бота без реального API.
+
+Эндпоинты (формат ответов как у GigaChat):
+- POST /api/v2/oauth                — токен (access_token, expires_at в мс)
+- POST /api/v1/chat/completions     — ответ целиком или потоком SSE ("stream": true)
+- GET  /stats                       — счётчики mock (JSON)
+
+Что можно настроить:
+- задержку до ответа: --latency-dist fixed|uniform|normal|lognormal|exp,
+  --latency-ms (среднее/медиана) и --latency-sd; поток — --chunks фрагментов
+  с паузой --chunk-ms между ними
+- ошибки: --error-rate доля ответов 500, --timeout-rate доля «зависаний»
+  на --hang-sec секунд (проверка таймаутов и breaker)
+- токены: --token-ttl — срок жизни токена (по истечении — 401),
+  --expire-rate — доля запросов, получающих 401 при живом токене
+- лимит: --rps — запросов completions в секунду, сверх — 429 с Retry-After
+
+Бот направляется на mock через .env:
+    GIGACHAT_OAUTH_URL=http://127.0.0.1:8099/api/v2/oauth
+    GIGACHAT_API_BASE=http://127.0.0.1:8099
+    GIGACHAT_AUTH_KEY=mock
+
+Запуск:
+    venv/bin/python scripts/mock_gigachat.py --port 8099 --latency-dist lognormal --latency-ms 2500 \\
+        --error-rate 0.05 --token-ttl 120 --rps 5
+Нагрузка на mock через тот же путь, что и в боте: scripts/bench_gigachat.py.
+"""
+
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("банк", "счёт", "блокировка", "115-ФЗ", "документы", "пояснения", "операции",
+         "клиент", "комплаенс", "запрос", "ЗСК", "реабилитация", "срок", "ответ")
+
+
+class MockState(object):
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.tokens = {}  # token -> expiry ts
+        self.window = []  # ts запросов completions за последнюю секунду
+        self.counters = {"oauth": 0, "completions": 0, "stream": 0, "ok": 0, "errors_500": 0,
+                         "hangs": 0, "unauthorized": 0, "rate_limited": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def latency(self):
+        """Задержка до первого байта ответа, сек."""
+        a = self.args
+        mean = a.latency_ms / 1000.0
+        sd = a.latency_sd / 1000.0
+        with self.lock:
+            if a.latency_dist == "uniform":
+                v = self.rnd.uniform(max(0.0, mean - sd), mean + sd)
+            elif a.latency_dist == "normal":
+                v = self.rnd.gauss(mean, sd)
+            elif a.latency_dist == "lognormal":
+                # медиана = mean, sd задаёт «хвост» (sigma логарифма)
+                sigma = math.log(1 + sd / mean) if mean > 0 and sd > 0 else 0.0
+                v = mean * math.exp(self.rnd.gauss(0, sigma))
+            elif a.latency_dist == "exp":
+                v = self.rnd.expovariate(1.0 / mean) if mean > 0 else 0.0
+            else:
+                v = mean
+        return max(0.0, v)
+
+    def roll(self, rate):
+        with self.lock:
+            return rate > 0 and self.rnd.random() < rate
+
+    def issue_token(self):
+        tok = "mock-" + uuid.uuid4().hex
+        exp = time.time() + self.args.token_ttl
+        with self.lock:
+            now = time.time()
+            self.tokens = {t: e for t, e in self.tokens.items() if e > now}
+            self.tokens[tok] = exp
+        return tok, exp
+
+    def token_ok(self, header):
+        tok = (header or "")[len("Bearer "):] if (header or "").startswith("Bearer ") else ""
+        with self.lock:
+            exp = self.tokens.get(tok)
+        return exp is not None and exp > time.time()
+
+    def rate_limited(self):
+        """True — лимит --rps исчерпан (скользящее окно в 1 с)."""
+        if self.args.rps <= 0:
+            return False
+        now = time.time()
+        with self.lock:
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.args.rps:
+                return True
+            self.window.append(now)
+            return False
+
+    def answer_text(self):
+        with self.lock:
+            return " ".join(self.rnd.choice(WORDS) for _ in range(self.args.answer_words)) + "."
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, fmt, *args):
+        if self.state.args.verbose:
+            sys.stderr.write("%s - %s\n" % (self.address_string(), fmt % args))
+
+    def _read_body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _send_json(self, code, obj, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/stats":
+            with self.state.lock:
+                counters = dict(self.state.counters)
+            self._send_json(200, counters)
+        else:
+            self._send_json(404, {"message": "not found"})
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split("?")[0]
+        if path == "/api/v2/oauth":
+            self.handle_oauth()
+        elif path == "/api/v1/chat/completions":
+            self.handle_completions(body)
+        else:
+            self._send_json(404, {"message": "not found"})
+
+    def handle_oauth(self):
+        self.state.count("oauth")
+        if not (self.headers.get("Authorization") or "").startswith("Basic "):
+            self._send_json(401, {"code": 6, "message": "credentials doesn't match db data"})
+            return
+        tok, exp = self.state.issue_token()
+        self._send_json(200, {"access_token": tok, "expires_at": int(exp * 1000)})
+
+    def handle_completions(self, body):
+        st = self.state
+        st.count("completions")
+        if not st.token_ok(self.headers.get("Authorization")) or st.roll(st.args.expire_rate):
+            st.count("unauthorized")
+            self._send_json(401, {"status": 401, "message": "Token has expired"})
+            return
+        if st.rate_limited():
+            st.count("rate_limited")
+            self._send_json(429, {"status": 429, "message": "Too Many Requests"}, {"Retry-After": "1"})
+            return
+        try:
+            req = json.loads(body.decode("utf-8") or "{}")
+        except ValueError:
+            self._send_json(400, {"status": 400, "message": "Invalid JSON"})
+            return
+        if st.roll(st.args.timeout_rate):
+            st.count("hangs")
+            time.sleep(st.args.hang_sec)
+        else:
+            time.sleep(st.latency())
+        if st.roll(st.args.error_rate):
+            st.count("errors_500")
+            self._send_json(500, {"status": 500, "message": "Internal Server Error"})
+            return
+        model = req.get("model") or "GigaChat"
+        text = st.answer_text()
+        if req.get("stream"):
+            st.count("stream")
+            self.stream_answer(model, text)
+        else:
+            self._send_json(200, {
+                "choices": [{"message": {"role": "assistant", "content": text},
+                             "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": model,
+                "object": "chat.completion",
+                "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(text) // 4,
+                          "total_tokens": (len(body) + len(text)) // 4},
+            })
+        st.count("ok")
+
+    def stream_answer(self, model, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        n = max(1, min(self.state.args.chunks, len(words)))
+        step = int(math.ceil(len(words) / float(n)))
+        for i in range(0, len(words), step):
+            part = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+            event = {"choices": [{"delta": {"content": part, "role": "assistant"}, "index": 0}],
+                     "created": int(time.time()), "model": model, "object": "chat.completion"}
+            self._chunk("data: %s\n\n" % json.dumps(event, ensure_ascii=False))
+            time.sleep(self.state.args.chunk_ms / 1000.0)
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, s):
+        data = s.encode("utf-8")
+        self.wfile.write(("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def build_parser():
+    ap = argparse.ArgumentParser(description="Mock GigaChat API (OAuth + chat completions) for load tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-dist", choices=("fixed", "uniform", "normal", "lognormal", "exp"), default="lognormal")
+    ap.add_argument("--latency-ms", type=float, default=1500, help="средняя (медиана для lognormal) задержка ответа")
+    ap.add_argument("--latency-sd", type=float, default=500, help="разброс задержки, мс")
+    ap.add_argument("--chunks", type=int, default=8, help="фрагментов в потоковом ответе")
+    ap.add_argument("--chunk-ms", type=float, default=150, help="пауза между фрагментами потока")
+    ap.add_argument("--answer-words", type=int, default=60)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    ap.add_argument("--timeout-rate", type=float, default=0.0, help="доля запросов, зависающих на --hang-sec")
+    ap.add_argument("--hang-sec", type=float, default=90)
+    ap.add_argument("--token-ttl", type=float, default=1800, help="срок жизни токена, сек")
+    ap.add_argument("--expire-rate", type=float, default=0.0, help="доля запросов с 401 при живом токене")
+    ap.add_argument("--rps", type=float, default=0, help="лимит completions в секунду (0 — без лимита), сверх — 429")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--verbose", action="store_true", help="писать каждый запрос в stderr")
+    return ap
+
+
+def make_server(args):
+    """MockServer на args.host:args.port со своим MockState (server.state)."""
+    state = MockState(args)
+    handler = type("BoundHandler", (Handler,), {"state": state})
+    server = MockServer((args.host, args.port), handler)
+    server.state = state
+    return server
+
+
+def main():
+    args = build_parser().parse_args()
+    server = make_server(args)
+    print("Mock GigaChat on http://%s:%d (latency %s %.0f±%.0f ms, errors %.0f%%, rps %s)" % (
+        args.host, args.port, args.latency_dist, args.latency_ms, args.latency_sd,
+        args.error_rate * 100, args.rps or "∞"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.state.counters, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пересобирает data/log_index.sqlite3 по dialogs.jsonl, feedback.jsonl и архивным сегментам.
+Запуск: venv/bin/python scripts/rebuild_log_index.py
+"""
+
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+sys.path.insert(0, BASE_DIR)
+
+from log_index import LogIndex
+
+DIALOGS_PATH = os.getenv("DIALOGS_PATH", os.path.join(DATA_DIR, "dialogs.jsonl"))
+FEEDBACK_PATH = os.getenv("FEEDBACK_PATH", os.path.join(DATA_DIR, "feedback.jsonl"))
+LOG_INDEX_PATH = os.getenv("LOG_INDEX_PATH", os.path.join(DATA_DIR, "log_index.sqlite3"))
+
+def main():
+    idx = LogIndex(LOG_INDEX_PATH)
+    n = idx.rebuild(DIALOGS_PATH, FEEDBACK_PATH)
+    idx.close()
+    print("Log index rebuilt: %s (%d events)" % (LOG_INDEX_PATH, n))
+
+if __name__ == "__main__":
+    main()
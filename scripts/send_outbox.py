@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, json, time
+import os, sys, json, time
 import requests
 from dotenv import load_dotenv
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
+sys.path.insert(0, BASE_DIR)
+
+from event_log import append_line, encode_event
 
 load_dotenv(os.path.join(BASE_DIR, ".env"))
 
@@ -19,9 +22,9 @@ DIALOGS_PATH = os.getenv("DIALOGS_PATH", os.path.join(DATA_DIR, "dialogs.jsonl")
 TG_API = "https://api.telegram.org/bot{}/".format(BOT_TOKEN)
 
 def append_jsonl(path, obj):
+    # Под той же блокировкой, что и писатель бота: строки не перемешиваются с его пачками
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    append_line(path, encode_event(obj))
 
 def send_message(chat_id, text, reply_markup=None):
     url = TG_API + "sendMessage"
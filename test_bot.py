@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты вспомогательных функций bot.py (нужны зависимости бота из requirements.txt)."""
+
+import os
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("dotenv")
+
+import bot
+
+
+class _Index(object):
+    """LOG_INDEX с заданными строками комментариев."""
+
+    def __init__(self, n):
+        self.rows = [{"thread_id": "t%d" % i, "user_id": i, "branch": "115fz", "eff_rating": 5,
+                      "comment": "c%d" % i, "is_read": False} for i in range(n)]
+
+    def list_comments(self, admin_id, offset=0, limit=10, branch=None, max_rating=None):
+        return self.rows[offset:offset + limit]
+
+    def unread_count(self, admin_id):
+        return len(self.rows)
+
+    def mark_read(self, admin_id, rows):
+        pass
+
+
+def _callbacks(kb):
+    return [b.callback_data for row in kb.inline_keyboard for b in row]
+
+
+def test_inbox_callback_data_is_short(monkeypatch):
+    monkeypatch.setattr(bot, "LOG_INDEX", _Index(25))
+    _, kb = bot.render_inbox(1, page=2, branch="no_reason", max_rating=3)
+    data = _callbacks(kb)
+    assert data == ["INBOX:1:5:3", "INBOX:3:5:3"]
+    assert all(len(d.encode("utf-8")) <= bot.CALLBACK_DATA_MAX for d in data)
+
+
+class _Query(object):
+    def __init__(self, data, error):
+        self.data = data
+        self.error = error
+        self.edits = 0
+
+    def answer(self):
+        pass
+
+    def edit_message_text(self, text, reply_markup=None):
+        self.edits += 1
+        raise self.error
+
+
+def test_inbox_repeat_click_ignores_not_modified(monkeypatch):
+    from telegram.error import BadRequest
+    monkeypatch.setattr(bot, "LOG_INDEX", _Index(3))
+    monkeypatch.setattr(bot, "ADMIN_IDS", {1})
+    update = type("Update", (), {})()
+    update.effective_user = type("User", (), {"id": 1})()
+    update.effective_chat = type("Chat", (), {"id": 1})()
+    update.callback_query = _Query("INBOX:1:-:", BadRequest("Message is not modified: specified new message content "
+                                                             "and reply markup are exactly the same"))
+    bot.on_callback(update, None)
+    assert update.callback_query.edits == 1
+    update.callback_query = _Query("INBOX:1:-:", BadRequest("Message to edit not found"))
+    with pytest.raises(BadRequest):
+        bot.on_callback(update, None)
+
+
+def test_parse_inbox_args():
+    assert bot.parse_inbox_args(["2", "zsk", "<=3"]) == (2, "zsk", 3)
+    assert bot.parse_inbox_args([]) == (1, None, None)
+
+
+class _Model(object):
+    model = "GigaChat"
+
+
+def _open_breakers(monkeypatch, model):
+    from llm_guard import BreakerPool
+    pool = BreakerPool("gigachat", min_calls=1, cooldown=60)
+    pool.get(model).allow()
+    pool.get(model).record(False)
+    monkeypatch.setattr(bot, "GIGACHAT", _Model())
+    monkeypatch.setattr(bot, "LLM_CACHE", None)
+    monkeypatch.setattr(bot, "GIGACHAT_BREAKERS", pool)
+    return pool
+
+
+def test_open_breaker_does_not_spend_rate_limit(monkeypatch):
+    from llm_guard import RateLimiter
+    _open_breakers(monkeypatch, "GigaChat")
+    limiter = RateLimiter(global_rate=0.001, global_burst=1, user_rate=0.001, user_burst=1, max_wait=0)
+    monkeypatch.setattr(bot, "LLM_RATE_LIMITER", limiter)
+    answer, err = bot.gigachat_call("вопрос", user_id=7)
+    assert answer is None and "circuit open" in err
+    assert limiter.acquire(7) is None
+
+
+def test_breaker_is_per_model(monkeypatch):
+    pool = _open_breakers(monkeypatch, "GigaChat-Pro")
+    monkeypatch.setattr(bot, "LLM_RATE_LIMITER", None)
+    monkeypatch.setattr(bot, "_gigachat_request", lambda prompt, model, timeout, on_text, breaker=None: ("ok", None))
+    assert bot.gigachat_call("вопрос", model="GigaChat-Pro")[1] == "GigaChat circuit open"
+    assert bot.gigachat_call("вопрос", model="GigaChat") == ("ok", None)
+    assert pool.stats()["GigaChat"]["state"] == "closed"
+
+
+class _Bot(object):
+    def __init__(self):
+        self.edits = []
+
+    def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append(text)
+
+
+def test_streaming_reply_ignores_updates_after_finish():
+    tg = _Bot()
+    reply = bot.StreamingReply(tg, chat_id=1, message_id=10, interval=0)
+    reply.update("част")
+    assert reply.finish("запасной ответ") == 10
+    reply.update("частичный ответ лидера")
+    assert tg.edits == ["част …", "запасной ответ"]
+
+
+def test_archive_index_read_from_disk_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_INDEX", str(tmp_path / "index.json"))
+    monkeypatch.setattr(bot, "_ARCHIVE_INDEX", None)
+    bot.save_archive_index({"1": "state-2024-01.jsonl.gz"})
+    reads = []
+    monkeypatch.setattr(bot, "_load_json", lambda path: reads.append(path))
+    for _ in range(3):
+        assert bot.restore_archived_user("2") is None
+    assert bot.load_archive_index() == {"1": "state-2024-01.jsonl.gz"}
+    assert reads == []
+
+
+def test_evicted_user_restored_from_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "STATE_FILE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_INDEX", str(tmp_path / "archive" / "index.json"))
+    monkeypatch.setattr(bot, "_ARCHIVE_INDEX", None)
+    bot.save_state({"5": {"branch": "zsk", "last_user_message_ts": 1}})
+    assert bot.evict_inactive_users(ttl_days=1) == 1
+    assert bot.load_state() == {} and "5" in bot.load_archive_index()
+    user_state, _ = bot.get_user_state_persistent(5)
+    assert user_state["branch"] == "zsk"
+    assert bot.load_archive_index() == {}
+
+
+def test_safe_write_without_writer_thread_notifies_listeners(tmp_path, monkeypatch):
+    from event_log import EventWriter
+    writer = EventWriter(fsync=False, rotate_daily=False, rotate_max_bytes=0)
+    got = []
+    writer.add_listener(lambda p, events, seq, offsets: got.append((events, offsets)))
+    monkeypatch.setattr(bot, "EVENT_WRITER", writer)
+    path = str(tmp_path / "dialogs.jsonl")
+    bot.safe_write_jsonl(path, {"ts": 1, "role": "user", "text": "q"})
+    bot.safe_write_jsonl(path, {"ts": 2, "role": "user", "text": "q2"})
+    assert [offsets for _, offsets in got] == [[0], [len(open(path, "rb").readline())]]
+
+
+def test_failed_answer_replaces_placeholder_with_apology(monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("kb index broken")
+
+    monkeypatch.setattr(bot, "answer_question", boom)
+    tg = _Bot()
+    reply = bot.StreamingReply(tg, chat_id=1, message_id=10)
+    with pytest.raises(RuntimeError):
+        bot.answer_question_task(None, tg, {}, "вопрос", None, {}, reply)
+    assert tg.edits == [bot.ANSWER_FAILED_TEXT]
+
+
+def test_parse_stats_args(monkeypatch):
+    now = 1704162600  # 2024-01-02T02:30:00Z
+    monkeypatch.setattr(bot, "now_ts", lambda: now)
+    day = 1704153600
+    assert bot.parse_stats_args([]) == ("d", day - 6 * 86400, day, None, "последние 7 дн.")
+    assert bot.parse_stats_args(["3h", "zsk"]) == ("h", now - 1800 - 7200, now - 1800, "zsk", "последние 3 ч")
+    assert bot.parse_stats_args(["2024-01-02", "2024-01-01"])[:3] == ("d", day - 86400, day)
+    assert bot.parse_stats_args(["2024-01-01"])[4] == "2024-01-01"
+
+
+class _Message(object):
+    def __init__(self):
+        self.replies = []
+
+    def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class _Update(object):
+    def __init__(self, user_id):
+        self.effective_user = type("User", (), {"id": user_id})()
+        self.message = _Message()
+
+
+def test_cmd_stats_average_matches_dashboard(tmp_path, monkeypatch):
+    from dashboard_data import DashboardAggregate
+    from log_index import LogIndex
+    events = [
+        ("dialogs", {"ts": 1704067200, "user_id": 1, "role": "bot", "thread_id": "t1",
+                     "meta": {"answer_id": "a1", "branch": "zsk"}}),
+        ("dialogs", {"ts": 1704067300, "user_id": 2, "role": "bot", "thread_id": "t2",
+                     "meta": {"answer_id": "a2", "branch": "zsk"}}),
+        ("feedback", {"ts": "2024-01-01T10:00:00Z", "answer_id": "a1", "branch": "zsk", "rating": 1}),
+        ("feedback", {"ts": "2024-01-01T11:00:00Z", "answer_id": "a2", "branch": "zsk", "rating": 4}),
+        ("feedback", {"ts": "2024-01-02T10:00:00Z", "answer_id": "a1", "branch": "zsk", "rating": 5}),
+    ]
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    agg = DashboardAggregate()
+    for i, (name, e) in enumerate(events):
+        idx.on_events(str(tmp_path / (name + ".jsonl")), [e], 1, [i * 100])
+        (agg.add_dialog if name == "dialogs" else agg.add_feedback)(e)
+    monkeypatch.setattr(bot, "LOG_INDEX", idx)
+    monkeypatch.setattr(bot, "ADMIN_IDS", [9])
+    context = type("Context", (), {"args": ["2024-01-01", "2024-01-02"]})()
+
+    update = _Update(9)
+    bot.cmd_stats(update, context)
+    text = update.message.replies[0]
+    assert "Ответов: 2" in text and "⭐1: 0" in text and "⭐5: 1" in text
+    assert "Средняя (1-5): %.2f" % agg.build()[0]["avg_rating_1_5"] in text
+
+    stranger = _Update(10)
+    bot.cmd_stats(stranger, context)
+    assert stranger.message.replies == ["❌ Доступ запрещён."]
+    idx.close()
+
+
+def test_personal_prompts_bypass_cache_and_coalescing(tmp_path, monkeypatch):
+    from llm_cache import LLMCache
+    from llm_guard import InFlight
+    calls = []
+    monkeypatch.setattr(bot, "GIGACHAT", _Model())
+    monkeypatch.setattr(bot, "GIGACHAT_BREAKERS", None)
+    monkeypatch.setattr(bot, "LLM_RATE_LIMITER", None)
+    monkeypatch.setattr(bot, "LLM_INFLIGHT", InFlight())
+    monkeypatch.setattr(bot, "LLM_PERSONAL_CALLS", 0)
+    monkeypatch.setattr(bot, "LLM_CACHE", LLMCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(bot, "_gigachat_request",
+                        lambda prompt, model, timeout, on_text, breaker=None: calls.append(prompt) or ("ok", None))
+    for _ in range(2):
+        assert bot.gigachat_call("вопрос с историей", personal=True) == ("ok", None)
+        assert bot.gigachat_call("общий вопрос") == ("ok", None)
+    assert calls == ["вопрос с историей", "общий вопрос", "вопрос с историей"]
+    assert bot.LLM_PERSONAL_CALLS == 2
+    assert bot.LLM_CACHE.stats()["entries"] == 1
+    bot.LLM_CACHE.close()
+
+
+class _Matcher(object):
+    def __init__(self):
+        self.calls = []
+
+    def match(self, text, branch=None):
+        self.calls.append(text)
+        return {"id": "faq-1", "answer": "готовый ответ"}, 1.0
+
+
+def test_faq_not_consulted_while_case_flow_waits_for_answer(monkeypatch):
+    state = {"branch": "115fz", "case_data": {"step": 1, "asked_questions": ["when_what"], "answers": {}}}
+    matcher = _Matcher()
+    flow = []
+    monkeypatch.setattr(bot, "FAQ_MATCHER", matcher)
+    monkeypatch.setattr(bot, "safe_write_jsonl", lambda path, obj: None)
+    monkeypatch.setattr(bot, "get_user_state_persistent", lambda uid: (state, False))
+    monkeypatch.setattr(bot, "update_user_state_persistent", lambda uid, patch: None)
+    monkeypatch.setattr(bot, "handle_menu", lambda update, context: False)
+    monkeypatch.setattr(bot, "ensure_case_flow", lambda update, context, st, text: flow.append(text) or True)
+    delivered = []
+    monkeypatch.setattr(bot, "deliver_answer", lambda message, tg, text, answer, *a, **kw: delivered.append(answer))
+    update = _Update(5)
+    update.effective_user.username = "u"
+    update.effective_chat = type("Chat", (), {"id": 5})()
+    update.message.text = "вчера заблокировали счёт"
+    context = type("Context", (), {"bot": None})()
+    bot.handle_text(update, context)
+    assert matcher.calls == [] and flow == ["вчера заблокировали счёт"]
+
+    state["case_data"]["step"] = 4
+    bot.handle_text(update, context)
+    assert matcher.calls == ["вчера заблокировали счёт"] and delivered == ["готовый ответ"]
+
+
+def test_archive_restore_reads_only_its_gzip_member(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(bot, "STATE_ARCHIVE_INDEX", str(tmp_path / "index.json"))
+    monkeypatch.setattr(bot, "_ARCHIVE_INDEX", None)
+    bot.archive_user_states([("1", {"branch": "old"}), ("2", {"branch": "zsk"})])
+    bot.archive_user_states([("1", {"branch": "115fz"})])
+    index = bot.load_archive_index()
+    offsets = (index["1"][1], index["2"][1])
+    assert offsets[0] > 0 and offsets[1] == 0
+    reads = []
+    real_member = bot._read_archive_member
+    monkeypatch.setattr(bot, "_read_archive_member", lambda path, offset: reads.append(offset) or real_member(path, offset))
+    assert bot.restore_archived_user("1") == {"branch": "115fz"}
+    assert bot.restore_archived_user("2") == {"branch": "zsk"}
+    assert reads == list(offsets)
+    # Индекс старого формата (только имя сегмента) читается целиком
+    bot.save_archive_index({"1": os.path.basename(bot._archive_segment_path(bot.now_ts()))})
+    assert bot.restore_archived_user("1") == {"branch": "115fz"}
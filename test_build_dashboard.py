@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты scripts/build_dashboard.py: инкрементальная сборка по чекпоинту через ротации логов,
+чекпоинт без текстов и перезапись только изменившихся шардов."""
+
+import os
+import json
+
+import pytest
+
+import build_dashboard
+from event_log import rotate_log
+
+
+def _dialog(i):
+    return {"ts": 1704067200 + i * 3600, "user_id": 10 + i % 3, "role": "bot", "text": "answer %d" % i,
+            "thread_id": "t%d" % i, "meta": {"answer_id": "a%d" % i, "question": "q%d" % i, "branch": "115fz"}}
+
+
+def _feedback(i):
+    return {"ts": 1704067200 + i * 3600 + 60, "user_id": 10 + i % 3, "answer_id": "a%d" % i,
+            "rating": i % 5 + 1, "comment": "c%d" % i}
+
+
+@pytest.fixture
+def add(dashboard_logs, append_jsonl):
+    """add(*i) — ответ i в dialogs и оценка с комментарием к нему в feedback."""
+    dialogs, feedback = dashboard_logs
+
+    def _add(*ids):
+        for i in ids:
+            append_jsonl(dialogs, _dialog(i))
+            append_jsonl(feedback, _feedback(i))
+    return _add
+
+
+def _without_texts(threads):
+    return [dict(t, question=None, answer=None) for t in threads]
+
+
+def _read_data(dash_dir):
+    data_dir = os.path.join(dash_dir, "data")
+    files = {}
+    for root, _, names in os.walk(data_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8") as f:
+                files[os.path.relpath(path, data_dir)] = json.load(f)
+    summary = files.pop("summary.json")
+    return files, summary["shards"]
+
+
+def _checkpoint(agg, logs_ck):
+    build_dashboard.save_checkpoint({"version": build_dashboard.CHECKPOINT_VERSION, "logs": logs_ck,
+                                     "aggregate": agg.to_dict()})
+
+
+def test_incremental_matches_full_after_two_rotations(dashboard_logs, add):
+    add(0, 1)
+    agg, logs_ck, mode = build_dashboard.collect()
+    assert mode == "full"
+    _checkpoint(agg, logs_ck)
+
+    # Дописано в активный файл прошлого запуска, затем две ротации подряд
+    add(2)
+    for path in dashboard_logs:
+        rotate_log(path)
+    add(3)
+    for path in dashboard_logs:
+        rotate_log(path)
+    add(4, 5)
+
+    inc, inc_ck, mode = build_dashboard.collect()
+    assert mode == "incremental"
+    full, full_ck, _ = build_dashboard.collect(full=True)
+    assert _without_texts(inc.build()[1]) == _without_texts(full.build()[1])
+    assert inc_ck == full_ck
+    assert len(inc.build()[1]) == 6
+
+
+def test_ambiguous_segment_seq_forces_full_rebuild(dashboard_logs, add):
+    dialogs, _ = dashboard_logs
+    add(0)
+    agg, logs_ck, _ = build_dashboard.collect()
+    add(1)
+    for path in dashboard_logs:
+        rotate_log(path)
+    # Два необработанных сегмента с seq из чекпоинта: смещение неясно к какому применять
+    manifest_path = os.path.join(build_dashboard.log_archive_dir(dialogs), "manifest.json")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["segments"].append(dict(manifest["segments"][0], file="copy-" + manifest["segments"][0]["file"]))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with pytest.raises(build_dashboard.FullRebuildNeeded):
+        list(build_dashboard.iter_new_events(dialogs, logs_ck["dialogs"]))
+
+
+def test_checkpoint_has_no_texts_and_unchanged_shards_stay(add, monkeypatch, tmp_path):
+    add(0, 1)
+    build_dashboard.main()
+    with open(build_dashboard.CHECKPOINT_PATH, encoding="utf-8") as f:
+        raw = f.read()
+    assert "answer 0" not in raw
+    assert json.loads(raw)["aggregate"]["qa"]["a0"]["q"] == "q0"
+
+    data_dir = os.path.join(build_dashboard.DASH_DIR, "data")
+    jan = [os.path.join(root, n) for root, _, names in os.walk(os.path.join(data_dir, "threads", "2024-01"))
+           for n in names]
+    before = {p: os.stat(p).st_ino for p in jan}
+
+    # Новый ответ через месяц — январские шарды не меняются
+    add(800)
+    build_dashboard.main()
+    assert {p: os.stat(p).st_ino for p in jan} == before
+    inc_files, inc_shards = _read_data(build_dashboard.DASH_DIR)
+    assert any(f.startswith(os.path.join("threads", "2024-02")) for f in inc_files)
+
+    # Результат совпадает с полной пересборкой, тексты на месте
+    monkeypatch.setattr(build_dashboard, "DASH_DIR", str(tmp_path / "full"))
+    build_dashboard.main(full=True)
+    full_files, full_shards = _read_data(build_dashboard.DASH_DIR)
+    assert inc_files == full_files and inc_shards == full_shards
+    answers = {t["answer"] for name, obj in full_files.items() if name.startswith("threads")
+               for t in obj["threads"]}
+    assert answers == {"answer 0", "answer 1", "answer 800"}
+    texts = [n for n in os.listdir(str(tmp_path)) if n.startswith("dashboard_texts-")]
+    assert len(texts) == 1
+
+
+def test_page_carries_no_thread_data(add):
+    add(0, 1)
+    build_dashboard.main()
+    dash = build_dashboard.DASH_DIR
+    with open(os.path.join(dash, "index.html"), encoding="utf-8") as f:
+        html = f.read()
+    assert "answer 0" not in html and "q1" not in html
+    assert not os.path.exists(os.path.join(dash, "comments.json"))
+    files, shards = _read_data(dash)
+    assert sorted(files) == sorted(["filters.json", "index.json", "rollups.json"] +
+                                   [os.path.join(*s["file"].split("/")) for s in shards])
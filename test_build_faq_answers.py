@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты scripts/build_faq_answers.py: кластеры вопросов и устойчивые id интентов."""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+import build_faq_answers
+
+A = "как разблокировать счет"
+B = "разблокировать счет банк"
+
+
+def _log(path, questions, start=0):
+    with open(path, "a", encoding="utf-8") as f:
+        for i, q in enumerate(questions, start):
+            f.write(json.dumps({"ts": i, "role": "bot", "text": "ответ %d" % i,
+                                "meta": {"question": q, "branch": "115fz", "answer_id": "a%d" % i}},
+                               ensure_ascii=False) + "\n")
+
+
+def _run(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_faq_answers, "DIALOGS_PATH", str(tmp_path / "dialogs.jsonl"))
+    monkeypatch.setattr(build_faq_answers, "FEEDBACK_PATH", str(tmp_path / "feedback.jsonl"))
+    monkeypatch.setattr(build_faq_answers, "FAQ_PATH", str(tmp_path / "faq_answers.json"))
+    monkeypatch.setattr(sys, "argv", ["build_faq_answers.py", "--min-count", "3"])
+    build_faq_answers.main()
+    with open(str(tmp_path / "faq_answers.json"), encoding="utf-8") as f:
+        return json.load(f)["intents"]
+
+
+def test_cluster_groups_similar_questions():
+    items = [{"question": q} for q in [A] * 3 + [B] + ["что такое мвк"]]
+    clusters = build_faq_answers.cluster(items)
+    assert sorted(len(c["items"]) for c in clusters) == [1, 4]
+
+
+def test_intent_keeps_id_when_cluster_centre_shifts(tmp_path, monkeypatch):
+    dialogs = str(tmp_path / "dialogs.jsonl")
+    _log(dialogs, [A] * 5 + [B])
+    first = _run(tmp_path, monkeypatch)
+    assert len(first) == 1
+    # Человек одобрил ответ
+    first[0].update(answer="Проверенный ответ", approved=True)
+    with open(str(tmp_path / "faq_answers.json"), "w", encoding="utf-8") as f:
+        json.dump({"intents": first}, f, ensure_ascii=False)
+
+    # Трафик сместился: центром кластера становится другая формулировка
+    _log(dialogs, [B] * 10, start=100)
+    second = _run(tmp_path, monkeypatch)
+    assert build_faq_answers.intent_id("115fz", build_faq_answers.faq_terms(B)) != first[0]["id"]
+    assert [(it["id"], it["approved"], it["answer"]) for it in second] == [
+        (first[0]["id"], True, "Проверенный ответ")]
+    assert second[0]["count"] == 16
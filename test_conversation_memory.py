@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты conversation_memory.py: лимит реплик, сжатие в summary и смена треда."""
+
+from conversation_memory import ConversationMemory, estimate_tokens
+
+
+def _fill(mem, n, thread_id="t1", memory=None):
+    for i in range(n):
+        memory = mem.add(memory, thread_id, "вопрос %d %s" % (i, "x" * 200), "ответ %d %s" % (i, "y" * 400))
+    return memory
+
+
+def test_turns_stay_within_budget_and_overflow_waits_for_compaction():
+    mem = ConversationMemory(max_tokens=600, summary_tokens=50)
+    memory = _fill(mem, 10)
+    assert sum(estimate_tokens(t["q"]) + estimate_tokens(t["a"]) for t in memory["turns"]) <= 600
+    assert mem.needs_compact(memory)
+    assert memory["turns"][-1]["q"].startswith("вопрос 9")
+    assert len(memory["turns"]) + len(memory["overflow"]) == 10
+
+
+def test_compact_uses_summary_and_render_is_bounded():
+    calls = []
+
+    def summarize(prev, turns):
+        calls.append(len(turns))
+        return (prev + " " if prev else "") + "сжато %d" % len(turns)
+
+    mem = ConversationMemory(max_tokens=600, summary_tokens=50, summarize=summarize)
+    memory = _fill(mem, 10)
+    prev = memory["summary"]
+    overflow, summary = mem.compact(memory)
+    memory = mem.apply(memory, prev, overflow, summary)
+    assert not mem.needs_compact(memory) and memory["summary"] == "сжато %d" % calls[0]
+    memory = _fill(mem, 30, memory=memory)
+    overflow, summary = mem.compact(memory)
+    memory = mem.apply(memory, memory["summary"], overflow, summary)
+    text = mem.render(memory, "t1")
+    assert text.startswith("Ранее в разговоре: сжато")
+    assert estimate_tokens(text) <= 600 + 50 + 50  # реплики + summary + подписи
+    assert mem.stats() == {"compactions": 2, "fallbacks": 0}
+
+
+def test_compact_falls_back_to_question_list():
+    def broken(prev, turns):
+        raise RuntimeError("LLM down")
+
+    mem = ConversationMemory(max_tokens=600, summarize=broken)
+    memory = _fill(mem, 10)
+    overflow, summary = mem.compact(memory)
+    # Без LLM — темы вопросов; при обрезке остаются самые свежие
+    assert "вопрос %d" % (len(overflow) - 1) in summary
+    assert len(summary) <= mem.summary_tokens * 3
+    assert mem.stats()["fallbacks"] == 1
+
+
+def test_apply_skips_stale_result():
+    mem = ConversationMemory(max_tokens=600)
+    memory = _fill(mem, 10)
+    overflow, summary = mem.compact(memory)
+    changed = dict(memory, summary="другое")
+    assert mem.apply(changed, "", overflow, summary) is None
+
+
+def test_new_thread_resets_memory():
+    mem = ConversationMemory()
+    memory = mem.add(None, "t1", "q", "a")
+    assert mem.render(memory, "t2") == ""
+    assert mem.add(memory, "t2", "q2", "a2")["turns"][0]["q"] == "q2"
+    assert len(mem.add(memory, "t2", "q2", "a2")["turns"]) == 1
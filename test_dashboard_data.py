@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты dashboard_data.py: разбор времени, индексы фильтров и согласованность дней с rollups."""
+
+import time
+
+import pytest
+
+from dashboard_data import DashboardAggregate, build_filter_index, build_payloads, parse_ts, shard_threads
+
+
+@pytest.fixture
+def moscow_tz(monkeypatch):
+    """Локальная зона процесса не UTC: дни не должны от неё зависеть."""
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset is not available")
+    monkeypatch.setenv("TZ", "Europe/Moscow")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_parse_ts_iso_is_utc(moscow_tz):
+    assert parse_ts("2024-01-01T00:00:00Z") == 1704067200
+    assert parse_ts(1704067200) == 1704067200
+    assert parse_ts("bad") == 0
+
+
+def test_filter_days_match_rollup_days(moscow_tz):
+    agg = DashboardAggregate()
+    # 22:30 UTC 1 января — по Москве уже 2 января
+    ts = 1704067200 + 22 * 3600 + 1800
+    agg.add_dialog({"ts": ts, "user_id": 1, "role": "bot", "text": "a", "thread_id": "t1",
+                    "meta": {"answer_id": "a1", "question": "q", "branch": "zsk"}})
+    agg.add_feedback({"ts": ts + 60, "user_id": 1, "answer_id": "a1", "rating": 5, "comment": "c"})
+    stats, threads = agg.build()
+    payloads = build_payloads(stats, threads, agg.rollups)
+    days = {time.strftime("%Y-%m-%d", time.gmtime(r[0])) for r in payloads["rollups.json"]["rows"]}
+    assert set(payloads["filters.json"]["day"]) == days == {"2024-01-01"}
+
+
+def test_filter_index_positions():
+    rows = [
+        {"b": "zsk", "s": "новый", "r": [5, 5], "ts": 1704067200, "cc": 1, "p6": 0},
+        {"b": "", "s": "закрыт", "r": [6], "ts": 1704153600, "cc": 0, "p6": 1},
+    ]
+    idx = build_filter_index(rows)
+    assert idx["n"] == 2
+    assert idx["branch"] == {"zsk": [0]}
+    assert idx["rating"] == {"5": [0], "6": [1]}
+    assert idx["day"] == {"2024-01-01": [0], "2024-01-02": [1]}
+    assert (idx["has_comment"], idx["paid_6"]) == ([0], [1])
+
+
+def _join_events():
+    """Лог, где связи идут только через thread_id: события до ответа, второй ответ треда."""
+    dialogs = [
+        {"ts": 100, "user_id": 1, "role": "admin", "text": "уже смотрим", "thread_id": "t1"},
+        {"ts": 110, "user_id": 1, "user_name": "Анна", "role": "bot", "text": "ответ 1", "thread_id": "t1",
+         "meta": {"answer_id": "a1", "question": "вопрос 1", "branch": "zsk"}},
+        {"ts": 120, "user_id": 1, "role": "bot", "text": "ответ 2", "thread_id": "t1",
+         "meta": {"answer_id": "a2", "question": "вопрос 2", "branch": "zsk"}},
+        {"ts": 130, "user_id": 2, "role": "bot", "text": "ответ 3", "thread_id": "t2",
+         "meta": {"answer_id": "a3", "question": "вопрос 3", "branch": "115fz"}},
+        {"ts": 140, "user_id": 2, "role": "admin", "text": "закрыто", "thread_id": "t2"},
+    ]
+    feedback = [
+        {"ts": 105, "user_id": 1, "thread_id": "t1", "rating": 4, "comment": "до ответа"},
+        {"ts": 125, "user_id": 1, "answer_id": "a2", "rating": 5},
+        {"ts": 135, "user_id": 2, "thread_id": "t2", "rating": 2, "comment": "плохо"},
+        {"ts": 145, "user_id": 3, "thread_id": "t-unknown", "rating": 1},
+    ]
+    return dialogs, feedback
+
+
+def _threads_by_answer(agg):
+    return {t["answer_id"]: t for t in agg.build()[1]}
+
+
+def test_thread_events_join_to_first_answer():
+    dialogs, feedback = _join_events()
+    agg = DashboardAggregate()
+    for e in dialogs:
+        agg.add_dialog(e)
+    for e in feedback:
+        agg.add_feedback(e)
+    threads = _threads_by_answer(agg)
+    assert threads["a1"]["ratings"]["all"] == [4]
+    assert [c["text"] for c in threads["a1"]["comments"]] == ["до ответа"]
+    assert [a["text"] for a in threads["a1"]["admin_replies"]] == ["уже смотрим"]
+    assert threads["a1"]["user_name"] == "Анна" and threads["a1"]["status"] == "закрыт"
+    assert threads["a2"]["ratings"]["all"] == [5] and threads["a2"]["status"] == "новый"
+    assert threads["a3"]["ratings"]["all"] == [2] and threads["a3"]["status"] == "закрыт"
+    # Оценка треда без ответа ждёт в pending и в треды не попадает
+    assert list(agg.pending_feedback) == ["t-unknown"]
+
+
+@pytest.mark.parametrize("cut", range(6))
+def test_merged_chunks_match_single_pass(cut):
+    dialogs, feedback = _join_events()
+    serial = DashboardAggregate()
+    for e in dialogs:
+        serial.add_dialog(e)
+    for e in feedback:
+        serial.add_feedback(e)
+
+    # Куски dialogs сводятся merge, feedback разбирается с known_answers, как в build_dashboard.collect
+    merged = DashboardAggregate()
+    for chunk in (dialogs[:cut], dialogs[cut:]):
+        part = DashboardAggregate()
+        for e in chunk:
+            part.add_dialog(e)
+        merged.merge(part)
+    first_answers = {t: aids[0] for t, aids in merged.thread_answers.items() if aids}
+    for chunk in (feedback[:cut], feedback[cut:]):
+        part = DashboardAggregate()
+        part.known_answers = first_answers
+        for e in chunk:
+            part.add_feedback(e)
+        part.known_answers = None
+        merged.merge(part)
+    assert _threads_by_answer(merged) == _threads_by_answer(serial)
+
+
+def _sharding_agg():
+    """5 ответов в январе и 1 в феврале; у a0 и a5 есть комментарии (статус «в работе»)."""
+    agg = DashboardAggregate()
+    days = [0, 1, 2, 3, 4, 35]
+    for i, day in enumerate(days):
+        ts = 1704067200 + day * 86400
+        agg.add_dialog({"ts": ts, "user_id": i + 1, "role": "bot", "text": "ответ %d" % i, "thread_id": "t%d" % i,
+                        "meta": {"answer_id": "a%d" % i, "question": "вопрос %d" % i,
+                                 "branch": "zsk" if i % 2 else "115fz"}})
+        agg.add_feedback({"ts": ts + 60, "user_id": i + 1, "answer_id": "a%d" % i, "rating": 6 if i == 3 else 4,
+                          "comment": "комментарий %d" % i if i in (0, 5) else ""})
+    return agg
+
+
+def test_shards_split_by_month_status_and_page():
+    stats, threads = _sharding_agg().build()
+    shards, pages, rows = shard_threads(threads, page_size=2)
+    assert [(s["file"], s["count"]) for s in shards] == [
+        ("threads/2024-02/work-0001.json", 1),
+        ("threads/2024-01/new-0001.json", 2),
+        ("threads/2024-01/new-0002.json", 2),
+        ("threads/2024-01/work-0001.json", 1),
+    ]
+    # строка индекса указывает на страницу со своим тредом, порядок строк — порядок тредов
+    assert [r["id"] for r in rows] == [t["answer_id"] for t in threads]
+    for r in rows:
+        assert r["id"] in [t["answer_id"] for t in pages[r["sh"]]]
+    assert {r["id"]: r["q"] for r in rows}["a2"] == "вопрос 2"
+
+
+def test_payload_filters_point_at_index_rows():
+    stats, threads = _sharding_agg().build()
+    payloads = build_payloads(stats, threads, page_size=2)
+    rows = payloads["index.json"]["rows"]
+    filters = payloads["filters.json"]
+    assert filters["n"] == len(rows) == 6
+    for branch, positions in filters["branch"].items():
+        assert positions == [i for i, r in enumerate(rows) if r["b"] == branch]
+    assert sorted(filters["status"]) == ["в работе", "новый"]
+    assert [rows[i]["id"] for i in filters["has_comment"]] == ["a5", "a0"]
+    assert [rows[i]["id"] for i in filters["paid_6"]] == ["a3"]
+    assert [rows[i]["id"] for i in filters["rating"]["6"]] == ["a3"]
+    summary = payloads["summary.json"]
+    assert summary["page_size"] == 2
+    assert sorted(s["file"] for s in summary["shards"]) == sorted(p for p in payloads if p.startswith("threads/"))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты event_codec.py: кодирование событий туда и обратно, словари, файлы .evb и битые кадры."""
+
+import json
+import sys
+
+import pytest
+
+from event_codec import (FORMAT_VERSION, MAGIC, BinaryEventLog, CodecError, CodecState, Decoder, Encoder,
+                         iter_evb_events, read_evb)
+
+EVENTS = [
+    {"ts": 1700000000, "user_id": 5, "chat_id": -100, "role": "user", "text": "Банк заблокировал счёт",
+     "thread_id": "t1", "user_name": "Иван"},
+    {"ts": 1700000001.5, "user_id": 5, "role": "bot", "text": "Ответ", "thread_id": "t1",
+     "meta": {"question": "Банк заблокировал счёт", "answer_id": "a1", "branch": "115fz", "rag_used": True,
+              "scores": [1.5, 0.25], "faq_id": None}},
+    {"ts": 1700000002, "user_id": 5, "answer_id": "a1", "rating": 5, "comment": "спасибо", "branch": "115fz"},
+    {"ts": 1700000003, "user_id": 6, "role": "admin", "text": "x", "delta": -42, "status": "sent"},
+]
+
+
+def _decode(data, text=True):
+    return [e for e, _ in Decoder(text=text).feed(data)]
+
+
+def test_round_trip():
+    enc = Encoder()
+    data = b"".join(enc.encode(e) for e in EVENTS)
+    assert _decode(data) == EVENTS
+    assert _decode(Encoder().encode_block(EVENTS)) == EVENTS
+
+
+def test_only_low_cardinality_fields_interned():
+    state = CodecState()
+    enc = Encoder(state)
+    for i in range(50):
+        enc.encode({"role": "user", "thread_id": "t%d" % i, "answer_id": "a%d" % i, "branch": "zsk",
+                    "status": "ok", "user_name": "u%d" % i})
+    assert sorted(state.vals) == ["ok", "user", "zsk"]
+
+
+def test_text_fields_skipped_without_text():
+    events = _decode(Encoder().encode_block(EVENTS), text=False)
+    assert events[0]["text"] is None and events[0]["thread_id"] == "t1"
+    assert events[2]["comment"] is None and events[2]["rating"] == 5
+
+
+def test_binary_log_resumes_file_and_drops_broken_tail(tmp_path):
+    out = str(tmp_path / "evb")
+    log = BinaryEventLog(out)
+    log.on_events("/x/dialogs.jsonl", EVENTS[:2], 1, [0, 10])
+    log.close()
+    path = next((tmp_path / "evb").iterdir())
+    with open(str(path), "ab") as f:
+        f.write(b"\x7f\x04broken")
+    log = BinaryEventLog(out)
+    log.on_events("/x/dialogs.jsonl", EVENTS[2:], 1, [20, 30])
+    log.close()
+    assert open(str(path), "rb").read(4) == MAGIC
+    assert list(iter_evb_events(str(path))) == EVENTS
+    assert read_evb(str(path))[2] == path.stat().st_size
+
+
+def _damaged_evb(path):
+    """Файл .evb: целый блок, затем блок правильной длины с испорченным zlib."""
+    with open(path, "wb") as f:
+        f.write(MAGIC + bytes([FORMAT_VERSION]))
+        f.write(Encoder().encode_block(EVENTS[:2]))
+        f.write(b"\x05\x04xxxx")
+    return path
+
+
+def test_corrupt_block_raises_codec_error_after_good_events(tmp_path):
+    path = _damaged_evb(str(tmp_path / "dialogs-20240101.evb"))
+    got = []
+    with pytest.raises(CodecError) as err:
+        for event in iter_evb_events(path):
+            got.append(event)
+    assert got == EVENTS[:2]
+    assert path in str(err.value) and "corrupt block" in str(err.value)
+    with pytest.raises(CodecError):
+        read_evb(path)
+
+
+def test_export_reports_damaged_segment_and_keeps_going(tmp_path, monkeypatch, capsys):
+    import export_events
+    bad = _damaged_evb(str(tmp_path / "dialogs-20240101.evb"))
+    good = str(tmp_path / "dialogs-20240102.evb")
+    with open(good, "wb") as f:
+        f.write(MAGIC + bytes([FORMAT_VERSION]) + Encoder().encode_block(EVENTS[2:]))
+    out = str(tmp_path / "export.jsonl")
+    monkeypatch.setattr(sys, "argv", ["export_events.py", bad, good, "-o", out])
+    assert export_events.main() == 1
+    with open(out, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == EVENTS
+    assert "Damaged segment: %s" % bad in capsys.readouterr().err
+
+
+def test_binary_log_sets_aside_file_with_corrupt_block(tmp_path):
+    out = tmp_path / "evb"
+    log = BinaryEventLog(str(out))
+    log.on_events("/x/dialogs.jsonl", EVENTS[:2], 1, [0, 10])
+    log.close()
+    path = next(out.iterdir())
+    with open(str(path), "ab") as f:
+        f.write(b"\x05\x04xxxx")
+    log = BinaryEventLog(str(out))
+    log.on_events("/x/dialogs.jsonl", EVENTS[2:], 1, [20, 30])
+    log.close()
+    assert list(iter_evb_events(str(path))) == EVENTS[2:]
+    assert [p.name for p in out.iterdir() if ".damaged-" in p.name]
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты event_log.py: ротация, номера сегментов, позиции строк, EventWriter,
+разбиение лога на куски и parallel_map."""
+
+import os
+import time
+import threading
+
+import pytest
+
+from event_log import (EventWriter, append_line, encode_event, iter_log_events, iter_log_records, iter_range_events,
+                       load_manifest, log_archive_dir, parallel_map, recover_rotation, rotate_log, save_manifest,
+                       split_line_ranges)
+
+
+def test_rotation_assigns_increasing_seq(tmp_path, append_jsonl):
+    path = str(tmp_path / "dialogs.jsonl")
+    for i in range(3):
+        append_jsonl(path, {"ts": 1700000000 + i, "n": i})
+        entry = rotate_log(path)
+        assert entry["seq"] == i + 1
+    manifest = load_manifest(log_archive_dir(path))
+    assert [e["seq"] for e in manifest["segments"]] == [1, 2, 3]
+    assert manifest["next_seq"] == 4
+    assert [e["n"] for e in iter_log_events(path)] == [0, 1, 2]
+
+
+def test_record_positions_survive_rotation(tmp_path, append_jsonl):
+    """(seq, offset) строки одинаковы до и после ротации и не повторяются между сегментами."""
+    path = str(tmp_path / "feedback.jsonl")
+    append_jsonl(path, {"ts": 1, "n": 0}, {"ts": 2, "n": 1})
+    before = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path)}
+    rotate_log(path)
+    append_jsonl(path, {"ts": 3, "n": 2}, {"ts": 4, "n": 3})
+    rotate_log(path)
+    append_jsonl(path, {"ts": 5, "n": 4})
+    after = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path)}
+    assert after[0] == before[0] and after[1] == before[1]
+    assert len(set(after.values())) == 5
+    assert after[4][0] == 3  # активный файл — next_seq
+
+
+def test_legacy_manifest_gets_seq(tmp_path, append_jsonl):
+    path = str(tmp_path / "dialogs.jsonl")
+    append_jsonl(path, {"ts": 1})
+    rotate_log(path)
+    archive_dir = log_archive_dir(path)
+    manifest = load_manifest(archive_dir)
+    for e in manifest["segments"]:
+        e.pop("seq")
+    manifest.pop("next_seq")
+    save_manifest(archive_dir, manifest)
+    assert load_manifest(archive_dir)["segments"][0]["seq"] == 1
+    append_jsonl(path, {"ts": 2})
+    assert rotate_log(path)["seq"] == 2
+
+
+def test_interrupted_rotation_recovered_before_new_writes(tmp_path, append_jsonl):
+    path = str(tmp_path / "dialogs.jsonl")
+    append_jsonl(path, {"ts": 1, "n": 0})
+    os.replace(path, path + ".rotating")  # падение между rename и сжатием
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=0)
+    got = []
+    writer.add_listener(lambda p, events, seq, offsets: got.append((seq, offsets)))
+    writer.start()
+    writer.write(path, {"ts": 2, "n": 1})
+    writer.flush()
+    writer.close()
+    assert not os.path.exists(path + ".rotating")
+    assert got == [(2, [0])]
+    assert [(e["n"], seq) for e, seq, _ in iter_log_records(path)] == [(0, 1), (1, 2)]
+    assert recover_rotation(path) is None
+
+
+def test_writer_listener_positions_match_reader(tmp_path):
+    """Позиции, которые писатель сообщает слушателям, совпадают с iter_log_records после ротаций."""
+    path = str(tmp_path / "feedback.jsonl")
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=60)
+    seen = {}
+
+    def listener(p, events, seq, offsets):
+        for e, off in zip(events, offsets):
+            seen[e["n"]] = (seq, off)
+
+    writer.add_listener(listener)
+    writer.start()
+    for i in range(6):
+        writer.write(path, {"ts": 1700000000 + i, "n": i, "comment": "c%d" % i})
+        writer.flush()
+    writer.close()
+    records = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path)}
+    assert records == seen
+    assert len(load_manifest(log_archive_dir(path))["segments"]) >= 2
+
+
+def test_removed_listener_gets_no_batches(tmp_path):
+    path = str(tmp_path / "dialogs.jsonl")
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=0)
+    got = []
+
+    def listener(p, events, seq, offsets):
+        got.extend(events)
+
+    writer.add_listener(listener)
+    writer.start()
+    writer.write(path, {"ts": 1, "n": 0})
+    writer.flush()
+    writer.remove_listener(listener)
+    writer.write(path, {"ts": 2, "n": 1})
+    writer.flush()
+    writer.close()
+    assert [e["n"] for e in got] == [0]
+
+
+def test_full_queue_drops_event_without_blocking(tmp_path):
+    path = str(tmp_path / "feedback.jsonl")
+    writer = EventWriter(flush_interval=0.05, fsync=False, max_queue=1, rotate_daily=False, rotate_max_bytes=0)
+    assert writer.write(path, {"ts": 1, "n": 0})
+    started = time.time()
+    assert not writer.write(path, {"ts": 2, "n": 1})  # очередь полна, поток ещё не запущен
+    assert time.time() - started < 0.1
+    assert writer.stats()["dropped"] == 1
+    writer.start()
+    writer.flush()
+    writer.close()
+    assert [e["n"] for e in iter_log_events(path)] == [0]
+
+
+def test_rotation_compresses_in_background(tmp_path, monkeypatch):
+    """Пока фоновый поток сжимает .rotating, писатель пишет дальше, а позиции верны."""
+    import event_log
+    path = str(tmp_path / "feedback.jsonl")
+    gate = threading.Event()
+    archive = event_log._archive_file
+
+    def slow_archive(*args):
+        gate.wait(5)
+        return archive(*args)
+
+    monkeypatch.setattr(event_log, "_archive_file", slow_archive)
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=60)
+    seen = {}
+
+    def listener(p, events, seq, offsets):
+        for e, off in zip(events, offsets):
+            seen[e["n"]] = (seq, off)
+
+    writer.add_listener(listener)
+    writer.start()
+    for i in range(3):
+        writer.write(path, {"ts": 1700000000 + i, "n": i, "comment": "c%d" % i})
+        assert writer.flush()
+    assert os.path.exists(path + ".rotating")
+    during = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path)}
+    assert [e["n"] for e in iter_log_events(path)] == [0, 1, 2]
+    gate.set()
+    writer.close()
+    assert not os.path.exists(path + ".rotating")
+    records = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path)}
+    assert records == seen == during
+
+
+def test_listener_offsets_exact_with_concurrent_external_appends(tmp_path):
+    """Строки другого процесса (send_outbox.py) между пачками не сбивают смещения писателя."""
+    path = str(tmp_path / "dialogs.jsonl")
+    writer = EventWriter(flush_interval=0.01, fsync=False, rotate_daily=False, rotate_max_bytes=0)
+    seen = {}
+
+    def listener(p, events, seq, offsets):
+        for e, off in zip(events, offsets):
+            seen[e["n"]] = (seq, off)
+
+    writer.add_listener(listener)
+    writer.start()
+    outbox = threading.Thread(target=lambda: [append_line(path, encode_event({"ts": 1, "outbox": i}))
+                                              for i in range(300)])
+    outbox.start()
+    for i in range(300):
+        writer.write(path, {"ts": 2, "n": i})
+    outbox.join()
+    writer.close()
+    records = {e["n"]: (seq, off) for e, seq, off in iter_log_records(path) if "n" in e}
+    assert records == seen and len(seen) == 300
+    assert sum(1 for e in iter_log_events(path) if "outbox" in e) == 300
+
+
+def _chunk_log(tmp_path, append_jsonl):
+    """Строки разной длины (кириллица — многобайтные) и недописанный хвост."""
+    path = str(tmp_path / "dialogs.jsonl")
+    append_jsonl(path, *({"n": i, "text": "ы" * (i * 7 % 23)} for i in range(40)))
+    with open(path, "ab") as f:
+        f.write('{"n": 40, "text": "недопис'.encode("utf-8"))
+    return path
+
+
+@pytest.mark.parametrize("chunk", [1, 17, 64, 500, 10 ** 6])
+def test_split_line_ranges_align_to_line_starts(tmp_path, append_jsonl, chunk):
+    path = _chunk_log(tmp_path, append_jsonl)
+    with open(path, "rb") as f:
+        data = f.read()
+    full_end = data.rfind(b"\n") + 1
+    ranges = split_line_ranges(path, chunk)
+    assert ranges[0][0] == 0 and ranges[-1][1] == full_end
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert start < end and data[end - 1:end] == b"\n"
+    events = [e["n"] for start, end in ranges for e in iter_range_events(path, start, end)]
+    assert events == list(range(40))
+
+
+def test_split_line_ranges_stop_at_given_end(tmp_path, append_jsonl):
+    path = _chunk_log(tmp_path, append_jsonl)
+    end = split_line_ranges(path, 10 ** 6)[0][1] // 2
+    ranges = split_line_ranges(path, 50, end=end)
+    assert ranges[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def _numbers(path, start, end):
+    return [e["n"] for e in iter_range_events(path, start, end)]
+
+
+def _offset_numbers(path, start, end):
+    return [_base + n for n in _numbers(path, start, end)]
+
+
+_base = 0
+
+
+def _set_base(base):
+    global _base
+    _base = base
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parallel_map_matches_serial_order(tmp_path, append_jsonl, workers):
+    path = _chunk_log(tmp_path, append_jsonl)
+    tasks = [(path, start, end) for start, end in split_line_ranges(path, 64)]
+    serial = [_numbers(*t) for t in tasks]
+    # initializer выполняется в каждом процессе пула (при workers=1 — в текущем)
+    try:
+        got = list(parallel_map(_offset_numbers, tasks, workers, initializer=_set_base, initargs=(1000,)))
+    finally:
+        _set_base(0)
+    assert got == [[1000 + n for n in part] for part in serial]
+    assert [n for part in got for n in part] == [1000 + n for n in range(40)]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты faq.py: основы слов, сходство и выдача одобренных интентов."""
+
+import json
+
+from faq import FaqMatcher, faq_terms, jaccard
+
+
+def _write(path, intents):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"intents": intents}, f, ensure_ascii=False)
+
+
+def test_faq_terms_ignore_case_stop_words_and_endings():
+    assert faq_terms("Подскажите, как разблокировать счёт?") == faq_terms("разблокировали счет")
+    assert faq_terms("что это") == frozenset()
+    assert jaccard(faq_terms("счет заблокирован банком"), faq_terms("банк заблокировал счет")) == 0.5
+    assert jaccard(frozenset(), faq_terms("счет")) == 0.0
+
+
+def test_matcher_returns_only_approved_intents(tmp_path):
+    path = str(tmp_path / "faq_answers.json")
+    _write(path, [
+        {"id": "115fz-1", "branch": "115fz", "questions": ["как разблокировать счет"], "answer": "Ответ", "approved": True},
+        {"id": "115fz-2", "branch": "115fz", "questions": ["что такое мвк"], "answer": "МВК", "approved": False},
+    ])
+    m = FaqMatcher(path, min_score=0.75)
+    assert len(m) == 1
+    intent, score = m.match("Как разблокировать счёт?", branch="115fz")
+    assert intent["id"] == "115fz-1" and score == 1.0
+    assert m.match("как разблокировать счет", branch="zsk")[0] is None
+    assert m.match("что такое мвк")[0] is None
+    assert m.stats() == {"intents": 1, "hits": 1, "misses": 2}
+
+
+def test_matcher_reloads_changed_file(tmp_path):
+    path = str(tmp_path / "faq_answers.json")
+    m = FaqMatcher(path)
+    assert len(m) == 0
+    _write(path, [{"id": "a", "questions": ["налоговая блокировка счета"], "answer": "x", "approved": True}])
+    m._checked = 0
+    m.RELOAD_CHECK_SEC = 0
+    assert m.match("блокировка счета налоговая")[0]["id"] == "a"
+
+
+def test_counters_are_exact_under_concurrent_matches(tmp_path):
+    import threading
+    path = str(tmp_path / "faq_answers.json")
+    _write(path, [{"id": "a", "questions": ["как разблокировать счет"], "answer": "Ответ", "approved": True}])
+    m = FaqMatcher(path)
+
+    def worker():
+        for i in range(500):
+            m.match("как разблокировать счет" if i % 2 else "что такое мвк")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert m.stats() == {"intents": 1, "hits": 2000, "misses": 2000}
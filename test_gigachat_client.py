@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты gigachat_client.py на mock GigaChat: общий OAuth-запрос, повтор после 401,
+разбор SSE и общий срок потокового ответа."""
+
+import json
+import threading
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from gigachat_client import GigaChatClient, iter_sse_deltas
+
+
+def _client(server):
+    return GigaChatClient("mock", oauth_url=server.url + "/api/v2/oauth", api_base=server.url, timeout=5)
+
+
+def test_concurrent_calls_with_expired_token_share_one_oauth_request(mock_gigachat):
+    server = mock_gigachat("--answer-words", "3")
+    client = _client(server)
+    client._set_token("expired", 0)
+    start = threading.Barrier(8)
+    answers = []
+
+    def call():
+        start.wait()
+        answers.append(client.chat("system", "вопрос"))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    client.close()
+    assert len(answers) == 8 and all(answers)
+    assert server.state.counters["oauth"] == 1
+    assert server.state.counters["completions"] == 8
+
+
+def test_unauthorized_refreshes_token_once_and_retries_once(mock_gigachat):
+    server = mock_gigachat()
+    client = _client(server)
+    # Токен живой по часам клиента, но сервер его не знает (отозван)
+    client._set_token("revoked", 2 ** 31)
+    assert client.chat("system", "вопрос")
+    client.close()
+    counters = server.state.counters
+    assert (counters["oauth"], counters["completions"], counters["unauthorized"]) == (1, 2, 1)
+
+
+def _sse(*contents):
+    return [b"data: " + json.dumps({"choices": [{"delta": {"content": c}}]}, ensure_ascii=False).encode("utf-8")
+            for c in contents]
+
+
+def test_sse_deltas_skip_non_data_lines_and_stop_at_done():
+    lines = [b": keep-alive", b"event: message", b"id: 1"] + _sse("При", "вет") + [b""]
+    lines += [b'data: {"choices": [{"delta": {"role": "assistant"}}, {"delta": {"content": "!"}}]}']
+    lines += [b"data: [DONE]"] + _sse("после конца")
+    assert list(iter_sse_deltas(lines)) == ["При", "вет", "!"]
+
+
+def test_sse_deltas_raise_after_deadline():
+    gen = iter_sse_deltas(iter(_sse("a", "b")), deadline=time.time() - 1)
+    with pytest.raises(requests.exceptions.Timeout):
+        next(gen)
+
+
+def test_chat_stream_joins_mock_chunks(mock_gigachat):
+    server = mock_gigachat("--answer-words", "12", "--chunks", "4")
+    client = _client(server)
+    parts = list(client.chat_stream("system", "вопрос"))
+    client.close()
+    assert len(parts) == 4
+    assert "".join(parts).endswith(".")
+
+
+def test_chat_stream_deadline_covers_whole_generation(mock_gigachat):
+    # Каждый фрагмент приходит быстрее таймаута чтения, но весь поток — дольше срока
+    server = mock_gigachat("--answer-words", "20", "--chunks", "20", "--chunk-ms", "100")
+    client = _client(server)
+    started = time.time()
+    parts = []
+    with pytest.raises(requests.exceptions.Timeout):
+        for delta in client.chat_stream("system", "вопрос", timeout=0.5):
+            parts.append(delta)
+    client.close()
+    assert time.time() - started < 1.5
+    assert 0 < len(parts) < 20
+
+
+def test_sequential_calls_reuse_one_pooled_connection(mock_gigachat):
+    server = mock_gigachat()
+    client = GigaChatClient("mock", oauth_url=server.url + "/api/v2/oauth", api_base=server.url, timeout=5,
+                            pool_size=4)
+    adapter = client.session.get_adapter(server.url)
+    assert adapter._pool_maxsize == 4 and adapter.max_retries.total == 0
+    for _ in range(3):
+        assert client.chat("system", "вопрос")
+    assert "".join(client.chat_stream("system", "вопрос"))
+    # OAuth и 4 запроса completions — через одно keep-alive соединение
+    pools = adapter.poolmanager.pools
+    assert [pools[key].num_connections for key in pools.keys()] == [1]
+    assert server.state.counters["oauth"] == 1
+    client.close()
+
+
+def test_close_stops_refresher_and_drops_pool(mock_gigachat):
+    server = mock_gigachat()
+    client = _client(server)
+    client.start_refresher(margin=60)
+    deadline = time.time() + 5
+    while not client.token_valid() and time.time() < deadline:
+        time.sleep(0.02)
+    assert client.token_valid()
+    refresher = client._refresher
+    adapter = client.session.get_adapter(server.url)
+    assert len(adapter.poolmanager.pools) == 1
+    client.close()
+    assert client._refresher is None and not refresher.is_alive()
+    assert len(adapter.poolmanager.pools) == 0
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты live_dashboard.py: запуск сервера и доступ по токену ко всем адресам."""
+
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from live_dashboard import LiveDashboard, is_loopback
+
+
+def test_is_loopback():
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0")
+    assert not is_loopback("10.0.0.5")
+
+
+def _live(tmp_path, token=""):
+    return LiveDashboard(str(tmp_path), str(tmp_path / "dialogs.jsonl"), str(tmp_path / "feedback.jsonl"),
+                         token=token)
+
+
+def test_token_is_required_on_any_host(tmp_path):
+    with pytest.raises(ValueError):
+        _live(tmp_path)
+
+
+@pytest.fixture
+def live(tmp_path):
+    (tmp_path / "index.html").write_text("<html></html>", encoding="utf-8")
+    with open(str(tmp_path / "dialogs.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": 1704067200, "user_id": 1, "role": "bot", "text": "секретный ответ",
+                            "thread_id": "t1", "meta": {"answer_id": "a1", "question": "вопрос"}},
+                           ensure_ascii=False) + "\n")
+    live = _live(tmp_path, token="s3cret")
+    live.start("127.0.0.1", 0)
+    deadline = time.time() + 5
+    while not live.ready and time.time() < deadline:
+        time.sleep(0.02)
+    live.url = "http://127.0.0.1:%d" % live._server.server_address[1]
+    yield live
+    live.stop()
+
+
+def _get(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=5) as r:
+            return r.status, r.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8")
+
+
+@pytest.mark.parametrize("path", ["/", "/data/summary.json", "/data/index.json", "/api/events"])
+def test_every_get_needs_token_even_on_loopback(live, path):
+    assert _get(live.url + path)[0] == 403
+    assert _get(live.url + path + "?token=wrong")[0] == 403
+
+
+def test_token_opens_dialog_pages(live):
+    status, body = _get(live.url + "/data/summary.json?token=s3cret")
+    assert status == 200
+    shard = json.loads(body)["shards"][0]["file"]
+    status, body = _get(live.url + "/data/" + shard, headers={"X-Dash-Token": "s3cret"})
+    assert status == 200 and "секретный ответ" in body
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты llm_cache.py: ключи, TTL и вытеснение по размеру (LRU)."""
+
+import time
+
+from llm_cache import LLMCache, make_key
+
+
+def test_key_ignores_case_and_spaces_but_not_kb_version():
+    assert make_key("m", "sys", "Банк  заблокировал\nсчёт") == make_key("m", "sys", "банк заблокировал счёт")
+    assert make_key("m", "sys", "q", "kb1") != make_key("m", "sys", "q", "kb2")
+    assert make_key("light", "sys", "q") != make_key("strong", "sys", "q")
+
+
+def test_ttl_expires_entries(tmp_path, monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.put("k", "m", "answer")
+    assert cache.get("k") == "answer"
+    now[0] += 61
+    assert cache.get("k") is None
+    st = cache.stats()
+    assert (st["hits"], st["misses"], st["expired"], st["entries"], st["bytes"]) == (1, 1, 1, 0, 0)
+    cache.close()
+
+
+def test_lru_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), ttl=0, max_bytes=350)
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.put(key, "m", "x" * 100)
+    now[0] += 1
+    assert cache.get("a")  # "a" использован недавно, вытесняется "b"
+    now[0] += 1
+    cache.put("d", "m", "y" * 100)
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c") and cache.get("d")
+    st = cache.stats()
+    assert st["evicted"] == 1 and st["bytes"] == 300
+    cache.close()
+
+
+def test_size_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMCache(path)
+    cache.put("k", "m", "ответ")
+    cache.put("k", "m", "ответ 2")
+    cache.close()
+    cache = LLMCache(path)
+    assert cache.stats()["bytes"] == len("ответ 2".encode("utf-8"))
+    assert cache.get("k") == "ответ 2"
+    cache.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты llm_executor.py: ограничение очереди, счётчики и ошибки задач."""
+
+import threading
+
+from llm_executor import LLMExecutor
+
+
+def test_rejects_when_workers_and_queue_are_busy():
+    ex = LLMExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    running = threading.Event()
+
+    def task():
+        running.set()
+        release.wait(5)
+        return "ok"
+
+    first = ex.submit(task)
+    running.wait(5)
+    second = ex.submit(task)
+    assert ex.submit(task) is None
+    assert ex.stats()["running"] == 1 and ex.stats()["queued"] == 1
+    release.set()
+    assert first.result(5) == "ok" and second.result(5) == "ok"
+    st = ex.stats()
+    assert (st["completed"], st["rejected"], st["running"], st["queued"]) == (2, 1, 0, 0)
+    # Места освободились
+    assert ex.submit(lambda: 1).result(5) == 1
+    ex.shutdown()
+
+
+def test_failed_task_is_counted_and_frees_slot():
+    ex = LLMExecutor(max_workers=1, max_queue=0)
+
+    def fail():
+        raise ValueError("boom")
+
+    assert ex.submit(fail).result(5) is None
+    assert ex.stats()["failed"] == 1
+    assert ex.submit(lambda: 2).result(5) == 2
+    ex.shutdown()
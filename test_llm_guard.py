@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты llm_guard.py: автоматы по моделям, token bucket и лимиты вызовов LLM, склейка запросов."""
+
+import threading
+import time
+
+from llm_guard import CLOSED, HALF_OPEN, OPEN, BreakerPool, CircuitBreaker, InFlight, RateLimiter, TokenBucket
+
+
+def test_token_bucket_refill_and_give_back():
+    b = TokenBucket(rate=1.0, capacity=2, now=0.0)
+    assert b.take(0.0) and b.take(0.0)
+    assert not b.take(0.0)
+    assert b.wait_time(0.5) == 0.5
+    assert b.take(1.0)
+    b.give_back()
+    assert b.take(1.0)
+    assert b.full(10.0) and b.tokens == 2.0
+
+
+def test_rate_limiter_user_and_global_limits():
+    lim = RateLimiter(global_rate=0.001, global_burst=3, user_rate=0.001, user_burst=2, max_wait=0)
+    assert lim.acquire(1) is None and lim.acquire(1) is None
+    assert lim.acquire(1) == "user"
+    assert lim.acquire(2) is None
+    # Общее ведро пусто: токен пользователя 3 возвращается
+    assert lim.acquire(3) == "global"
+    assert lim._users[3].tokens == 2.0
+    st = lim.stats()
+    assert (st["allowed"], st["user_limited"], st["global_limited"]) == (3, 1, 1)
+
+
+def test_rate_limiter_release_returns_tokens():
+    lim = RateLimiter(global_rate=0.001, global_burst=1, user_rate=0.001, user_burst=1, max_wait=0)
+    assert lim.acquire(1) is None
+    lim.release(1)
+    assert lim.acquire(1) is None
+    assert lim.stats()["allowed"] == 1
+
+
+def test_breaker_opens_on_error_rate_and_recovers_after_probe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    br = CircuitBreaker(window=60, min_calls=4, error_rate=0.5, cooldown=30)
+    for ok in (True, False, True):
+        assert br.allow()
+        br.record(ok, 1.0)
+    assert br.state == CLOSED  # вызовов меньше min_calls
+    br.allow()
+    br.record(False)
+    assert br.state == OPEN and br.stats()["opened"] == 1
+    assert not br.allow() and br.stats()["rejected"] == 1
+    assert br.stats()["retry_in"] == 30
+    now[0] += 30
+    assert br.allow() and br.state == HALF_OPEN
+    br.record(False)
+    assert br.state == OPEN and br.stats()["opened"] == 2
+    now[0] += 30
+    assert br.allow()
+    br.record(True, 1.0)
+    assert br.state == CLOSED and br.stats()["calls"] == 0
+
+
+def test_breaker_forgets_errors_outside_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    br = CircuitBreaker(window=60, min_calls=2, error_rate=0.5)
+    br.allow()
+    br.record(False)
+    now[0] += 61
+    br.allow()
+    br.record(True, 1.0)
+    assert br.state == CLOSED and br.stats()["errors"] == 0
+
+
+def test_breaker_timeout_follows_p95():
+    br = CircuitBreaker(min_timeout=2, max_timeout=60, timeout_factor=1.5, min_samples=20)
+    for _ in range(19):
+        br.record(True, 4.0)
+    assert br.timeout() == 60  # замеров мало
+    br.record(True, 4.0)
+    assert br.timeout() == 6.0
+    for _ in range(200):
+        br.record(True, 0.1)
+    assert br.timeout() == 2
+
+
+def test_breaker_cancel_frees_half_open_probe():
+    br = CircuitBreaker(min_calls=1, cooldown=0)
+    assert br.allow()
+    br.record(False)
+    assert br.state == OPEN
+    assert br.allow() and br.state == HALF_OPEN
+    assert not br.allow()
+    br.cancel()
+    assert br.allow()
+    br.record(True, 0.1)
+    assert br.state == CLOSED
+
+
+def test_breaker_stream_latencies_give_separate_timeout():
+    br = CircuitBreaker(min_timeout=1, max_timeout=60, timeout_factor=1.5, min_samples=3)
+    for _ in range(3):
+        br.record(True, 2.0)
+        br.record(True, 20.0, stream=True)
+    assert br.timeout() == 3.0
+    assert br.timeout(stream=True) == 30.0
+    st = br.stats()
+    assert (st["p95"], st["stream_p95"]) == (2.0, 20.0)
+
+
+def test_breaker_pool_keeps_state_per_key():
+    pool = BreakerPool("gigachat", min_calls=1, cooldown=60, min_samples=1, max_timeout=60)
+    light, strong = pool.get("light"), pool.get("strong")
+    assert pool.get("light") is light
+    light.allow()
+    light.record(False)
+    strong.allow()
+    strong.record(True, 2.0)
+    assert not light.allow() and strong.allow()
+    st = pool.stats()
+    assert st["light"]["state"] == OPEN and st["strong"]["state"] == CLOSED
+    assert st["strong"]["timeout"] == 10 and st["light"]["timeout"] == 60
+
+
+def test_inflight_coalesces_identical_requests():
+    inflight = InFlight()
+    flight, leader = inflight.begin("k")
+    assert leader
+    assert inflight.join("k") is flight
+    assert inflight.begin("k") == (flight, False)
+    inflight.finish("k", flight, ("answer", None))
+    assert inflight.wait(flight, 1) == ("answer", None)
+    assert inflight.join("k") is None
+    st = inflight.stats()
+    assert (st["leaders"], st["coalesced"], st["in_flight"]) == (1, 2, 0)
+
+
+def test_inflight_broadcast_does_not_block_leader():
+    inflight = InFlight(notify_workers=2)
+    release = threading.Event()
+    seen = []
+
+    def slow(text):
+        release.wait(5)
+        seen.append(text)
+
+    flight, _ = inflight.begin("k", slow)
+    started = time.time()
+    for text in ("a", "ab", "abc", "abcd"):
+        flight.broadcast(text)
+    assert time.time() - started < 1
+    release.set()
+    deadline = time.time() + 5
+    while (not seen or seen[-1] != "abcd") and time.time() < deadline:
+        time.sleep(0.01)
+    # Пока первая правка висела, промежуточные фрагменты схлопнулись до последнего
+    assert seen == ["a", "abcd"]
+    inflight.finish("k", flight, ("abcd", None))
+
+
+def test_inflight_timed_out_waiter_stops_receiving_text():
+    inflight = InFlight(notify_workers=0)
+    flight, _ = inflight.begin("k")
+    got = []
+    assert inflight.join("k", got.append) is flight
+    flight.broadcast("a")
+    assert inflight.wait(flight, 0.01, got.append) is None
+    flight.broadcast("ab")
+    inflight.finish("k", flight, ("abc", None))
+    flight.broadcast("abc")
+    assert got == ["a"]
+    assert inflight.stats()["timeouts"] == 1
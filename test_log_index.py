@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты log_index.py: комментарии и отметки о прочтении при ротации, пересборка, миграция схемы."""
+
+import json
+import sqlite3
+
+from event_log import EventWriter
+from log_index import LogIndex, SCHEMA_VERSION
+
+
+def _comment(i):
+    return {"ts": "2024-01-0%dT10:00:00Z" % (i % 9 + 1), "user_id": 100 + i, "chat_id": 100 + i,
+            "thread_id": "t%d" % i, "answer_id": "a%d" % i, "rating": 5, "comment": "comment %d" % i}
+
+
+def _write_rotating(tmp_path, idx, events):
+    """Пишет события через EventWriter с ротацией по размеру почти на каждой пачке."""
+    path = str(tmp_path / "feedback.jsonl")
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=100)
+    writer.add_listener(idx.on_events)
+    writer.start()
+    for e in events:
+        writer.write(path, e)
+        writer.flush()
+    writer.close()
+    return path
+
+
+def _texts(idx, admin_id=1):
+    return sorted(c["comment"] for c in idx.list_comments(admin_id, limit=100))
+
+
+def test_comments_survive_rotation_and_rebuild(tmp_path):
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = _write_rotating(tmp_path, idx, [_comment(i) for i in range(5)])
+    expected = ["comment %d" % i for i in range(5)]
+    assert _texts(idx) == expected
+    idx.rebuild(str(tmp_path / "dialogs.jsonl"), path)
+    assert _texts(idx) == expected
+    idx.close()
+
+
+def test_read_marks_stay_on_their_comment(tmp_path):
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = _write_rotating(tmp_path, idx, [_comment(i) for i in range(3)])
+    idx.mark_read(1, [c for c in idx.list_comments(1, limit=100) if c["comment"] == "comment 0"])
+    _write_rotating(tmp_path, idx, [_comment(i) for i in range(3, 6)])
+    unread = [c["comment"] for c in idx.list_comments(1, limit=100) if not c["is_read"]]
+    assert sorted(unread) == ["comment %d" % i for i in range(1, 6)]
+    assert idx.unread_count(1) == 5 and idx.unread_count(2) == 6
+    idx.rebuild(str(tmp_path / "dialogs.jsonl"), path)
+    assert idx.unread_count(1) == 5
+    idx.close()
+
+
+def test_inode_schema_migrated_with_read_marks(tmp_path):
+    db = str(tmp_path / "index.sqlite3")
+    path = str(tmp_path / "feedback.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(2):
+            f.write(json.dumps(_comment(i)) + "\n")
+    legacy = sqlite3.connect(db)
+    legacy.executescript("""
+        CREATE TABLE comments (ts INTEGER, user_id INTEGER, chat_id INTEGER, thread_id TEXT, answer_id TEXT,
+            branch TEXT, rating INTEGER, comment TEXT, log_inode INTEGER, log_offset INTEGER,
+            PRIMARY KEY (log_inode, log_offset));
+        CREATE TABLE comment_reads (admin_id INTEGER, log_inode INTEGER, log_offset INTEGER,
+            PRIMARY KEY (admin_id, log_inode, log_offset));
+        PRAGMA user_version = 3;
+    """)
+    c = _comment(1)
+    legacy.execute("INSERT INTO comments (ts, user_id, comment, log_inode, log_offset) VALUES (?, ?, ?, 77, 500)",
+                   (1704189600, c["user_id"], c["comment"]))
+    legacy.execute("INSERT INTO comment_reads VALUES (1, 77, 500)")
+    legacy.commit()
+    legacy.close()
+
+    idx = LogIndex(db)
+    assert idx.needs_rebuild()
+    idx.rebuild(str(tmp_path / "dialogs.jsonl"), path)
+    rows = {r["comment"]: r["is_read"] for r in idx.list_comments(1, limit=10)}
+    assert rows == {"comment 0": 0, "comment 1": 1}
+    assert idx._version == SCHEMA_VERSION
+    idx.close()
+
+
+def test_thread_and_answer_lookup(tmp_path):
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = str(tmp_path / "dialogs.jsonl")
+    events = [
+        {"ts": 1, "user_id": 5, "chat_id": 50, "role": "user", "text": "q", "thread_id": "t1"},
+        {"ts": 2, "user_id": 5, "chat_id": 50, "role": "bot", "text": "a", "thread_id": "t1",
+         "meta": {"answer_id": "a1"}},
+    ]
+    idx.on_events(path, events, 1, [0, 100])
+    assert idx.lookup_thread("t1")["chat_id"] == 50
+    assert idx.lookup_thread("t1")["log_offset"] == 100
+    assert idx.lookup_answer("a1")["thread_id"] == "t1"
+    assert idx.lookup_answer("nope") is None
+    idx.close()
+
+
+def test_index_recovers_after_listener_failure(tmp_path):
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = str(tmp_path / "feedback.jsonl")
+    idx.rebuild(str(tmp_path / "dialogs.jsonl"), path)
+    writer = EventWriter(flush_interval=0.05, fsync=False, rotate_daily=False, rotate_max_bytes=300)
+    writer.add_listener(idx.on_events)
+    writer.start()
+    orig = idx._index_event
+
+    def crash_on_2(cur, name, event, seq, offset):
+        if event.get("comment") == "comment 2":
+            raise RuntimeError("listener killed")
+        return orig(cur, name, event, seq, offset)
+
+    for i in range(6):
+        idx._index_event = crash_on_2 if i == 2 else orig
+        writer.write(path, _comment(i))
+        writer.flush()
+    idx._index_event = orig
+    # Строка, дописанная мимо писателя (как send_outbox.py)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(_comment(6), ensure_ascii=False) + "\n")
+    writer.write(path, _comment(7))
+    writer.flush()
+    assert writer.errors == 1
+    assert _texts(idx) == ["comment %d" % i for i in range(8)]
+
+    # Слушатель отключён (бот упал между записью и индексом), потом перезапуск
+    writer.remove_listener(idx.on_events)
+    for i in range(8, 11):
+        writer.write(path, _comment(i))
+        writer.flush()
+    writer.close()
+    idx.close()
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    assert not idx.needs_rebuild()
+    assert idx.catch_up(str(tmp_path / "dialogs.jsonl"), path) == 3
+    assert _texts(idx) == sorted("comment %d" % i for i in range(11))
+    assert idx.catch_up(str(tmp_path / "dialogs.jsonl"), path) == 0
+    idx.close()
+
+
+def test_rerating_replaces_previous_rating_in_rollups(tmp_path):
+    from rollups import summarize
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = str(tmp_path / "feedback.jsonl")
+    rate = lambda ts, rating: {"ts": ts, "answer_id": "a1", "branch": "zsk", "rating": rating}
+    idx.on_events(path, [rate(1704067200, 2)], 1, [0])
+    idx.on_events(path, [rate(1704153600, 5), rate(1704153660, 4)], 1, [100, 200])
+    total = summarize(idx.rollup_rows("d"))["total"]
+    assert (total["r2"], total["r5"], total["r4"], total["avg_rating_1_5"]) == (0, 0, 1, 4.0)
+    idx.close()
+
+
+def test_inbox_filters_use_effective_rating_and_indexes(tmp_path):
+    idx = LogIndex(str(tmp_path / "index.sqlite3"))
+    path = str(tmp_path / "feedback.jsonl")
+    events = [
+        # комментарий без оценки, оценка ответа приходит позже
+        {"ts": 1704067200, "answer_id": "a1", "branch": "zsk", "comment": "без оценки"},
+        {"ts": 1704067260, "answer_id": "a1", "branch": "zsk", "rating": 2},
+        {"ts": 1704067320, "answer_id": "a2", "branch": "115fz", "rating": 5, "comment": "своя оценка"},
+    ]
+    idx.on_events(path, events, 1, [0, 100, 200])
+    low = lambda **kw: [c["comment"] for c in idx.list_comments(1, limit=10, **kw)]
+    assert low(max_rating=3) == ["без оценки"]
+    assert low(branch="115fz") == ["своя оценка"]
+    assert idx.list_comments(1, limit=10, max_rating=3)[0]["eff_rating"] == 2
+    # переоценка ответа меняет эффективную оценку его комментария
+    idx.on_events(path, [{"ts": 1704067380, "answer_id": "a1", "branch": "zsk", "rating": 5}], 1, [300])
+    assert low(max_rating=3) == []
+    with idx._lock:
+        names = {r[1] for r in idx._conn.execute("PRAGMA index_list(comments)").fetchall()}
+        plan = " ".join(str(r[-1]) for r in idx._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM comments c WHERE c.branch = 'zsk' ORDER BY c.ts DESC").fetchall())
+    assert {"comments_branch_ts", "comments_eff_rating_ts"} <= names
+    assert "comments_branch_ts" in plan
+    idx.close()
+
+
+def test_v6_index_gets_eff_rating_column_and_rebuilds(tmp_path):
+    db = str(tmp_path / "index.sqlite3")
+    conn = sqlite3.connect(db)
+    conn.executescript(
+        "CREATE TABLE comments (ts INTEGER, user_id INTEGER, chat_id INTEGER, thread_id TEXT, answer_id TEXT, "
+        "branch TEXT, rating INTEGER, comment TEXT, log_seq INTEGER, log_offset INTEGER, "
+        "PRIMARY KEY (log_seq, log_offset)); PRAGMA user_version = 6;")
+    conn.commit()
+    conn.close()
+    path = str(tmp_path / "feedback.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": 1704067200, "answer_id": "a1", "rating": 1, "comment": "плохо"},
+                           ensure_ascii=False) + "\n")
+    idx = LogIndex(db)
+    assert idx.needs_rebuild()
+    idx.rebuild(str(tmp_path / "dialogs.jsonl"), path)
+    assert [c["comment"] for c in idx.list_comments(1, max_rating=1)] == ["плохо"]
+    idx.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты scripts/mock_gigachat.py: OAuth, ответы целиком и потоком, внедряемые ошибки и лимит."""
+
+import json
+import time
+import urllib.error
+import urllib.request
+
+
+def _post(url, obj=None, headers=None):
+    data = json.dumps(obj or {}).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers=dict({"Content-Type": "application/json"}, **(headers or {})))
+    try:
+        with urllib.request.urlopen(req, timeout=5) as r:
+            return r.status, dict(r.headers), r.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read().decode("utf-8")
+
+
+def _token(server):
+    status, _, body = _post(server.url + "/api/v2/oauth", headers={"Authorization": "Basic bW9jaw=="})
+    assert status == 200
+    return json.loads(body)
+
+
+def _complete(server, token, **payload):
+    return _post(server.url + "/api/v1/chat/completions", dict({"model": "GigaChat-Pro"}, **payload),
+                 {"Authorization": "Bearer " + token})
+
+
+def _with_token(server):
+    return server, _token(server)["access_token"]
+
+
+def test_oauth_and_completions(mock_gigachat):
+    server = mock_gigachat("--answer-words", "5")
+    assert _post(server.url + "/api/v2/oauth")[0] == 401
+    tok = _token(server)
+    assert tok["expires_at"] > time.time() * 1000
+    status, _, body = _complete(server, tok["access_token"])
+    assert status == 200
+    obj = json.loads(body)
+    assert obj["model"] == "GigaChat-Pro"
+    assert len(obj["choices"][0]["message"]["content"].split()) == 5
+    assert _complete(server, "unknown")[0] == 401
+
+
+def test_stream_sends_sse_chunks_then_done(mock_gigachat):
+    server = mock_gigachat("--answer-words", "6", "--chunks", "3")
+    status, headers, body = _complete(server, _token(server)["access_token"], stream=True)
+    assert status == 200 and headers["Content-Type"] == "text/event-stream"
+    events = [line[len("data: "):] for line in body.split("\n") if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    parts = [json.loads(e)["choices"][0]["delta"]["content"] for e in events[:-1]]
+    assert len(parts) == 3 and len("".join(parts).split()) == 6
+
+
+def test_token_ttl_expires_token(mock_gigachat):
+    server = mock_gigachat("--token-ttl", "0.2")
+    tok = _token(server)["access_token"]
+    assert _complete(server, tok)[0] == 200
+    time.sleep(0.3)
+    assert _complete(server, tok)[0] == 401
+
+
+def test_injected_errors_and_rate_limit(mock_gigachat):
+    assert _complete(*_with_token(mock_gigachat("--error-rate", "1")))[0] == 500
+    assert _complete(*_with_token(mock_gigachat("--expire-rate", "1")))[0] == 401
+
+    server, tok = _with_token(mock_gigachat("--rps", "1"))
+    assert _complete(server, tok)[0] == 200
+    status, headers, _ = _complete(server, tok)
+    assert status == 429 and headers["Retry-After"] == "1"
+    with urllib.request.urlopen(server.url + "/stats", timeout=5) as r:
+        counters = json.loads(r.read().decode("utf-8"))
+    assert (counters["oauth"], counters["completions"], counters["rate_limited"]) == (1, 2, 1)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты model_router.py: выбор модели по правилам и статистика вызовов."""
+
+import json
+
+from model_router import ModelRouter, question_features
+
+
+def _router(**kw):
+    return ModelRouter("GigaChat", light_model="GigaChat-Lite", strong_model="GigaChat-Pro", **kw)
+
+
+def test_default_routes():
+    r = _router()
+    assert r.route(question_features("Что такое МВК?")) == ("GigaChat-Lite", "definition")
+    assert r.route(question_features("Счёт заблокирован", case_data={"step": 4})) == ("GigaChat-Pro", "case")
+    assert r.route(question_features("x" * 400)) == ("GigaChat-Pro", "long")
+    assert r.route(question_features("Как снять блок?", scores=[3.5, 1.0])) == ("GigaChat-Lite", "short_kb")
+    assert r.route(question_features("Как снять блок?", scores=[0.5])) == ("GigaChat-Pro", "default")
+
+
+def test_routes_from_file_and_tiers_default_to_main_model(tmp_path):
+    path = str(tmp_path / "routes.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"routes": [{"name": "tax", "branches": ["tax"], "model": "GigaChat-Max"},
+                              {"name": "rest", "tier": "light"}]}, f)
+    r = ModelRouter.from_file(path, "GigaChat")
+    assert r.route(question_features("налог", branch="tax")) == ("GigaChat-Max", "tax")
+    assert r.route(question_features("налог", branch="zsk")) == ("GigaChat", "rest")
+    assert ModelRouter.from_file(str(tmp_path / "missing.json"), "GigaChat").routes
+
+
+def test_stats_per_model():
+    r = _router()
+    r.route(question_features("Что такое МВК?"))
+    r.record("GigaChat-Lite", 1.0)
+    r.record("GigaChat-Lite", 3.0)
+    r.record("GigaChat-Lite", None, ok=False)
+    st = r.stats()["GigaChat-Lite"]
+    assert (st["calls"], st["errors"], st["p50"], st["p95"]) == (3, 1, 1.0, 3.0)
+    assert st["routes"] == {"definition": 1}
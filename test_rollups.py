@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Тесты rollups.py: корзины по часам и суткам UTC, merge и сводка."""
+
+from rollups import FIELDS, Rollups, summarize
+
+DAY = 1704067200  # 2024-01-01T00:00:00Z
+
+
+def _events():
+    return [
+        ("dialogs", {"ts": DAY + 10, "role": "user", "text": "q"}),
+        ("dialogs", {"ts": DAY + 20, "role": "bot", "meta": {"answer_id": "a", "branch": "zsk", "rag_used": True}}),
+        ("feedback", {"ts": "2024-01-01T23:59:59Z", "branch": "zsk", "rating": 4, "comment": "ok"}),
+        ("feedback", {"ts": "2024-01-02T00:00:00Z", "branch": "zsk", "rating": "6"}),
+        ("feedback", {"ts": None, "rating": 5}),
+    ]
+
+
+def _fill(events):
+    r = Rollups()
+    for name, e in events:
+        r.add(name, e)
+    return r
+
+
+def test_daily_buckets_are_utc_days():
+    rows = _fill(_events()).rows("d")
+    assert [(row[1], row[2]) for row in rows] == [(DAY, ""), (DAY, "zsk"), (DAY + 86400, "zsk")]
+    day1 = dict(zip(FIELDS, rows[1][3:]))
+    assert (day1["answers"], day1["rag_used"], day1["r4"], day1["comments"]) == (1, 1, 1, 1)
+    assert dict(zip(FIELDS, rows[2][3:]))["r6"] == 1
+
+
+def test_merge_of_parts_equals_single_pass():
+    events = _events()
+    whole = _fill(events)
+    parts = _fill(events[:2])
+    parts.merge(_fill(events[2:]))
+    assert parts.rows() == whole.rows()
+    assert Rollups.from_rows(whole.rows()).rows() == whole.rows()
+
+
+def test_summarize():
+    s = summarize(_fill(_events()).rows("d"))
+    assert s["total"]["messages"] == 1 and s["total"]["ratings_1_5"] == 1
+    assert s["branches"]["zsk"]["avg_rating_1_5"] == 4.0
+
+
+def _rerated():
+    return [
+        ("dialogs", {"ts": DAY + 20, "role": "bot", "meta": {"answer_id": "a", "branch": "zsk"}}),
+        ("dialogs", {"ts": DAY + 30, "role": "bot", "meta": {"answer_id": "b", "branch": "zsk"}}),
+        ("feedback", {"ts": "2024-01-01T10:00:00Z", "branch": "zsk", "answer_id": "a", "rating": 1}),
+        ("feedback", {"ts": "2024-01-02T10:00:00Z", "branch": "zsk", "answer_id": "a", "rating": 5}),
+        ("feedback", {"ts": "2024-01-02T11:00:00Z", "branch": "zsk", "answer_id": "b", "rating": 4}),
+    ]
+
+
+def test_rerating_counts_only_latest_rating():
+    events = _rerated()
+    whole = _fill(events)
+    s = summarize(whole.rows("d"))["total"]
+    assert (s["r1"], s["r4"], s["r5"], s["ratings_1_5"], s["avg_rating_1_5"]) == (0, 1, 1, 2, 4.5)
+    parts = _fill(events[:3])
+    parts.merge(_fill(events[3:]))
+    assert parts.rows() == whole.rows()
+
+
+def test_avg_rating_matches_dashboard_aggregate():
+    from dashboard_data import DashboardAggregate
+    agg = DashboardAggregate()
+    for name, e in _rerated():
+        (agg.add_dialog if name == "dialogs" else agg.add_feedback)(e)
+    stats, _ = agg.build()
+    assert summarize(agg.rollups.rows("d"))["total"]["avg_rating_1_5"] == stats["avg_rating_1_5"] == 4.5